@@ -1,16 +1,27 @@
-from io import BytesIO
+import asyncio
 import streamlit as st
 import os
 import uuid
-from datetime import datetime
-from PIL import Image
+from datetime import datetime, timedelta
 import time
 import json
 
 from config import settings
-from database import Database
+from database import GALLERY_PROJECTION, get_database
 from models import ImageRecord, FeedbackData
-from services.image_generator import ImageGenerator
+from services.admission import AdmissionRejected
+from services.image_generator import get_image_generator
+from services.job_worker import JobWorkerPool
+from services.image_codec import detect_format, extension_mime
+from services.export import write_export
+from services.gallery_view import GalleryView
+from services.image_store import delete_image, get_image_store
+from services.metrics import get_metrics, StageTimer
+from services.pending_store import get_pending_store
+from services.prompt_index import get_prompt_index
+from services.reconcile import REPORT_NAME as RECONCILE_REPORT, StorageReconciler
+from services.thumbnails import save_thumbnail
+from services.write_buffer import get_write_buffer
 
 # Page configuration
 st.set_page_config(
@@ -80,22 +91,142 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'geneall_images' not in st.session_state:
-    st.session_state.geneall_images = []
-if 'db' not in st.session_state:
-    st.session_state.db = Database()
-if 'image_generator' not in st.session_state:
-    st.session_state.image_generator = ImageGenerator()
+# Clients are shared by every session in this process
+st.session_state.db = get_database()
+st.session_state.image_generator = get_image_generator()
+st.session_state.db.check_health()
 
 if "view" not in st.session_state:
     st.session_state.view = "main"
-if "last_image" not in st.session_state:
-    st.session_state.last_image = None
+if "user_id" not in st.session_state:
+    # No accounts: each browser session is one user for fair scheduling
+    st.session_state.user_id = uuid.uuid4().hex
+if "last_image_ref" not in st.session_state:
+    # Reference into the pending image store; the image bytes never live in session state
+    st.session_state.last_image_ref = None
 if "last_prompt" not in st.session_state:
     st.session_state.last_prompt = ""
+if "pending_images" not in st.session_state:
+    st.session_state.pending_images = []
+if "last_job_id" not in st.session_state:
+    st.session_state.last_job_id = None
+if "jobs" not in st.session_state:
+    # Restore job ids from the URL so submitted jobs survive a page reload
+    st.session_state.jobs = [j for j in st.query_params.get("jobs", "").split(",") if j]
+
+for page_key in ("gallery_page", "history_page"):
+    if page_key not in st.session_state:
+        st.session_state[page_key] = {"cursor": None, "direction": "next"}
+if "history_search" not in st.session_state:
+    # Search text + filters the history paging state belongs to, and the ranked results offset
+    st.session_state.history_search = None
+    st.session_state.history_offset = 0
+
+
+@st.cache_resource
+def start_job_workers():
+    """Start the in-process job worker pool once per server process"""
+    pool = JobWorkerPool()
+    pool.start()
+    return pool
+
+
+@st.cache_resource
+def start_storage_reconciler():
+    """Start scheduled storage reconciliation once per server process"""
+    reconciler = StorageReconciler()
+    reconciler.start()
+    return reconciler
+
+
+def load_for_feedback(item: dict):
+    """Show a generated image in the feedback view; its bytes go to the pending store, not session state"""
+    ref = item.get("image_ref") or pending_store.put(item["image"])
+    if st.session_state.last_image_ref != ref:
+        # A previous image left without feedback is abandoned
+        pending_store.discard(st.session_state.last_image_ref)
+    st.session_state.last_image_ref = ref
+    st.session_state.last_prompt = item["prompt"]
+    st.session_state.style = item["style"]
+    st.session_state.generation_time = item["generation_time"]
+    st.session_state.generation_timings = item.get("timings")
+    st.session_state.last_job_id = item.get("job_id")
+    st.session_state.quality_tier = item.get("tier")
+    st.session_state.tier_times = item.get("tier_times") or {}
+
+
+def load_next_pending() -> bool:
+    """Load the next batch image that has not expired from the pending store"""
+    while st.session_state.pending_images:
+        item = st.session_state.pending_images.pop(0)
+        if pending_store.exists(item["image_ref"]):
+            load_for_feedback(item)
+            return True
+    return False
+
+
+def newest_gallery_page(limit: int) -> dict:
+    """The newest Gallery page from the session's view model, merged with what changed since it was last shown"""
+    view = st.session_state.get("gallery_view")
+    if view is not None and not view.needs_reload(limit):
+        view.apply(st.session_state.db.get_gallery_delta(view.watermark, view.synced_at, limit))
+    if view is None or view.needs_reload(limit):
+        view = st.session_state.gallery_view = GalleryView(
+            st.session_state.db.get_images_page(limit=limit), limit, GALLERY_PROJECTION
+        )
+    return view.page()
+
+
+def page_navigation(state_key: str, result: dict):
+    """Render Newer/Older buttons for a keyset-paginated page"""
+    col1, col2 = st.columns(2)
+    with col1:
+        if result["has_prev"] and st.button("⬅️ Newer", key=f"{state_key}_prev"):
+            st.session_state[state_key] = {"cursor": result["first"], "direction": "prev"}
+            st.rerun()
+    with col2:
+        if result["has_next"] and st.button("Older ➡️", key=f"{state_key}_next"):
+            st.session_state[state_key] = {"cursor": result["last"], "direction": "next"}
+            st.rerun()
+
+
+def filter_controls(key: str) -> dict:
+    """Style, rating and date range widgets; returns filters for Database history/export queries"""
+    styles = st.multiselect("Styles:", list(settings.STYLES.keys()), format_func=lambda x: x.title(), key=f"{key}_styles")
+    rated_only = st.checkbox("Only rated images", key=f"{key}_rated")
+    rating_range = st.slider("Rating:", 1, 10, (1, 10), disabled=not rated_only, key=f"{key}_rating")
+    date_range = st.date_input("Created between:", value=(), key=f"{key}_dates")
+
+    filters = {"styles": styles}
+    if rated_only:
+        filters["min_rating"], filters["max_rating"] = rating_range
+    if len(date_range) == 2:
+        filters["start"] = datetime.combine(date_range[0], datetime.min.time())
+        filters["end"] = datetime.combine(date_range[1] + timedelta(days=1), datetime.min.time())
+    return filters
+
+
+use_queue = (
+    settings.JOB_QUEUE_ENABLED
+    and st.session_state.db.collection is not None
+)
+if use_queue and settings.JOB_WORKERS > 0:
+    start_job_workers()
+if settings.RECONCILE_INTERVAL > 0 and st.session_state.db.collection is not None:
+    start_storage_reconciler()
+
+# Image storage backend (local sharded directory or GridFS)
+image_store = get_image_store()
+# Generated images waiting for feedback
+pending_store = get_pending_store()
+# Near-duplicate prompt index (None when reuse suggestions are disabled)
+prompt_index = get_prompt_index() if st.session_state.db.collection is not None else None
+
+
+def image_source(key: str):
+    """Local path of a stored image when available (served without loading it), else its bytes"""
+    return image_store.local_path(key) or image_store.load(key)
 
-# Create images directory
-os.makedirs(settings.IMAGES_DIR, exist_ok=True)
 
 if st.session_state.view == "main":
 
@@ -135,38 +266,214 @@ if st.session_state.view == "main":
 
     if page == "Generate Image":
         st.header("🎨 Generate Image")
+
+        mode = st.radio(
+            "Mode:",
+            ["Single prompt", "Multiple prompts", "One prompt, all styles"],
+            horizontal=True
+        )
+
+        # Requests to generate in this run, from the form or from "Generate anyway" below
+        run_requests, run_mode, run_tier = None, mode, None
+
+        # Existing images for a near-duplicate prompt, offered before paying for a new generation
+        offer = st.session_state.get("reuse_offer")
+        if offer and prompt_index is not None:
+            st.subheader("♻️ Similar images already exist")
+            st.caption(f"For “{offer['prompt'][:80]}” ({offer['style'].title()}). Reuse one instead of generating a new image?")
+            cols = st.columns(2)
+            for i, (similarity, image_id) in enumerate(offer["matches"]):
+                record = st.session_state.db.get_image(image_id)
+                if not record or record.get("file_state") or not image_store.exists(record["filename"]):
+                    continue
+                with cols[i % 2]:
+                    preview = record.get("thumbnail_filename") or record["filename"]
+                    st.image(image_source(preview), use_container_width=True)
+                    st.caption(f"{similarity*100:.0f}% similar · {record['prompt'][:60]}")
+                    if st.button("♻️ Use this image", key=f"reuse_{image_id}"):
+                        prompt_index.record_offer(reused=True)
+                        # Saved as a new record for this prompt; the blob itself is shared
+                        load_for_feedback({
+                            "image": image_store.load(record["filename"]),
+                            "prompt": offer["prompt"],
+                            "style": offer["style"],
+                            "generation_time": None,
+                        })
+                        st.session_state.reuse_offer = None
+                        st.session_state.view = "feedback"
+                        st.rerun()
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🚀 Generate anyway"):
+                    prompt_index.record_offer(reused=False)
+                    run_requests, run_mode = [(offer["prompt"], offer["style"])], "Single prompt"
+                    run_tier = offer["tier"]
+                    st.session_state.reuse_offer = None
+            with col2:
+                if st.button("✖️ Cancel"):
+                    st.session_state.reuse_offer = None
+                    st.rerun()
         
         with st.form("image_generation_form"):
             prompt = st.text_area(
-                "Describe your image:",
+                "Describe your image:" if mode != "Multiple prompts" else "Describe your images (one prompt per line):",
                 placeholder="A majestic dragon flying over a mystical forest at sunset...",
                 height=100
             )
             
-            style = st.selectbox(
-                "Art Style:",
-                options=list(settings.STYLES.keys()),
-                format_func=lambda x: x.title()
-            )
+            if mode != "One prompt, all styles":
+                style = st.selectbox(
+                    "Art Style:",
+                    options=list(settings.STYLES.keys()),
+                    format_func=lambda x: x.title()
+                )
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                quality = st.selectbox(
+                    "Quality:",
+                    options=list(settings.QUALITY_TIERS.keys()),
+                    index=list(settings.QUALITY_TIERS).index(settings.DEFAULT_QUALITY_TIER),
+                    format_func=lambda x: f"{x.title()} ({settings.QUALITY_TIERS[x]['width']}px)"
+                )
+            with col2:
+                preview_first = st.checkbox(
+                    "⚡ Preview first",
+                    help="Generate a fast draft now and refine only the ones you keep"
+                )
+            # A preview is a draft; "Refine" later regenerates it at REFINE_QUALITY_TIER
+            tier = run_tier or ("draft" if preview_first else quality)
             
-            submitted = st.form_submit_button("🚀 Generate Image")
+            submitted = st.form_submit_button("🚀 Generate Image" if mode == "Single prompt" else "🚀 Generate Images")
             
             if submitted and prompt:
+                if mode == "Multiple prompts":
+                    requests = [(line.strip(), style) for line in prompt.splitlines() if line.strip()]
+                elif mode == "One prompt, all styles":
+                    requests = [(prompt.strip(), s) for s in settings.STYLES]
+                else:
+                    requests = [(prompt, style)]
+                run_requests = requests
+
+                if mode == "Single prompt" and prompt_index is not None:
+                    matches = prompt_index.find(prompt, style)
+                    if matches:
+                        st.session_state.reuse_offer = {"prompt": prompt, "style": style, "tier": tier, "matches": matches}
+                        st.rerun()
+
+            if run_requests and use_queue and st.session_state.db.count_queued_jobs() + len(run_requests) > settings.ADMISSION_MAX_QUEUE:
+                # Fast rejection instead of an ever-growing backlog
+                st.warning("⏳ The generation queue is full right now. Please try again in a few minutes.")
+
+            elif run_requests and use_queue and (
+                st.session_state.db.count_queued_jobs(user_id=st.session_state.user_id) + len(run_requests)
+                > settings.ADMISSION_MAX_PER_USER
+            ):
+                # The same per-user cap the admission controller applies to direct generation
+                st.warning(
+                    f"⏳ At most {settings.ADMISSION_MAX_PER_USER} of your jobs can wait at once. "
+                    "Please submit more when some have finished."
+                )
+
+            elif run_requests and use_queue:
+                requests = run_requests
+                # Submit as background jobs; workers pick them up from MongoDB
+                for job_prompt, job_style in requests:
+                    image_id = str(uuid.uuid4())
+                    job = ImageRecord(
+                        id=image_id,
+                        prompt=job_prompt,
+                        expected_style=job_style,
+                        filename=f"{image_id}.png",
+                        created_at=datetime.now(),
+                        status="queued",
+                        quality_tier=tier,
+                        user_id=st.session_state.user_id
+                    )
+                    if st.session_state.db.enqueue_job(job):
+                        st.session_state.jobs.append(image_id)
+                st.query_params["jobs"] = ",".join(st.session_state.jobs)
+                st.success(f"✅ Queued {len(requests)} generation job(s). You can keep browsing while they run.")
+
+            elif run_requests and run_mode != "Single prompt":
+                requests = run_requests
+                st.info(f"🎨 Generating {len(requests)} images, up to {settings.GENERATION_CONCURRENCY} at a time...")
+                progress = st.progress(0.0)
+                cols = st.columns(2)
+                slots = [cols[i % 2].empty() for i in range(len(requests))]
+                results = [None] * len(requests)
+
+                async def stream_results():
+                    done = 0
+                    async for result in st.session_state.image_generator.generate_images(
+                        requests, tier=tier, user_id=st.session_state.user_id
+                    ):
+                        done += 1
+                        results[result["index"]] = result
+                        progress.progress(done / len(requests))
+                        with slots[result["index"]].container():
+                            if result["image"]:
+                                st.image(
+                                    result["image"],
+                                    caption=f"{result['prompt'][:50]} ({result['style'].title()}, {result['generation_time']:.1f}s)",
+                                    use_container_width=True
+                                )
+                            else:
+                                st.error(f"❌ {result['prompt'][:50]} ({result['style'].title()}): {result['error']}")
+
+                asyncio.run(stream_results())
+
+                # Queue successful results for feedback, in submission order
+                generated = [r for r in results if r and r["image"]]
+                st.session_state.pending_images.extend(
+                    {
+                        "image_ref": pending_store.put(r["image"]),
+                        "prompt": r["prompt"],
+                        "style": r["style"],
+                        "generation_time": r["generation_time"],
+                        "timings": r["timings"],
+                        "tier": tier,
+                        "tier_times": {tier: r["generation_time"]},
+                        "job_id": None,
+                    }
+                    for r in generated
+                )
+                st.success(f"✅ Generated {len(generated)} of {len(requests)} images!")
+
+            elif run_requests:
+                prompt, style = run_requests[0]
                 try:
                     with st.spinner("🎨 Generating your image... This may take 30-60 seconds."):
                         start_time = time.time()
+                        timer = StageTimer(style=style)
+                        queue_status = st.empty()
                         
-                        # Generate image
-                        image_data = st.session_state.image_generator.generate_image(prompt, style)
+                        # Generate image (waits for a provider slot when others are ahead)
+                        image_data = st.session_state.image_generator.generate_image(
+                            prompt, style, timer, tier,
+                            user_id=st.session_state.user_id,
+                            on_wait=lambda position, eta: queue_status.info(
+                                f"⏳ Waiting for the provider: position {position} in queue, about {eta:.0f}s"
+                            ),
+                        )
+                        queue_status.empty()
                         
                         # Calculate generation time
                         generation_time = time.time() - start_time
-                        st.session_state.generation_time = generation_time
+
+                        if image_data is None:
+                            raise RuntimeError("The provider did not return an image. Please try again.")
 
                         # Save in session state
-                        st.session_state.last_image = image_data
-                        st.session_state.last_prompt = prompt
-                        st.session_state.style=style
+                        load_for_feedback({
+                            "image": image_data,
+                            "prompt": prompt,
+                            "style": style,
+                            "generation_time": generation_time,
+                            "timings": dict(timer.stages),
+                            "tier": tier,
+                            "tier_times": {tier: generation_time},
+                        })
 
                         # Switch to feedback view
                         st.session_state.view = "feedback"
@@ -203,120 +510,458 @@ if st.session_state.view == "main":
                         # st.success(f"✅ Image generated successfully in {generation_time:.1f}s!")
                         # st.balloons()
                         
+                except AdmissionRejected as e:
+                    st.warning(f"⏳ {e}")
                 except Exception as e:
                     st.error(f"❌ Error generating image: {str(e)}")
             
             elif submitted and not prompt:
                 st.error("❌ Please enter a prompt description.")
 
+        if st.session_state.pending_images:
+            st.info(f"📝 {len(st.session_state.pending_images)} generated images are waiting for feedback.")
+            if st.button("📝 Rate Generated Images"):
+                if load_next_pending():
+                    st.session_state.view = "feedback"
+                else:
+                    st.warning("⌛ These images expired before they were rated.")
+                st.rerun()
+
+        if st.session_state.jobs:
+            @st.fragment(run_every=settings.JOB_POLL_INTERVAL)
+            def show_jobs():
+                st.subheader("⏳ Your Jobs")
+                jobs = st.session_state.db.get_jobs(st.session_state.jobs)
+
+                # Forget jobs that were rated or deleted elsewhere
+                active_ids = [job["id"] for job in jobs if not job.get("feedback_data")]
+                if active_ids != st.session_state.jobs:
+                    st.session_state.jobs = active_ids
+                    st.query_params["jobs"] = ",".join(active_ids)
+
+                cols = st.columns(2)
+                for i, job in enumerate(j for j in jobs if j["id"] in active_ids):
+                    with cols[i % 2]:
+                        st.markdown(f"**{job['prompt'][:60]}** · {job['expected_style'].title()}")
+                        if job["status"] == "completed":
+                            preview = job.get("thumbnail_filename") or job["filename"]
+                            if image_store.exists(preview):
+                                st.image(image_source(preview), use_container_width=True)
+                            tier = job.get("quality_tier") or settings.DEFAULT_QUALITY_TIER
+                            st.caption(f"✅ {tier.title()} completed in {job.get('generation_time') or 0:.1f}s")
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.button("📝 Rate", key=f"rate_{job['id']}"):
+                                    load_for_feedback({
+                                        "image": image_store.load(job["filename"]),
+                                        "prompt": job["prompt"],
+                                        "style": job["expected_style"],
+                                        "generation_time": job.get("generation_time"),
+                                        "job_id": job["id"],
+                                    })
+                                    st.session_state.view = "feedback"
+                                    st.rerun()
+                            with col2:
+                                # Keep the draft: regenerate it at full quality, replacing it when ready
+                                if tier == "draft" and st.button("✨ Refine", key=f"refine_{job['id']}"):
+                                    st.session_state.db.refine_job(job["id"], settings.REFINE_QUALITY_TIER)
+                        elif job["status"] == "failed":
+                            st.error(f"❌ {job.get('error') or 'Generation failed'}")
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.button("🔁 Retry", key=f"retry_{job['id']}"):
+                                    st.session_state.db.requeue_job(job["id"])
+                            with col2:
+                                if st.button("🗑️ Dismiss", key=f"dismiss_{job['id']}"):
+                                    delete_image(st.session_state.db, job["id"])
+                        elif job["status"] == "running":
+                            st.caption(f"🎨 Running (attempt {job.get('attempts', 1)})...")
+                        else:
+                            # Workers rotate between users, each user's jobs oldest first, within the provider quota
+                            ahead = st.session_state.db.queue_position(job.get("user_id"), job["created_at"])
+                            avg_time = st.session_state.db.get_statistics()["avg_generation_time"] or 30
+                            throughput = max(settings.JOB_WORKERS, 1) / avg_time
+                            if settings.ADMISSION_ENABLED:
+                                throughput = min(throughput, settings.PROVIDER_RATE_LIMIT / 60)
+                            st.caption(f"🕒 Queued · position {ahead + 1} · about {(ahead + 1) / throughput:.0f}s")
+
+            show_jobs()
+
     # with col2:
     elif page == "Gallery":
         st.header("📸 Image Gallery")
+
+        auto_refresh = st.toggle(
+            "🔄 Auto-refresh",
+            help=f"Check for new and removed images every {settings.GALLERY_REFRESH_INTERVAL:.0f}s"
+        )
+
+        @st.fragment(run_every=settings.GALLERY_REFRESH_INTERVAL if auto_refresh else None)
+        def show_gallery():
+            if st.session_state.gallery_page["cursor"] is None:
+                # Newest page: only what changed since the last view is fetched
+                result = newest_gallery_page(gallery_limit)
+            else:
+                result = st.session_state.db.get_images_page(limit=gallery_limit, **st.session_state.gallery_page)
+                if not result["has_prev"]:
+                    # Paged back to the newest images: refresh incrementally from here on
+                    st.session_state.gallery_page = {"cursor": None, "direction": "next"}
+            images = result["items"]
         
-        # Get images from database
-        images = st.session_state.db.get_images(limit=gallery_limit)
-        
-        if images:
-            # Display images in a grid
-            cols = st.columns(2)
+            if images:
+                # Display images in a grid
+                cols = st.columns(2)
             
-            for i, image in enumerate(images):
-                with cols[i % 2]:
-                    try:
-                        image_path = os.path.join(settings.IMAGES_DIR, image['filename'])
-                        if os.path.exists(image_path):
-                            # Display image348
-                            img = Image.open(image_path)
-                            st.image(img, use_container_width=True)
-                            
+                for i, image in enumerate(images):
+                    with cols[i % 2]:
+                        try:
+                            image_key = image['filename']
+                            # Display thumbnail; the full image is only loaded on demand. Records whose
+                            # files are gone are excluded by the query, so the store is not checked here
+                            st.image(image_source(image.get('thumbnail_filename') or image_key), use_container_width=True)
+
                             # Image info
                             with st.expander(f"📝 {image['prompt'][:50]}..."):
                                 st.markdown(f"**Prompt:** {image['prompt']}")
                                 st.markdown(f"**Style:** {image['expected_style'].title()}")
                                 st.markdown(f"**Created:** {image['created_at'].strftime('%Y-%m-%d %H:%M:%S')}")
-                                
+                            
                                 if image.get('generation_time'):
                                     st.markdown(f"**Generation Time:** {image['generation_time']:.1f}s")
-                                
+                            
                                 if image.get('file_size'):
                                     st.markdown(f"**File Size:** {image['file_size']/1024:.1f} KB")
-                                
+                            
+                                if image.get('file_state') == "evicted":
+                                    st.caption("🗄️ Full-size image was removed to stay within the storage quota")
+                                    continue
+
+                                # Full resolution view
+                                if st.toggle("🔍 Full size", key=f"full_{image['id']}"):
+                                    st.session_state.db.touch_image(image['id'])
+                                    st.image(image_source(image_key), use_container_width=True)
+                            
                                 # Download button
                                 if st.button(f"📥 Download", key=f"download_{image['id']}"):
-                                    with open(image_path, "rb") as file:
-                                        st.download_button(
-                                            label="💾 Download Image",
-                                            data=file.read(),
-                                            file_name=f"{image['prompt'][:30]}.png",
-                                            mime="image/png",
-                                            key=f"download_btn_{image['id']}"
-                                        )
-                    except Exception as e:
-                        st.error(f"Error loading image: {str(e)}")
-        else:
-            st.info("🎨 No images generated yet. Create your first image!")
+                                    st.session_state.db.touch_image(image['id'])
+                                    st.download_button(
+                                        label="💾 Download Image",
+                                        data=image_store.load(image_key),
+                                        file_name=f"{image['prompt'][:30]}{os.path.splitext(image_key)[1]}",
+                                        mime=extension_mime(image_key),
+                                        key=f"download_btn_{image['id']}"
+                                    )
+                        except Exception as e:
+                            st.error(f"Error loading image: {str(e)}")
+            else:
+                st.info("🎨 No images generated yet. Create your first image!")
+
+            page_navigation("gallery_page", result)
+
+        show_gallery()
+
+        # Bulk export: ZIP of images plus a JSONL manifest, streamed to disk in chunks
+        with st.expander("📦 Export images"):
+            export_filters = filter_controls("export")
+            if st.button("📦 Build export archive"):
+                os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+                export_path = os.path.join(settings.EXPORT_DIR, f"export-{datetime.now():%Y%m%d-%H%M%S}.zip")
+                with st.spinner("📦 Building archive..."):
+                    size = write_export(st.session_state.db, export_path, export_filters)
+                st.session_state.export_path = export_path
+                st.success(f"✅ Export ready ({size/1024/1024:.1f} MB)")
+
+            export_path = st.session_state.get("export_path")
+            if export_path and os.path.exists(export_path):
+                if os.path.getsize(export_path) <= settings.EXPORT_MAX_DOWNLOAD_BYTES:
+                    with open(export_path, "rb") as export_file:
+                        st.download_button(
+                            label="💾 Download export",
+                            data=export_file,
+                            file_name=os.path.basename(export_path),
+                            mime="application/zip",
+                        )
+                else:
+                    # Too large to hand through the browser session; fetch it from the server instead
+                    st.info(f"Archive saved on the server at `{export_path}`. For very large exports use `python manage.py export`.")
     
     elif page == "Prompt History":
         st.header("📝 Prompt History")
         
-        history = st.session_state.db.get_prompt_history()
+        search_text = st.text_input("🔍 Search prompts:", placeholder="dragon sunset")
+        with st.expander("Filters"):
+            filters = filter_controls("history")
+
+        # Start from the first page whenever the search or filters change
+        search_state = repr((search_text.strip(), filters))
+        if st.session_state.history_search != search_state:
+            st.session_state.history_search = search_state
+            st.session_state.history_page = {"cursor": None, "direction": "next"}
+            st.session_state.history_offset = 0
+
+        if search_text.strip():
+            result = st.session_state.db.search_prompts(
+                search_text.strip(), filters, limit=settings.HISTORY_PAGE_SIZE, offset=st.session_state.history_offset
+            )
+        else:
+            result = st.session_state.db.get_prompt_history_page(
+                limit=settings.HISTORY_PAGE_SIZE, filters=filters, **st.session_state.history_page
+            )
+        history = result["items"]
         
         if history:
             for item in history:
-                with st.expander(f"📅 {item['created_at'].strftime('%Y-%m-%d %H:%M')}"):
+                with st.expander(f"📅 {item['created_at'].strftime('%Y-%m-%d %H:%M')} - {item['prompt'][:60]}"):
                     st.markdown(f"**Prompt:** {item['prompt']}")
                     st.markdown(f"**Style:** {item['expected_style'].title()}")
+                    rating = (item.get('feedback_data') or {}).get('rating')
+                    if rating is not None:
+                        st.markdown(f"**Rating:** {rating}/10")
+                    if 'score' in item:
+                        st.caption(f"Relevance: {item['score']:.2f}")
+        elif search_text.strip() or any(filters.values()):
+            st.info("🔍 No prompts match your search.")
         else:
             st.info("📝 No prompt history available.")
+
+        if search_text.strip():
+            # Ranked results are paged by offset
+            col1, col2 = st.columns(2)
+            with col1:
+                if result["has_prev"] and st.button("⬅️ Previous", key="history_search_prev"):
+                    st.session_state.history_offset = max(0, result["offset"] - settings.HISTORY_PAGE_SIZE)
+                    st.rerun()
+            with col2:
+                if result["has_next"] and st.button("Next ➡️", key="history_search_next"):
+                    st.session_state.history_offset = result["offset"] + settings.HISTORY_PAGE_SIZE
+                    st.rerun()
+        else:
+            page_navigation("history_page", result)
     
     elif page == "Statistics":
         st.header("📊 Statistics")
         
         if st.session_state.db.collection is not None:
-            # Get all images for statistics
-            all_images = st.session_state.db.get_images(limit=1000)
+            # Aggregated server-side over the full collection
+            stats = st.session_state.db.get_statistics()
             
-            if all_images:
-                # Style distribution
-                style_counts = {}
-                total_generation_time = 0
-                total_file_size = 0
-                
-                for img in all_images:
-                    style = img['expected_style']
-                    style_counts[style] = style_counts.get(style, 0) + 1
-                    
-                    if img.get('generation_time'):
-                        total_generation_time += img['generation_time']
-                    
-                    if img.get('file_size'):
-                        total_file_size += img['file_size']
-                
+            if stats["total"]:
                 # Display metrics
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
-                    st.metric("Total Images", len(all_images))
+                    st.metric("Total Images", stats["total"])
                 
                 with col2:
-                    avg_time = total_generation_time / len(all_images) if all_images else 0
-                    st.metric("Avg Generation Time", f"{avg_time:.1f}s")
+                    st.metric("Avg Generation Time", f"{stats['avg_generation_time']:.1f}s")
                 
                 with col3:
-                    avg_size = total_file_size / len(all_images) if all_images else 0
-                    st.metric("Avg File Size", f"{avg_size/1024:.1f} KB")
+                    st.metric("Avg File Size", f"{stats['avg_file_size']/1024:.1f} KB")
                 
                 # Style distribution chart
                 st.subheader("🎨 Style Distribution")
-                st.bar_chart(style_counts)
+                st.bar_chart(stats["style_counts"])
                 
                 # Recent activity
                 st.subheader("📅 Recent Activity")
-                recent_images = all_images[:5]
+                recent_images = st.session_state.db.get_images(limit=5)
                 for img in recent_images:
                     st.markdown(f"• **{img['created_at'].strftime('%Y-%m-%d %H:%M')}** - {img['prompt'][:50]}...")
             else:
                 st.info("📊 No data available for statistics.")
+
+            # Per-stage latency breakdown
+            st.subheader("⏱️ Stage Latency")
+            latencies = st.session_state.db.get_stage_latencies()
+            if latencies["overall"]:
+                style_filter = st.selectbox(
+                    "Style:",
+                    ["All styles"] + sorted(latencies["by_style"]),
+                    format_func=lambda x: x.title()
+                )
+                stages = latencies["overall"] if style_filter == "All styles" else latencies["by_style"][style_filter]
+                st.dataframe(
+                    [
+                        {"Stage": stage, **{name: f"{value:.3f}s" for name, value in values.items()}}
+                        for stage, values in sorted(stages.items(), key=lambda item: -item[1]["p50"])
+                    ],
+                    use_container_width=True,
+                    hide_index=True
+                )
+            else:
+                st.info("⏱️ No timing data recorded yet.")
+
+            if latencies["by_tier"]:
+                st.markdown("**Generation time by quality tier**")
+                st.dataframe(
+                    [
+                        {"Tier": tier.title(), **{name: f"{value:.1f}s" for name, value in latencies["by_tier"][tier].items()}}
+                        for tier in settings.QUALITY_TIERS
+                        if tier in latencies["by_tier"]
+                    ],
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+            exposition = get_metrics().render()
+            if exposition:
+                with st.expander("📈 Metrics export (Prometheus text format)"):
+                    st.code(exposition, language="text")
+
+            # Shared MongoDB connection pool
+            st.subheader("🔌 MongoDB Connection Pool")
+            pool = st.session_state.db.pool_metrics()
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("In Use", f"{pool['checked_out']} / {pool['max_pool_size']}")
+            with col2:
+                st.metric("Open Connections", pool['connections_open'])
+            with col3:
+                st.metric("Checkouts", pool['checkouts'])
+            with col4:
+                st.metric("Checkout Failures", pool['checkout_failures'])
+
+            # Generated images waiting for feedback, held outside session state
+            st.subheader("📥 Pending Feedback Images")
+            pending_stats = pending_store.stats()
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Waiting", pending_stats['pending'])
+            with col2:
+                st.metric("On Disk", f"{pending_stats['bytes']/1024/1024:.1f} MB")
+            with col3:
+                st.metric("Expired (abandoned)", pending_stats['expired'])
+
+            # Write-behind buffer for image records
+            write_buffer = get_write_buffer()
+            if write_buffer is not None:
+                st.subheader("📝 Write Buffer")
+                buffer_stats = write_buffer.stats()
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Pending", buffer_stats['pending'])
+                with col2:
+                    st.metric("Written / Batches", f"{buffer_stats['written']} / {buffer_stats['batches']}")
+                with col3:
+                    st.metric("Retries", buffer_stats['retries'])
+                with col4:
+                    st.metric("Spilled (awaiting replay)", f"{buffer_stats['spilled']} ({buffer_stats['spill_files']} files)")
+
+            # Admission control in front of the provider
+            admission = st.session_state.image_generator.admission
+            if admission is not None:
+                st.subheader("🚦 Provider Admission")
+                admission_stats = admission.stats()
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Quota", f"{admission_stats['rate_per_minute']:.0f}/min")
+                with col2:
+                    st.metric("Waiting (users)", f"{admission_stats['waiting']} ({admission_stats['users_waiting']})")
+                with col3:
+                    st.metric("Admitted / Rejected", f"{admission_stats['admitted']} / {admission_stats['rejected']}")
+                with col4:
+                    st.metric("Avg Wait", f"{admission_stats['avg_wait']:.1f}s")
+
+            # Near-duplicate prompt reuse
+            if prompt_index is not None:
+                st.subheader("♻️ Prompt Reuse")
+                reuse_stats = prompt_index.stats()
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Indexed Prompts", reuse_stats['prompts'])
+                with col2:
+                    st.metric("Offers", reuse_stats['offered'])
+                with col3:
+                    st.metric("Reused / Generated", f"{reuse_stats['reused']} / {reuse_stats['generated']}")
+                with col4:
+                    st.metric("Reuse Rate", f"{reuse_stats['reuse_rate']*100:.1f}%")
+
+            # Query-result cache for Database reads
+            query_cache = st.session_state.db.query_cache
+            if query_cache is not None:
+                st.subheader("🗄️ Query Cache")
+                query_stats = query_cache.stats()
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Hit Rate", f"{query_stats['hit_rate']*100:.1f}%")
+                with col2:
+                    st.metric("Hits / Misses", f"{query_stats['hits']} / {query_stats['misses']}")
+                with col3:
+                    st.metric("Invalidations", query_stats['invalidations'])
+                with col4:
+                    st.metric("Entries", query_stats['entries'])
+
+            # Result cache counters
+            cache = st.session_state.image_generator.cache
+            if cache is not None:
+                st.subheader("⚡ Result Cache")
+                cache_stats = cache.stats()
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Hit Rate", f"{cache_stats['hit_rate']*100:.1f}%")
+                with col2:
+                    st.metric("Hits / Misses", f"{cache_stats['hits']} / {cache_stats['misses']}")
+                with col3:
+                    st.metric("Evictions", cache_stats['evictions'] + cache_stats['disk_evictions'])
+                with col4:
+                    st.metric("Disk Usage", f"{cache_stats['disk_bytes']/1024/1024:.1f} MB")
+
+            # Identical requests served by one in-flight provider call
+            single_flight = st.session_state.image_generator.single_flight
+            if single_flight is not None:
+                st.subheader("🔗 Request Coalescing")
+                flight_stats = single_flight.stats()
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Provider Calls", flight_stats['executions'])
+                with col2:
+                    st.metric("Coalesced Requests", flight_stats['coalesced'])
+                with col3:
+                    st.metric("Coalesced Rate", f"{flight_stats['coalesced_rate']*100:.1f}%")
+
+            # Latest storage reconciliation (orphan cleanup, missing files, quota eviction)
+            reconcile_report = st.session_state.db.get_maintenance_report(RECONCILE_REPORT)
+            if reconcile_report:
+                st.subheader("🧹 Storage")
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    quota = reconcile_report['quota_bytes']
+                    st.metric(
+                        "Stored",
+                        f"{reconcile_report['stored_bytes']/1024/1024:.0f} MB"
+                        + (f" / {quota/1024/1024:.0f} MB" if quota else "")
+                    )
+                with col2:
+                    st.metric("Reclaimed", f"{reconcile_report['reclaimed_bytes']/1024/1024:.1f} MB")
+                with col3:
+                    st.metric("Orphans / Evicted", f"{reconcile_report['orphans_deleted']} / {reconcile_report['evicted']}")
+                with col4:
+                    st.metric("Missing Files", reconcile_report['marked_missing'])
+                st.caption(
+                    f"Last run {reconcile_report['started_at'].strftime('%Y-%m-%d %H:%M:%S')} "
+                    f"in {reconcile_report['duration']:.1f}s · eviction policy: {reconcile_report['policy'].replace('_', ' ')}"
+                )
+
+            # Provider routing, when several endpoints are configured
+            router_stats = st.session_state.image_generator.router_stats()
+            if router_stats:
+                st.subheader("🛰️ Provider Endpoints")
+                st.dataframe(
+                    [
+                        {
+                            "Endpoint": endpoint["endpoint"],
+                            "Circuit": endpoint["state"],
+                            "p50 Latency": f"{endpoint['p50_latency']:.2f}s",
+                            "Error Rate": f"{endpoint['error_rate']*100:.1f}%",
+                            "Requests": endpoint["requests"],
+                            "Wins": endpoint["wins"],
+                        }
+                        for endpoint in router_stats
+                    ],
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.caption(f"Hedged requests: {st.session_state.image_generator.client.hedged_requests}")
         else:
             st.error("❌ Database not connected.")
 
@@ -324,51 +969,33 @@ if st.session_state.view == "main":
         st.header("📝 Evaluation Report")
 
         if st.session_state.db.collection is not None:
-            # ✅ Get all images that have feedback
-            all_images = st.session_state.db.get_images(limit=1000)
+            # ✅ Aggregate ratings of all images that have feedback
+            report = st.session_state.db.get_rating_report()
 
-
-            if all_images:
+            if report["count"]:
                 st.subheader("📈 Overall Prompt to Image Feedback")
 
-                # Collect ratings
-                ratings = [img["feedback_data"]["rating"] for img in all_images]
-
-                if ratings:
-                    avg_rating = sum(ratings) / len(ratings)
-                    st.metric("Average Rating", f"{avg_rating:.2f}/10")
-                    st.metric("Model generates expected images", f"{avg_rating/10*100:.1f}%")
-                    st.metric("Total Rated Images", len(ratings))
-
-                    # Distribution of ratings
-                    from collections import Counter
-                    rating_counts = Counter(ratings)
-                    st.bar_chart(rating_counts)
-
-                    # OPTIONAL: Group ratings by style
-                    st.subheader("🎨 Rating by Style")
-                    style_scores = {}
-                    style_counts = {}
-                    for img in all_images:
-                        style = img.get('expected_style', 'Unknown')
-                        rating = img.get('feedback_data')['rating']
-                        if isinstance(rating, (int, float)):
-                            style_scores[style] = style_scores.get(style, 0) + rating
-                            style_counts[style] = style_counts.get(style, 0) + 1
-                    style_avgs = {s: style_scores[s]/style_counts[s] for s in style_scores}
-                    st.bar_chart(style_avgs)
-
-                    # Recent rated images
-                    st.subheader("📅 Recent Ratings")
-                    for img in all_images[:5]:
-                        st.markdown(
-                            f"**{img['created_at'].strftime('%Y-%m-%d %H:%M')}** | "
-                            f"Prompt: *{img['prompt'][:80]}*... "
-                            f"Style: **{img['expected_style']}** | "
-                            f"Rating: ⭐ {img["feedback_data"]["rating"]}/10"
-                        )
-                else:
-                    st.info("✅ No valid feedback ratings found.")
+                avg_rating = report["avg_rating"]
+                st.metric("Average Rating", f"{avg_rating:.2f}/10")
+                st.metric("Model generates expected images", f"{avg_rating/10*100:.1f}%")
+                st.metric("Total Rated Images", report["count"])
+
+                # Distribution of ratings
+                st.bar_chart(report["histogram"])
+
+                # OPTIONAL: Group ratings by style
+                st.subheader("🎨 Rating by Style")
+                st.bar_chart(report["style_avgs"])
+
+                # Recent rated images
+                st.subheader("📅 Recent Ratings")
+                for img in st.session_state.db.get_images(limit=5, rated_only=True):
+                    st.markdown(
+                        f"**{img['created_at'].strftime('%Y-%m-%d %H:%M')}** | "
+                        f"Prompt: *{img['prompt'][:80]}*... "
+                        f"Style: **{img['expected_style']}** | "
+                        f"Rating: ⭐ {img["feedback_data"]["rating"]}/10"
+                    )
             else:
                 st.info("🖼️ No images with feedback available.")
         else:
@@ -378,15 +1005,51 @@ if st.session_state.view == "main":
         
 
 if st.session_state.view == "feedback":
-    # get last image from the session state
-    image_data = st.session_state.last_image
-    image_stream = BytesIO(image_data)
+    # The session only holds a reference; the image itself is in the pending store
+    image_ref = st.session_state.last_image_ref
     generation_time = st.session_state.generation_time
+    if not pending_store.exists(image_ref):
+        # Nothing to rate (a stale session, or the image expired); never hand None to st.image
+        st.session_state.last_image_ref = None
+        st.session_state.view = "main"
+        st.rerun()
+    pending_store.touch(image_ref)
 
     st.title("📝 Feedback")
     st.write("Prompt:")
     st.markdown(f"> **{st.session_state.last_prompt}**")
-    st.image(Image.open(image_stream), caption="Generated Image", width=512)
+    quality_tier = st.session_state.get("quality_tier")
+    st.image(
+        pending_store.path(image_ref),
+        caption=f"Generated Image ({quality_tier.title()})" if quality_tier else "Generated Image",
+        width=512
+    )
+
+    if quality_tier == "draft" and not st.session_state.last_job_id:
+        # Preview-then-refine: only drafts worth keeping are generated at full quality
+        refine_tier = settings.REFINE_QUALITY_TIER
+        if st.button(f"✨ Refine to {refine_tier.title()}"):
+            with st.spinner(f"✨ Generating the {refine_tier} version..."):
+                start_time = time.time()
+                timer = StageTimer(style=st.session_state.style)
+                try:
+                    refined = st.session_state.image_generator.generate_image(
+                        st.session_state.last_prompt, st.session_state.style, timer, refine_tier,
+                        user_id=st.session_state.user_id
+                    )
+                except AdmissionRejected as e:
+                    st.warning(f"⏳ {e}")
+                    refined = None
+            if refined:
+                pending_store.discard(image_ref)
+                st.session_state.last_image_ref = pending_store.put(refined)
+                st.session_state.generation_time = time.time() - start_time
+                st.session_state.generation_timings = dict(timer.stages)
+                st.session_state.quality_tier = refine_tier
+                st.session_state.tier_times[refine_tier] = st.session_state.generation_time
+                st.rerun()
+            else:
+                st.error("❌ Refining failed; you can still keep the draft.")
 
     rating = st.slider("How well does this image match your expectations? (1–10)", 1, 10, 5)
     comment = st.text_area("Optional comments")
@@ -405,41 +1068,80 @@ if st.session_state.view == "feedback":
         #     df = pd.DataFrame([feedback_data])
         # df.to_csv("feedback.csv", index=False)
 
-        # Save image
-        image_id = str(uuid.uuid4())
-        filename = f"{image_id}.png"
-        filepath = os.path.join(settings.IMAGES_DIR, filename)
-        
-        with open(filepath, "wb") as f:
-            f.write(image_data)
-        
-        # Get file size
-        file_size = os.path.getsize(filepath)
-        
-        # Create record
-        image_record = ImageRecord(
-            id=image_id,
-            prompt=st.session_state.last_prompt,
-            expected_style=st.session_state.style,
-            filename=filename,
-            created_at=datetime.now(),
-            generation_time=generation_time,
-            status="completed",
-            file_size=file_size,
-            feedback_data=feedback_data
-        )
-        
-        # Save to database
-        st.session_state.db.save_image_record(image_record)
+        if st.session_state.last_job_id:
+            # Image and record were already stored by the job worker
+            st.session_state.db.save_feedback(st.session_state.last_job_id, feedback_data)
+            st.session_state.last_job_id = None
+        else:
+            # Read only now; it was touched above, so the TTL sweep cannot have removed it
+            image_data = pending_store.get(image_ref)
+
+            # Continue the stage breakdown started during generation
+            timer = StageTimer(style=st.session_state.style)
+            timer.stages.update(st.session_state.get("generation_timings") or {})
+
+            # Save image
+            image_id = str(uuid.uuid4())
+            # Content-addressed: identical outputs share one stored blob
+            with timer.span("file_write"):
+                filename = image_store.save(image_data, detect_format(image_data)[1])
+            
+            # File size is known from the bytes already in memory
+            file_size = len(image_data)
+            with timer.span("thumbnail"):
+                thumb_name = save_thumbnail(image_data)
+            
+            # Create record
+            image_record = ImageRecord(
+                id=image_id,
+                prompt=st.session_state.last_prompt,
+                expected_style=st.session_state.style,
+                filename=filename,
+                created_at=datetime.now(),
+                generation_time=generation_time,
+                status="completed",
+                file_size=file_size,
+                thumbnail_filename=thumb_name,
+                timings=timer.stages,
+                quality_tier=st.session_state.get("quality_tier"),
+                tier_times=st.session_state.get("tier_times") or None,
+                feedback_data=feedback_data
+            )
+            
+            # Save to database
+            write_buffer = get_write_buffer()
+            if write_buffer is not None:
+                # Written in the background in batches; the record carries its own db_write_queue timing
+                write_buffer.submit(image_record)
+            else:
+                with timer.span("db_insert"):
+                    saved = st.session_state.db.save_image_record(image_record)
+                if saved:
+                    st.session_state.db.record_timing(image_id, "db_insert", timer.stages["db_insert"])
+            if prompt_index is not None:
+                prompt_index.add(image_id, image_record.prompt, image_record.expected_style)
         
         # st.success(f"✅ Image generated successfully in {generation_time:.1f}s!")
         # st.balloons()
 
-        st.success("✅ Feedback saved! Returning to main page...")
-        # Switch back
-        st.session_state.view = "main"
+        # Stored (or reused) as a record now; the pending copy is no longer needed
+        pending_store.discard(image_ref)
+        st.session_state.last_image_ref = None
+        if load_next_pending():
+            # Move on to the next image from the batch
+            st.success("✅ Feedback saved! Loading next image...")
+        else:
+            st.success("✅ Feedback saved! Returning to main page...")
+            # Switch back
+            st.session_state.view = "main"
         st.rerun()
 
+    if st.session_state.pending_images:
+        st.caption(f"{len(st.session_state.pending_images)} more images waiting for feedback")
+        if st.button("⏭️ Skip to main page"):
+            st.session_state.view = "main"
+            st.rerun()
+
 # Footer
 st.markdown("---")
 st.markdown("""
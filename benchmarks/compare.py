@@ -0,0 +1,38 @@
+"""Compare two benchmark result files: python -m benchmarks.compare base.json head.json"""
+import sys
+import json
+import argparse
+
+
+def load(path: str) -> tuple:
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(r["name"], r["size"]): r for r in report["results"]}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "min_ms"])
+    parser.add_argument("--threshold", type=float, default=1.10, help="Ratio above which a result counts as a regression")
+    args = parser.parse_args(argv)
+
+    base_report, base = load(args.base)
+    head_report, head = load(args.head)
+    print(f"{base_report.get('revision')} -> {head_report.get('revision')} ({args.metric})")
+
+    regressions = 0
+    for key in sorted(set(base) & set(head), key=lambda k: (k[0], k[1] or 0)):
+        before, after = base[key][args.metric], head[key][args.metric]
+        ratio = after / before if before else float("inf")
+        flag = "⚠️ " if ratio > args.threshold else "  "
+        regressions += ratio > args.threshold
+        name, size = key
+        print(f"{flag}{name:<40} size={size!s:<8} {before:10.2f} -> {after:10.2f} ms  x{ratio:.2f}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
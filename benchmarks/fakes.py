@@ -0,0 +1,94 @@
+import time
+import random
+import hashlib
+import threading
+from io import BytesIO
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+
+
+class FakeInferenceClient:
+    """Offline stand-in for huggingface_hub.InferenceClient.
+
+    `text_to_image` sleeps for a configurable latency and returns a lazily
+    opened image, like the real client does with the provider response.
+    Encoded images are cached per size, so the fake itself costs no CPU.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        width: int = 1024,
+        height: int = 1024,
+        image_format: str = "PNG",
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.width = width
+        self.height = height
+        self.image_format = image_format
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+        self._random = random.Random(seed)
+        self._encoded: Dict[Tuple[int, int], bytes] = {}
+        self._lock = threading.Lock()
+
+    def _encoded_image(self, width: int, height: int) -> bytes:
+        with self._lock:
+            if (width, height) not in self._encoded:
+                image = Image.effect_noise((width, height), 64).convert("RGB")
+                buffer = BytesIO()
+                image.save(buffer, format=self.image_format)
+                self._encoded[(width, height)] = buffer.getvalue()
+            return self._encoded[(width, height)]
+
+    def text_to_image(self, prompt: str, model: Optional[str] = None, **kwargs) -> Image.Image:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.failure_rate
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("Fake provider failure")
+
+        data = self._encoded_image(kwargs.get("width") or self.width, kwargs.get("height") or self.height)
+        return Image.open(BytesIO(data))
+
+
+def synthetic_records(count: int, filenames, start: Optional[float] = None):
+    """Yield `count` ImageRecord-shaped documents, newest last"""
+    rng = random.Random(count)
+    styles = list(settings.STYLES)
+    words = ["dragon", "forest", "sunset", "city", "robot", "ocean", "castle", "neon", "portrait", "mountain",
+             "cat", "galaxy", "flower", "desert", "train", "rain", "garden", "knight", "ship", "lantern"]
+    start = start if start is not None else time.time() - count
+
+    for i in range(count):
+        image_id = hashlib.md5(f"{count}-{i}".encode()).hexdigest()
+        style = styles[i % len(styles)]
+        filename = filenames[i % len(filenames)] if filenames else f"{image_id}.png"
+        yield {
+            "id": image_id,
+            "prompt": " ".join(rng.choice(words) for _ in range(rng.randint(3, 12))),
+            "expected_style": style,
+            "filename": filename,
+            "created_at": datetime.fromtimestamp(start + i),
+            "generation_time": rng.uniform(5, 60),
+            "status": "completed",
+            "file_size": rng.randint(200_000, 2_000_000),
+            "thumbnail_filename": None,
+            "feedback_data": {"rating": rng.randint(1, 10), "comment": None} if rng.random() < 0.8 else None,
+            "error": None,
+            "attempts": 1,
+            "worker_id": None,
+            "started_at": None,
+            "lease_expires_at": None,
+        }
@@ -0,0 +1,317 @@
+"""Offline benchmark suite.
+
+Times the data layer, image storage, the generator (against a fake
+provider) and a headless render of every app page, for collections of
+synthetic ImageRecords of increasing size, and writes the results as JSON.
+
+    python -m benchmarks.run --sizes 10000,100000,1000000 --output bench.json
+    python -m benchmarks.run --mongo-url mongodb://localhost:27017/   # real server
+    python -m benchmarks.compare old.json new.json
+
+Without --mongo-url an in-process mongomock client is used.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from config import settings
+
+# Keep benchmarks self-contained: no background workers, no caches hiding query/provider cost
+settings.JOB_WORKERS = 0
+settings.RESULT_CACHE_ENABLED = False
+settings.QUERY_CACHE_ENABLED = False
+# The fake provider has no quota to protect
+settings.ADMISSION_ENABLED = False
+
+import database  # noqa: E402
+from database import Database  # noqa: E402
+from services import image_generator, image_store  # noqa: E402
+from services.image_generator import ImageGenerator  # noqa: E402
+from services.image_store import LocalImageStore  # noqa: E402
+from services.job_worker import JobWorkerPool  # noqa: E402
+from models import ImageRecord  # noqa: E402
+from services.prompt_index import PromptIndex  # noqa: E402
+from services.provider_router import Endpoint, ProviderRouter  # noqa: E402
+from benchmarks.fakes import FakeInferenceClient, synthetic_records  # noqa: E402
+
+PAGES = ["Generate Image", "Gallery", "Prompt History", "Statistics", "Evaluation Report"]
+
+
+def measure(name: str, fn: Callable, repeat: int, size: Optional[int] = None, warmup: int = 1) -> dict:
+    """Run fn repeatedly and summarize wall-clock timings in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    result = {
+        "name": name,
+        "size": size,
+        "repeat": repeat,
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_ms": timings[0],
+        "max_ms": timings[-1],
+    }
+    print(f"  {name:<40} size={size!s:<8} p50={result['p50_ms']:9.2f}ms  p95={result['p95_ms']:9.2f}ms")
+    return result
+
+
+def make_client(mongo_url: Optional[str]):
+    if mongo_url:
+        from pymongo import MongoClient
+        return MongoClient(mongo_url)
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("mongomock is not installed; install it or pass --mongo-url")
+    return mongomock.MongoClient()
+
+
+def seed(db: Database, size: int, filenames: List[str], batch_size: int = 10_000):
+    """Replace the collection contents with `size` synthetic records"""
+    db.collection.delete_many({})
+    db.stats_collection.delete_many({})
+    batch = []
+    for record in synthetic_records(size, filenames):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            db.collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.collection.insert_many(batch, ordered=False)
+    db.ensure_indexes()
+
+
+def bench_data_layer(db: Database, size: int, repeat: int) -> List[dict]:
+    results = [
+        measure("db.get_images(limit=20)", lambda: db.get_images(limit=20), repeat, size),
+        measure("db.get_images_page(first)", lambda: db.get_images_page(limit=20), repeat, size),
+        measure("db.count_images", db.count_images, repeat, size),
+        measure("db.get_statistics", db.get_statistics, repeat, size),
+        measure("db.get_rating_report", db.get_rating_report, repeat, size),
+    ]
+
+    # A deep page: cursor halfway through the collection
+    middle = db.collection.find({}, {"created_at": 1, "id": 1}).sort("created_at", 1).skip(size // 2).limit(1)
+    middle = next(iter(middle), None)
+    if middle:
+        cursor = (middle["created_at"], middle["id"])
+        results.append(measure("db.get_images_page(deep)", lambda: db.get_images_page(limit=20, cursor=cursor), repeat, size))
+
+    # Unbounded history is expensive at large sizes; fewer repetitions
+    results.append(measure("db.get_prompt_history", db.get_prompt_history, max(1, repeat // 5), size, warmup=0))
+    results.append(measure("db.get_prompt_history_page", lambda: db.get_prompt_history_page(limit=25), repeat, size))
+    filters = {"styles": ["realistic", "fantasy"], "min_rating": 7}
+    results.append(measure(
+        "db.get_prompt_history_page(filtered)",
+        lambda: db.get_prompt_history_page(limit=25, filters=filters), repeat, size,
+    ))
+    # $text needs a real server; mongomock has no text search
+    if not type(db.client).__module__.startswith("mongomock"):
+        results.append(measure(
+            "db.search_prompts", lambda: db.search_prompts("dragon forest", filters, limit=25), repeat, size
+        ))
+    # Near-duplicate prompt index: one full build, then lookups
+    index = PromptIndex(db)
+    results.append(measure("prompt_index.build", lambda: PromptIndex(db).refresh(force=True), 1, size, warmup=0))
+    index.refresh(force=True)
+    results.append(measure(
+        "prompt_index.find", lambda: index.find("Sunset over the dragon forest, castle", "realistic"), repeat, size
+    ))
+    return results
+
+
+def bench_storage(store: LocalImageStore, image_data: bytes, repeat: int) -> List[dict]:
+    keys = []
+
+    def save_unique():
+        # Vary one byte past the header so every save writes a new blob
+        data = image_data[:64] + os.urandom(8) + image_data[72:]
+        keys.append(store.save(data, "png"))
+
+    results = [
+        measure("store.save(unique)", save_unique, repeat),
+        measure("store.save(duplicate)", lambda: store.save(image_data, "png"), repeat),
+    ]
+    key = store.save(image_data, "png")
+    results.append(measure("store.load", lambda: store.load(key), repeat))
+    for k in keys:
+        store.delete(k)
+    return results
+
+
+def bench_generator(client: FakeInferenceClient, repeat: int, batch: int) -> List[dict]:
+    generator = ImageGenerator(client=client)
+
+    async def run_batch():
+        async for _ in generator.generate_images([(f"prompt {i}", "realistic") for i in range(batch)]):
+            pass
+
+    async def run_identical_batch():
+        async for _ in generator.generate_images([("a trending prompt", "realistic")] * batch):
+            pass
+
+    return [
+        measure("generator.generate_image", lambda: generator.generate_image("a red dragon", "fantasy"), repeat),
+        measure(f"generator.generate_images(batch={batch})", lambda: asyncio.run(run_batch()), max(1, repeat // 5)),
+        # Single-flight coalesces these into one provider call each round
+        measure(f"generator.generate_images(identical={batch})", lambda: asyncio.run(run_identical_batch()), max(1, repeat // 5)),
+    ]
+
+
+def bench_job_queue(db: Database, client: FakeInferenceClient, repeat: int) -> List[dict]:
+    """Enqueue -> claim -> JobWorkerPool.process round trips, checking that every job completes"""
+    pool = JobWorkerPool(num_workers=0, db=db, image_generator=ImageGenerator(client=client))
+    tier = "draft"
+
+    def round_trip():
+        image_id = str(uuid.uuid4())
+        db.enqueue_job(ImageRecord(
+            id=image_id,
+            prompt=f"queued prompt {image_id}",
+            expected_style="realistic",
+            filename=f"{image_id}.png",
+            created_at=datetime.now(),
+            quality_tier=tier,
+        ))
+        job = db.claim_next_job("bench-worker", settings.JOB_LEASE_SECONDS, settings.JOB_MAX_ATTEMPTS)
+        pool.process(job, "bench-worker")
+        record = db.get_image(image_id)
+        # A job that does not complete would otherwise only show up as a fast benchmark
+        if record["status"] != "completed" or tier not in (record.get("tier_times") or {}):
+            raise RuntimeError(f"Job {image_id} ended {record['status']} with tier_times={record.get('tier_times')}")
+
+    return [measure("job_worker.process(round trip)", round_trip, repeat)]
+
+
+def bench_router(latency: float, repeat: int) -> List[dict]:
+    """Tail latency of a jittery endpoint alone vs. routed with hedging onto a second one"""
+    def endpoints():
+        return [
+            Endpoint("fake", "jittery", FakeInferenceClient(latency=latency, jitter=latency * 10, width=64, height=64, seed=1)),
+            Endpoint("fake", "steady", FakeInferenceClient(latency=latency * 2, width=64, height=64, seed=2)),
+        ]
+
+    single = endpoints()[0].client
+    hedged = ProviderRouter(endpoints(), hedge_delay=latency * 3)
+    failing = ProviderRouter([
+        Endpoint("fake", "down", FakeInferenceClient(latency=latency, failure_rate=1.0, width=64, height=64)),
+        Endpoint("fake", "up", FakeInferenceClient(latency=latency, width=64, height=64)),
+    ], hedge_delay=0)
+    return [
+        measure("provider.single(jittery)", lambda: single.text_to_image("a red dragon"), repeat),
+        measure("router.hedged", lambda: hedged.text_to_image("a red dragon"), repeat),
+        measure("router.failover", lambda: failing.text_to_image("a red dragon"), repeat),
+    ]
+
+
+def bench_pages(size: int, repeat: int) -> List[dict]:
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("  streamlit not installed, skipping page renders")
+        return []
+
+    app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+    results = []
+    for page in PAGES:
+        def render():
+            app = AppTest.from_file(app_path, default_timeout=120)
+            app.run()
+            if page != PAGES[0]:
+                app.sidebar.selectbox[0].set_value(page).run()
+            if app.exception:
+                raise RuntimeError(f"{page} raised: {app.exception[0].value}")
+        results.append(measure(f"page.render({page})", render, repeat, size))
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated collection sizes")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions per measurement")
+    parser.add_argument("--mongo-url", help="Benchmark a real MongoDB instead of mongomock")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake provider latency in seconds")
+    parser.add_argument("--image-size", type=int, default=1024, help="Fake provider image width/height")
+    parser.add_argument("--batch", type=int, default=16, help="Batch size for generate_images")
+    parser.add_argument("--skip-pages", action="store_true", help="Skip headless page renders")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    settings.DATABASE_NAME = f"benchmark_{os.getpid()}"
+    settings.IMAGES_DIR = os.path.join(workdir, "images")
+
+    # Inject offline stand-ins as the process-wide instances used by app.py
+    client = make_client(args.mongo_url)
+    db = Database(client=client)
+    fake_client = FakeInferenceClient(latency=args.latency, width=args.image_size, height=args.image_size, seed=0)
+    store = LocalImageStore(settings.IMAGES_DIR)
+    database.set_database(db)
+    image_generator.set_image_generator(ImageGenerator(client=fake_client))
+    image_store.set_image_store(store)
+
+    # A few distinct, valid images shared by all synthetic records (as deduplicated blobs would be)
+    image_data = fake_client._encoded_image(args.image_size, args.image_size)
+    filenames = [
+        store.save(fake_client._encoded_image(args.image_size - i, args.image_size - i), "png")
+        for i in range(8)
+    ]
+
+    print(f"Benchmarking generator (latency={args.latency}s, {args.image_size}px)")
+    results = bench_generator(fake_client, args.repeat, args.batch)
+    print("Benchmarking provider routing")
+    results += bench_router(args.latency, args.repeat)
+    print("Benchmarking image storage")
+    results += bench_storage(store, image_data, args.repeat)
+    print("Benchmarking the job queue")
+    results += bench_job_queue(db, fake_client, args.repeat)
+
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        print(f"Seeding {size} records")
+        seed(db, size, filenames)
+        results += bench_data_layer(db, size, args.repeat)
+        if not args.skip_pages:
+            results += bench_pages(size, max(1, args.repeat // 5))
+
+    if args.mongo_url:
+        client.drop_database(settings.DATABASE_NAME)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "mongo": "server" if args.mongo_url else "mongomock",
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Session memory soak test.
+
+Drives many simulated browser sessions through generate -> feedback with
+Streamlit's headless AppTest harness and a fake provider, keeping every
+session alive like idle tabs, and reports the server's peak RSS and the
+memory each session adds.
+
+    python -m benchmarks.soak --sessions 300 --abandon 0.5 --output soak.json
+
+`--abandon` is the fraction of sessions left on the feedback view with an
+unrated image (the tabs whose memory used to grow with image size).
+"""
+import gc
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+from config import settings
+
+# One in-process server: generate directly (no job queue) and keep caches out of the measurement
+settings.JOB_QUEUE_ENABLED = False
+settings.PROMPT_REUSE_ENABLED = False
+settings.WRITE_BEHIND_ENABLED = False
+settings.RECONCILE_INTERVAL = 0
+
+from benchmarks.run import git_revision, make_client  # noqa: E402
+import database  # noqa: E402
+from database import Database  # noqa: E402
+from services import image_generator, image_store, pending_store  # noqa: E402
+from services.image_generator import ImageGenerator  # noqa: E402
+from services.image_store import LocalImageStore  # noqa: E402
+from services.pending_store import PendingImageStore  # noqa: E402
+from benchmarks.fakes import FakeInferenceClient  # noqa: E402
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_session(app_path: str, index: int, rate: bool):
+    """Open one session, generate an image and (optionally) submit feedback; returns the live AppTest"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(app_path, default_timeout=120)
+    app.run()
+    app.text_area[0].input(f"soak test prompt {index}")
+    next(button for button in app.button if button.label.startswith("🚀")).click().run()
+    if app.exception:
+        raise RuntimeError(f"Session {index} raised: {app.exception[0].value}")
+    if app.session_state.view != "feedback":
+        raise RuntimeError(f"Session {index} did not reach the feedback view")
+    if rate:
+        next(button for button in app.button if button.label == "Submit Feedback").click().run()
+        if app.exception:
+            raise RuntimeError(f"Session {index} raised on feedback: {app.exception[0].value}")
+    return app
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200, help="Simulated sessions to open")
+    parser.add_argument("--abandon", type=float, default=0.5, help="Fraction of sessions left unrated")
+    parser.add_argument("--mongo-url", help="Use a real MongoDB instead of mongomock")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake provider latency in seconds")
+    parser.add_argument("--image-size", type=int, default=1024, help="Fake provider image width/height")
+    parser.add_argument("--report-every", type=int, default=50, help="Print progress every N sessions")
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        sys.exit("streamlit is not installed")
+
+    workdir = tempfile.mkdtemp(prefix="soak-")
+    settings.DATABASE_NAME = f"soak_{os.getpid()}"
+    settings.IMAGES_DIR = os.path.join(workdir, "images")
+
+    # Inject offline stand-ins as the process-wide instances used by app.py
+    client = make_client(args.mongo_url)
+    database.set_database(Database(client=client))
+    fake_client = FakeInferenceClient(latency=args.latency, width=args.image_size, height=args.image_size, seed=0)
+    image_generator.set_image_generator(ImageGenerator(client=fake_client))
+    image_store.set_image_store(LocalImageStore(settings.IMAGES_DIR))
+    pending_store.set_pending_store(PendingImageStore(os.path.join(workdir, "pending")))
+
+    app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+    # Warm up imports, caches and the fake provider's encoded image before taking the baseline
+    run_session(app_path, -1, rate=True)
+    gc.collect()
+    baseline = current_rss()
+
+    sessions = []
+    started = time.perf_counter()
+    samples = []
+    for i in range(args.sessions):
+        # Spread the abandoned sessions evenly over the run
+        abandoned = int((i + 1) * args.abandon) > int(i * args.abandon)
+        sessions.append(run_session(app_path, i, rate=not abandoned))
+        if (i + 1) % args.report_every == 0 or i + 1 == args.sessions:
+            gc.collect()
+            rss = current_rss()
+            samples.append({"sessions": i + 1, "rss": rss})
+            print(f"  {i + 1:>5} sessions  RSS {rss/1024/1024:8.1f} MB  (+{(rss - baseline)/(i + 1)/1024:.1f} KB/session)")
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    final = current_rss()
+    pending = pending_store.get_pending_store().stats()
+    abandoned = sum(1 for app in sessions if app.session_state.view == "feedback")
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "sessions": len(sessions),
+        "abandoned": abandoned,
+        "elapsed": elapsed,
+        "sessions_per_second": len(sessions) / elapsed if elapsed else 0.0,
+        "baseline_rss": baseline,
+        "final_rss": final,
+        "peak_rss": peak_rss(),
+        "rss_per_session": (final - baseline) / len(sessions) if sessions else 0.0,
+        "pending_images": pending["pending"],
+        "pending_bytes": pending["bytes"],
+        "samples": samples,
+    }
+    print(
+        f"{len(sessions)} sessions ({abandoned} unrated) in {elapsed:.1f}s: "
+        f"peak RSS {report['peak_rss']/1024/1024:.1f} MB, "
+        f"{report['rss_per_session']/1024:.1f} KB per session, "
+        f"{pending['pending']} pending images ({pending['bytes']/1024/1024:.1f} MB) on disk"
+    )
+
+    if args.mongo_url:
+        client.drop_database(settings.DATABASE_NAME)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote results to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
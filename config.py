@@ -1,21 +1,147 @@
 import os
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class Settings:
     # MongoDB
     MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://localhost:27017/")
     DATABASE_NAME: str = os.getenv("DATABASE_NAME", "image_generation")
     COLLECTION_NAME: str = os.getenv("COLLECTION_NAME", "generated_images")
+    STATS_COLLECTION_NAME: str = os.getenv("STATS_COLLECTION_NAME", "image_stats")
+    # Ids of changed/deleted image records, for incremental Gallery refreshes; entries expire after the TTL
+    CHANGES_COLLECTION_NAME: str = os.getenv("CHANGES_COLLECTION_NAME", "image_changes")
+    CHANGE_LOG_TTL: float = float(os.getenv("CHANGE_LOG_TTL", "86400"))
+    # Keep a running stats document up to date on every write instead of aggregating on read
+    STATS_MATERIALIZED: bool = os.getenv("STATS_MATERIALIZED", "false").lower() == "true"
+    ENSURE_INDEXES: bool = os.getenv("ENSURE_INDEXES", "true").lower() == "true"
+    MONGO_MAX_POOL_SIZE: int = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+    MONGO_MIN_POOL_SIZE: int = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+    MONGO_CONNECT_TIMEOUT_MS: int = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+    MONGO_SOCKET_TIMEOUT_MS: int = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+    MONGO_HEALTH_CHECK_INTERVAL: float = float(os.getenv("MONGO_HEALTH_CHECK_INTERVAL", "30"))
     
     # Hugging Face
     HF_API_TOKEN: str = os.getenv("HF_TOKEN", "")
     HF_API_URL: str = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0")
+    HF_TIMEOUT: float = float(os.getenv("HF_TIMEOUT", "120"))
+    # Optional "provider:model,provider:model" list; when set, requests are routed across these endpoints
+    PROVIDER_ENDPOINTS: str = os.getenv("PROVIDER_ENDPOINTS", "")
+    # Seconds to wait on the fastest endpoint before hedging on the next one (0 disables hedging)
+    ROUTER_HEDGE_DELAY: float = float(os.getenv("ROUTER_HEDGE_DELAY", "15"))
+    ROUTER_MAX_HEDGES: int = int(os.getenv("ROUTER_MAX_HEDGES", "1"))
+    ROUTER_WINDOW: int = int(os.getenv("ROUTER_WINDOW", "50"))
+    ROUTER_FAILURE_THRESHOLD: int = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+    ROUTER_ERROR_RATE: float = float(os.getenv("ROUTER_ERROR_RATE", "0.5"))
+    ROUTER_COOLDOWN: float = float(os.getenv("ROUTER_COOLDOWN", "30"))
     
     # App
     IMAGES_DIR: str = "generated_images"
+    # Image storage: "local" (sharded directory under IMAGES_DIR) or "gridfs"
+    IMAGE_STORE_BACKEND: str = os.getenv("IMAGE_STORE_BACKEND", "local").lower()
+    IMAGE_STORE_SHARD_DEPTH: int = int(os.getenv("IMAGE_STORE_SHARD_DEPTH", "2"))
+    GRIDFS_BUCKET: str = os.getenv("GRIDFS_BUCKET", "images")
+    # PNG, WEBP, JPEG, or AUTO to keep whatever format the provider returns
+    OUTPUT_FORMAT: str = os.getenv("OUTPUT_FORMAT", "PNG").upper()
+    OUTPUT_QUALITY: int = int(os.getenv("OUTPUT_QUALITY", "90"))
+    OUTPUT_LOSSLESS: bool = os.getenv("OUTPUT_LOSSLESS", "false").lower() == "true"
+    # Exports: bytes read from the store per chunk; larger archives are offered as a file path only
+    EXPORT_CHUNK_SIZE: int = int(os.getenv("EXPORT_CHUNK_SIZE", str(1024 * 1024)))
+    EXPORT_DIR: str = os.getenv("EXPORT_DIR", "exports")
+    EXPORT_MAX_DOWNLOAD_BYTES: int = int(os.getenv("EXPORT_MAX_DOWNLOAD_MB", "500")) * 1024 * 1024
+    # Storage reconciliation: orphan cleanup, missing-file marking and quota eviction every RECONCILE_INTERVAL
+    # seconds (0 = only via `python manage.py reconcile`); blobs newer than the grace period are never removed
+    RECONCILE_INTERVAL: float = float(os.getenv("RECONCILE_INTERVAL", "3600"))
+    RECONCILE_BATCH_SIZE: int = int(os.getenv("RECONCILE_BATCH_SIZE", "500"))
+    RECONCILE_GRACE_PERIOD: float = float(os.getenv("RECONCILE_GRACE_PERIOD", "3600"))
+    # 0 = no quota; full-size images are evicted by policy above it, thumbnails and records are kept
+    STORAGE_QUOTA_BYTES: int = int(os.getenv("STORAGE_QUOTA_MB", "0")) * 1024 * 1024
+    # "least_recently_viewed", "lowest_rated" or "oldest"
+    EVICTION_POLICY: str = os.getenv("EVICTION_POLICY", "least_recently_viewed").lower()
+    # Generated images awaiting feedback live here, not in session state; unread ones expire after the TTL
+    PENDING_IMAGE_DIR: str = os.getenv("PENDING_IMAGE_DIR", ".cache/pending")
+    PENDING_IMAGE_TTL: float = float(os.getenv("PENDING_IMAGE_TTL", "21600"))
+    PENDING_SWEEP_INTERVAL: float = float(os.getenv("PENDING_SWEEP_INTERVAL", "300"))
+    # Gallery: newest page is refreshed from deltas; auto-refresh polls every GALLERY_REFRESH_INTERVAL seconds
+    GALLERY_REFRESH_INTERVAL: float = float(os.getenv("GALLERY_REFRESH_INTERVAL", "10"))
+    # Look-back for records written after newer ones (write-behind batches, clock skew between processes)
+    GALLERY_REFRESH_LAG: float = float(os.getenv("GALLERY_REFRESH_LAG", "30"))
+    HISTORY_PAGE_SIZE: int = int(os.getenv("HISTORY_PAGE_SIZE", "25"))
+    THUMBNAIL_SIZE: int = int(os.getenv("THUMBNAIL_SIZE", "384"))
+    THUMBNAIL_QUALITY: int = int(os.getenv("THUMBNAIL_QUALITY", "75"))
+
+    # Write-behind buffer for image records: flushed with insert_many by size or interval
+    WRITE_BEHIND_ENABLED: bool = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+    WRITE_BATCH_SIZE: int = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+    WRITE_FLUSH_INTERVAL: float = float(os.getenv("WRITE_FLUSH_INTERVAL", "1"))
+    WRITE_BUFFER_MAX: int = int(os.getenv("WRITE_BUFFER_MAX", "10000"))
+    # "majority" or a number of acknowledging members
+    WRITE_CONCERN_W: str = os.getenv("WRITE_CONCERN_W", "1")
+    WRITE_CONCERN_JOURNAL: bool = os.getenv("WRITE_CONCERN_JOURNAL", "false").lower() == "true"
+    WRITE_RETRY_ATTEMPTS: int = int(os.getenv("WRITE_RETRY_ATTEMPTS", "5"))
+    WRITE_RETRY_MAX_DELAY: float = float(os.getenv("WRITE_RETRY_MAX_DELAY", "5"))
+    # Batches that still fail after retrying are written here and replayed later
+    WRITE_SPILL_DIR: str = os.getenv("WRITE_SPILL_DIR", ".cache/write_spill")
+
+    # Batch generation
+    GENERATION_CONCURRENCY: int = int(os.getenv("GENERATION_CONCURRENCY", "4"))
+    GENERATION_TIMEOUT: float = float(os.getenv("GENERATION_TIMEOUT", "120"))
     
+    # Admission control in front of the provider: global token bucket, fair per-user queues
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    PROVIDER_RATE_LIMIT: float = float(os.getenv("PROVIDER_RATE_LIMIT", "60"))  # requests per minute
+    PROVIDER_BURST: float = float(os.getenv("PROVIDER_BURST", "5"))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+    ADMISSION_MAX_PER_USER: int = int(os.getenv("ADMISSION_MAX_PER_USER", "20"))
+    ADMISSION_TIMEOUT: float = float(os.getenv("ADMISSION_TIMEOUT", "300"))
+
+    # Background job queue
+    JOB_QUEUE_ENABLED: bool = os.getenv("JOB_QUEUE_ENABLED", "true").lower() == "true"
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+
+    # Metrics: "prometheus" (served on METRICS_PORT when set), "otel" or "none"
+    METRICS_EXPORTER: str = os.getenv("METRICS_EXPORTER", "prometheus").lower()
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+    STAGE_LATENCY_SAMPLE: int = int(os.getenv("STAGE_LATENCY_SAMPLE", "5000"))
+
+    # Query-result cache for repeated Database reads across reruns and sessions
+    QUERY_CACHE_ENABLED: bool = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+    QUERY_CACHE_TTL: float = float(os.getenv("QUERY_CACHE_TTL", "10"))
+    QUERY_CACHE_MAX_ENTRIES: int = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+
+    # Offer existing images for near-duplicate prompts (word-set Jaccard similarity) before generating
+    PROMPT_REUSE_ENABLED: bool = os.getenv("PROMPT_REUSE_ENABLED", "true").lower() == "true"
+    PROMPT_REUSE_THRESHOLD: float = float(os.getenv("PROMPT_REUSE_THRESHOLD", "0.8"))
+    PROMPT_INDEX_PERMUTATIONS: int = int(os.getenv("PROMPT_INDEX_PERMUTATIONS", "64"))
+    PROMPT_INDEX_BANDS: int = int(os.getenv("PROMPT_INDEX_BANDS", "16"))
+    PROMPT_INDEX_REFRESH: float = float(os.getenv("PROMPT_INDEX_REFRESH", "5"))
+    PROMPT_INDEX_LAG: float = float(os.getenv("PROMPT_INDEX_LAG", "600"))
+
+    # Result cache
+    RESULT_CACHE_ENABLED: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MEMORY_ITEMS: int = int(os.getenv("RESULT_CACHE_MEMORY_ITEMS", "64"))
+    RESULT_CACHE_DIR: str = os.getenv("RESULT_CACHE_DIR", ".cache/results")
+    RESULT_CACHE_DISK_MAX_BYTES: int = int(os.getenv("RESULT_CACHE_DISK_MAX_MB", "512")) * 1024 * 1024
+    # Concurrent identical requests wait on one provider call instead of each making their own
+    SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    
+    # Quality tiers: provider parameters per tier, fastest first
+    QUALITY_TIERS = {
+        "draft": {"width": 512, "height": 512, "num_inference_steps": 12},
+        "standard": {"width": 768, "height": 768, "num_inference_steps": 25},
+        "final": {"width": 1024, "height": 1024, "num_inference_steps": 40},
+    }
+    DEFAULT_QUALITY_TIER: str = os.getenv("DEFAULT_QUALITY_TIER", "final")
+    # Tier that "Refine" regenerates a draft preview at
+    REFINE_QUALITY_TIER: str = os.getenv("REFINE_QUALITY_TIER", "final")
+
     # Style options
     STYLES = {
         "realistic": "photorealistic, high quality, detailed, 8k resolution",
@@ -25,4 +151,17 @@ class Settings:
         "abstract": "abstract art, artistic, creative, modern art"
     }
 
-settings = Settings()
\ No newline at end of file
+def _validate_tiers(settings: Settings):
+    """Fall back to the highest tier when a tier setting names no configured tier"""
+    for name in ("DEFAULT_QUALITY_TIER", "REFINE_QUALITY_TIER"):
+        tier = getattr(settings, name)
+        if tier not in settings.QUALITY_TIERS:
+            fallback = list(settings.QUALITY_TIERS)[-1]
+            logger.error(
+                f"{name}={tier!r} is not one of {', '.join(settings.QUALITY_TIERS)}; using {fallback!r}"
+            )
+            setattr(settings, name, fallback)
+
+
+settings = Settings()
+_validate_tiers(settings)
\ No newline at end of file
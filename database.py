@@ -1,40 +1,277 @@
+import time
+import functools
+import threading
 import pymongo
+from pymongo import ReturnDocument, WriteConcern, monitoring
+from pymongo.errors import BulkWriteError
 from pymongo.mongo_client import MongoClient
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Set, Tuple
 import logging
 from config import settings
 
-from models import ImageRecord
+from models import ImageRecord, FeedbackData
+from services.metrics import percentiles
+from services.query_cache import get_query_cache
 
 logger = logging.getLogger(__name__)
 
-class Database:
+STATS_DOCUMENT_ID = "global"
+
+# Indexes required by the query methods below: (name, keys, options)
+INDEXES = [
+    ("created_at_desc", [("created_at", pymongo.DESCENDING)], {}),
+    ("id_unique", [("id", pymongo.ASCENDING)], {"unique": True}),
+    ("status_created_at_id", [
+        ("status", pymongo.ASCENDING),
+        ("created_at", pymongo.DESCENDING),
+        ("id", pymongo.DESCENDING),
+    ], {}),
+    ("status_style_created_at", [
+        ("status", pymongo.ASCENDING),
+        ("expected_style", pymongo.ASCENDING),
+        ("created_at", pymongo.DESCENDING),
+    ], {}),
+    ("filename", [("filename", pymongo.ASCENDING)], {}),
+    ("thumbnail_filename", [("thumbnail_filename", pymongo.ASCENDING)], {"sparse": True}),
+    ("status_rating_created_at", [
+        ("status", pymongo.ASCENDING),
+        ("feedback_data.rating", pymongo.ASCENDING),
+        ("created_at", pymongo.DESCENDING),
+    ], {}),
+    # Quota eviction under the default least_recently_viewed policy
+    ("status_last_viewed_created_at", [
+        ("status", pymongo.ASCENDING),
+        ("last_viewed_at", pymongo.ASCENDING),
+        ("created_at", pymongo.ASCENDING),
+    ], {}),
+    # Prompt search; status is an equality prefix so searches only touch completed records
+    ("status_prompt_text", [
+        ("status", pymongo.ASCENDING),
+        ("prompt", pymongo.TEXT),
+    ], {"default_language": "english"}),
+]
+
+# Indexes replaced by an entry in INDEXES; dropped by ensure_indexes so old deployments do not keep them
+SUPERSEDED_INDEXES = [
+    "status_created_at",  # extended with id as status_created_at_id
+]
+
+HISTORY_PROJECTION = {"id": 1, "prompt": 1, "expected_style": 1, "created_at": 1, "feedback_data.rating": 1}
+
+# Fields the Gallery renders; its session view model keeps only these
+GALLERY_PROJECTION = {
+    "_id": 0, "id": 1, "prompt": 1, "expected_style": 1, "created_at": 1, "generation_time": 1,
+    "file_size": 1, "filename": 1, "thumbnail_filename": 1, "file_state": 1,
+}
+
+# Order in which quota eviction gives up full-size images (never viewed / unrated first)
+EVICTION_SORTS = {
+    "least_recently_viewed": [("last_viewed_at", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)],
+    "lowest_rated": [("feedback_data.rating", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)],
+    "oldest": [("created_at", pymongo.ASCENDING)],
+}
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts connection pool events of the shared MongoClient"""
+
     def __init__(self):
-        self.client = None
+        self._lock = threading.Lock()
+        self.counters = {
+            "connections_open": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "pool_clears": 0,
+        }
+
+    def _add(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self.counters[key] += delta
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(connections_created=1, connections_open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(connections_closed=1, connections_open=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(checkouts=1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+
+pool_metrics = PoolMetrics()
+_shared_client: Optional[MongoClient] = None
+_shared_database = None
+_shared_lock = threading.RLock()
+
+
+def get_mongo_client() -> MongoClient:
+    """Return the process-wide MongoClient (connection pool shared by all sessions)"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = MongoClient(
+                settings.MONGODB_URL,
+                maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+                event_listeners=[pool_metrics],
+            )
+        return _shared_client
+
+
+_query_state = threading.local()
+
+
+def _uncached(fallback):
+    """Return a read method's error fallback, keeping @cached_query from caching it"""
+    _query_state.failed = True
+    return fallback
+
+
+def cached_query(method):
+    """Serve a read method from the shared query cache, keyed by method name and arguments.
+
+    Results returned through `_uncached` (empty fallbacks after a MongoDB
+    error) are not stored, so one transient error is not served to every
+    session for the whole TTL.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self.query_cache
+        if cache is None or self.collection is None:
+            return method(self, *args, **kwargs)
+
+        key = repr((method.__name__, args, sorted(kwargs.items())))
+        found, value = cache.get(key)
+        if found:
+            return value
+        generation = cache.generation
+        outer_failed = getattr(_query_state, "failed", False)
+        _query_state.failed = False
+        try:
+            value = method(self, *args, **kwargs)
+            if not _query_state.failed:
+                cache.put(key, value, generation)
+        finally:
+            _query_state.failed = outer_failed or _query_state.failed
+        return value
+    return wrapper
+
+
+def invalidates_queries(method):
+    """Drop cached read results after a write method runs"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            if self.query_cache is not None:
+                self.query_cache.invalidate()
+    return wrapper
+
+
+class Database:
+    def __init__(self, client: Optional[MongoClient] = None):
+        self.client = client
+        self.query_cache = get_query_cache()
         self.db = None
         self.collection = None
+        self.stats_collection = None
+        self.changes_collection = None
+        self._last_health_check = 0.0
+        self._health_lock = threading.Lock()
         self.connect()
     
     def connect(self):
         """Connect to MongoDB"""
         try:
             # print(f"Mongo URL: {settings.MONGODB_URL}")
-            self.client = MongoClient(settings.MONGODB_URL)
-            self.db = self.client[settings.DATABASE_NAME]
-            self.collection = self.db[settings.COLLECTION_NAME]
+            if self.client is None:
+                self.client = get_mongo_client()
             
             # Test connection
             self.client.admin.command('ping')
+            self._last_health_check = time.monotonic()
+
+            self.db = self.client[settings.DATABASE_NAME]
+            self.stats_collection = self.db[settings.STATS_COLLECTION_NAME]
+            self.changes_collection = self.db[settings.CHANGES_COLLECTION_NAME]
+            self.collection = self.db[settings.COLLECTION_NAME]
             logger.info("✅ Connected to MongoDB successfully!")
+
+            if settings.ENSURE_INDEXES:
+                self.ensure_indexes()
             return True
             
         except Exception as e:
             logger.error(f"❌ MongoDB connection failed: {e}")
-            self.client = None
             self.db = None
             self.collection = None
+            self.stats_collection = None
+            self.changes_collection = None
             return False
+
+    def check_health(self) -> bool:
+        """Ping MongoDB at most once per health check interval, reconnecting if it was down"""
+        with self._health_lock:
+            if time.monotonic() - self._last_health_check < settings.MONGO_HEALTH_CHECK_INTERVAL:
+                return self.collection is not None
+            self._last_health_check = time.monotonic()
+
+            if self.collection is None:
+                return self.connect()
+
+            try:
+                self.client.admin.command('ping')
+                return True
+            except Exception as e:
+                # Fail fast in every session until the next successful check
+                logger.error(f"❌ MongoDB health check failed: {e}")
+                self.db = None
+                self.collection = None
+                self.stats_collection = None
+                self.changes_collection = None
+                return False
+
+    def pool_metrics(self) -> dict:
+        """Connection pool counters of the shared MongoClient"""
+        return {**pool_metrics.snapshot(), "max_pool_size": settings.MONGO_MAX_POOL_SIZE}
     
+    @invalidates_queries
     def save_image_record(self, image_record: ImageRecord) -> bool:
         """Save image record to database"""
         if self.collection is None:
@@ -42,24 +279,68 @@ class Database:
             return False
         
         try:
-            self.collection.insert_one(image_record.model_dump())
+            record = image_record.model_dump()
+            self.collection.insert_one(record)
+            if record["status"] == "completed":
+                self._update_stats(self._record_increments(record))
             return True
         except Exception as e:
             logger.error(f"Failed to save image record: {e}")
             return False
     
-    def get_images(self, limit: int = 20) -> List[dict]:
+    @invalidates_queries
+    def save_image_records(self, records: List[dict]) -> bool:
+        """Insert a batch of ImageRecord documents with the configured write concern.
+
+        Safe to retry: records that were already written in an earlier attempt
+        are skipped as duplicates rather than failing the batch.
+        """
+        if self.collection is None or not records:
+            return not records
+
+        w = settings.WRITE_CONCERN_W
+        collection = self.collection.with_options(
+            write_concern=WriteConcern(w=int(w) if w.isdigit() else w, j=settings.WRITE_CONCERN_JOURNAL)
+        )
+        duplicates = set()
+        try:
+            collection.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors) or e.details.get("writeConcernErrors"):
+                logger.error(f"Failed to save {len(records)} image records: {e}")
+                return False
+            duplicates = {error["index"] for error in errors}
+        except Exception as e:
+            logger.error(f"Failed to save {len(records)} image records: {e}")
+            return False
+
+        increments = {}
+        for index, record in enumerate(records):
+            if index not in duplicates and record["status"] == "completed":
+                for key, value in self._record_increments(record).items():
+                    increments[key] = increments.get(key, 0) + value
+        self._update_stats(increments)
+        return True
+
+    @cached_query
+    def get_images(self, limit: int = 20, rated_only: bool = False) -> List[dict]:
         """Get images from database"""
         if self.collection is None:
             return []
         
+        query = {"status": "completed"}
+        if rated_only:
+            query["feedback_data.rating"] = {"$type": "number"}
+        
         try:
-            cursor = self.collection.find().sort("created_at", -1).limit(limit)
+            cursor = self.collection.find(query).sort("created_at", -1).limit(limit)
             return list(cursor)
         except Exception as e:
             logger.error(f"Failed to fetch images: {e}")
-            return []
+            return _uncached([])
     
+    @cached_query
     def get_prompt_history(self) -> List[dict]:
         """Get prompt history"""
         if self.collection is None:
@@ -67,33 +348,1120 @@ class Database:
         
         try:
             cursor = self.collection.find(
-                {},
+                {"status": "completed"},
                 {"prompt": 1, "expected_style": 1, "created_at": 1}
             ).sort("created_at", -1)
             return list(cursor)
         except Exception as e:
             logger.error(f"Failed to fetch prompt history: {e}")
-            return []
+            return _uncached([])
     
+    @cached_query
+    def get_images_page(
+        self,
+        limit: int = 20,
+        cursor: Optional[Tuple[datetime, str]] = None,
+        direction: str = "next",
+    ) -> dict:
+        """Get one page of images using keyset pagination on (created_at, id)"""
+        # Records whose files are gone are marked by storage reconciliation, so the Gallery need not check each file
+        return self._get_page({"status": "completed", "file_state": {"$ne": "missing"}}, None, limit, cursor, direction)
+
+    @cached_query
+    def get_prompt_history_page(
+        self,
+        limit: int = 25,
+        cursor: Optional[Tuple[datetime, str]] = None,
+        direction: str = "next",
+        filters: Optional[dict] = None,
+    ) -> dict:
+        """Get one page of prompt history using keyset pagination on (created_at, id)"""
+        return self._get_page(self._history_query(filters), HISTORY_PROJECTION, limit, cursor, direction)
+
+    @cached_query
+    def search_prompts(
+        self,
+        text: str,
+        filters: Optional[dict] = None,
+        limit: int = 25,
+        offset: int = 0,
+    ) -> dict:
+        """Full-text search over prompts, ranked by relevance then recency.
+
+        `filters` narrows the results like `get_prompt_history_page`. Ranked
+        results are paged by offset, since relevance has no stable cursor.
+        """
+        empty = {"items": [], "offset": offset, "has_prev": False, "has_next": False}
+        if self.collection is None:
+            return empty
+
+        query = self._history_query(filters)
+        query["$text"] = {"$search": text}
+        projection = {**HISTORY_PROJECTION, "score": {"$meta": "textScore"}}
+        try:
+            items = list(
+                self.collection.find(query, projection)
+                .sort([("score", {"$meta": "textScore"}), ("created_at", pymongo.DESCENDING)])
+                .skip(offset)
+                .limit(limit + 1)
+            )
+        except Exception as e:
+            logger.error(f"Failed to search prompts: {e}")
+            return _uncached(empty)
+
+        return {
+            "items": items[:limit],
+            "offset": offset,
+            "has_prev": offset > 0,
+            "has_next": len(items) > limit,
+        }
+
+    @staticmethod
+    def _history_query(filters: Optional[dict] = None) -> dict:
+        """Query for completed records matching optional filters.
+
+        Supported filters: `styles` (list), `min_rating`/`max_rating` (inclusive;
+        excludes unrated records) and `start`/`end` (created_at datetimes).
+        """
+        query = {"status": "completed"}
+        filters = filters or {}
+        if filters.get("styles"):
+            query["expected_style"] = {"$in": list(filters["styles"])}
+
+        rating = {}
+        if filters.get("min_rating") is not None:
+            rating["$gte"] = filters["min_rating"]
+        if filters.get("max_rating") is not None:
+            rating["$lte"] = filters["max_rating"]
+        if rating:
+            query["feedback_data.rating"] = rating
+
+        created_at = {}
+        if filters.get("start") is not None:
+            created_at["$gte"] = filters["start"]
+        if filters.get("end") is not None:
+            created_at["$lt"] = filters["end"]
+        if created_at:
+            query["created_at"] = created_at
+        return query
+
+    def _get_page(
+        self,
+        query: dict,
+        projection: Optional[dict],
+        limit: int,
+        cursor: Optional[Tuple[datetime, str]],
+        direction: str,
+    ) -> dict:
+        """Fetch the page after (direction="next") or before (direction="prev") a cursor.
+
+        Pages are ordered newest first. The cursor is the (created_at, id) of the
+        last item of the previous page (or first item, going back), so every page
+        is a bounded index range scan regardless of how deep it is.
+        """
+        empty = {"items": [], "first": None, "last": None, "has_prev": False, "has_next": False}
+        if self.collection is None:
+            return empty
+
+        base_query = query
+        query = dict(base_query)
+        forward = direction == "next"
+        if cursor is not None:
+            created_at, image_id = cursor
+            op = "$lt" if forward else "$gt"
+            bound = {"$lte" if forward else "$gte": created_at}
+            if "created_at" in query:
+                # Keep a date range filter alongside the cursor bound
+                query["$and"] = [{"created_at": query.pop("created_at")}, {"created_at": bound}]
+            else:
+                query["created_at"] = bound
+            query["$or"] = [
+                {"created_at": {op: created_at}},
+                {"created_at": created_at, "id": {op: image_id}},
+            ]
+        order = pymongo.DESCENDING if forward else pymongo.ASCENDING
+
+        try:
+            items = list(
+                self.collection.find(query, projection)
+                .sort([("created_at", order), ("id", order)])
+                .limit(limit + 1)
+            )
+        except Exception as e:
+            logger.error(f"Failed to fetch page: {e}")
+            return _uncached(empty)
+
+        has_more = len(items) > limit
+        items = items[:limit]
+        if not forward:
+            if not has_more:
+                # Reached the newest records: show a full first page instead of a partial one
+                return self._get_page(base_query, projection, limit, None, "next")
+            items.reverse()
+
+        return {
+            "items": items,
+            "first": (items[0]["created_at"], items[0]["id"]) if items else None,
+            "last": (items[-1]["created_at"], items[-1]["id"]) if items else None,
+            "has_prev": cursor is not None if forward else True,
+            "has_next": has_more if forward else True,
+        }
+
+    @cached_query
     def count_images(self) -> int:
         """Count total images"""
         if self.collection is None:
             return 0
         
         try:
-            return self.collection.count_documents({})
+            return self.collection.count_documents({"status": "completed"})
         except Exception as e:
             logger.error(f"Failed to count images: {e}")
-            return 0
+            return _uncached(0)
     
+    @invalidates_queries
     def delete_image_record(self, image_id: str) -> bool:
         """Delete image record from database"""
         if self.collection is None:
             return False
         
         try:
-            result = self.collection.delete_one({"id": image_id})
-            return result.deleted_count > 0
+            record = self.collection.find_one_and_delete({"id": image_id})
+            if record is None:
+                return False
+            if record.get("status") == "completed":
+                self._update_stats(self._record_increments(record, sign=-1))
+            self._log_changes([image_id])
+            return True
         except Exception as e:
             logger.error(f"Failed to delete image record: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @invalidates_queries
+    def record_timing(self, image_id: str, stage: str, seconds: float) -> bool:
+        """Add a stage duration measured after the record was written (e.g. the write itself)"""
+        if self.collection is None:
+            return False
+
+        try:
+            result = self.collection.update_one({"id": image_id}, {"$set": {f"timings.{stage}": seconds}})
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"Failed to record timing for {image_id}: {e}")
+            return False
+
+    @cached_query
+    def get_stage_latencies(self, sample: int = settings.STAGE_LATENCY_SAMPLE) -> dict:
+        """p50/p95/p99 of each timing stage over the most recent records, overall and per style,
+        plus generation time per quality tier"""
+        empty = {"overall": {}, "by_style": {}, "by_tier": {}}
+        if self.collection is None:
+            return empty
+
+        try:
+            cursor = self.collection.find(
+                {"status": "completed", "$or": [{"timings": {"$type": "object"}}, {"tier_times": {"$type": "object"}}]},
+                {"expected_style": 1, "timings": 1, "tier_times": 1},
+            ).sort("created_at", -1).limit(sample)
+            overall, by_style, by_tier = {}, {}, {}
+            for record in cursor:
+                for stage, seconds in (record.get("timings") or {}).items():
+                    overall.setdefault(stage, []).append(seconds)
+                    by_style.setdefault(record["expected_style"], {}).setdefault(stage, []).append(seconds)
+                for tier, seconds in (record.get("tier_times") or {}).items():
+                    by_tier.setdefault(tier, []).append(seconds)
+        except Exception as e:
+            logger.error(f"Failed to fetch stage timings: {e}")
+            return _uncached(empty)
+
+        return {
+            "overall": {stage: percentiles(values) for stage, values in overall.items()},
+            "by_style": {
+                style: {stage: percentiles(values) for stage, values in stages.items()}
+                for style, stages in by_style.items()
+            },
+            "by_tier": {tier: percentiles(values) for tier, values in by_tier.items()},
+        }
+
+    def get_image(self, image_id: str) -> Optional[dict]:
+        """Get a single image record by id"""
+        if self.collection is None:
+            return None
+
+        try:
+            return self.collection.find_one({"id": image_id})
+        except Exception as e:
+            logger.error(f"Failed to fetch image {image_id}: {e}")
+            return None
+
+    def count_references(self, key: str) -> int:
+        """Number of records whose image or thumbnail is stored under a key"""
+        if self.collection is None:
+            return 0
+
+        try:
+            return self.collection.count_documents({"$or": [{"filename": key}, {"thumbnail_filename": key}]})
+        except Exception as e:
+            # Never let a failed count look like "unreferenced": the blob is kept until a later release
+            logger.error(f"Failed to count references to {key}, keeping it: {e}")
+            return 1
+
+    def referenced_keys(self, keys: Iterable[str]) -> Optional[Set[str]]:
+        """The subset of storage keys some record's image or thumbnail points at; None if the lookup failed"""
+        if self.collection is None:
+            return None
+
+        keys = list(keys)
+        try:
+            return (
+                set(self.collection.distinct("filename", {"filename": {"$in": keys}}))
+                | set(self.collection.distinct("thumbnail_filename", {"thumbnail_filename": {"$in": keys}}))
+            )
+        except Exception as e:
+            logger.error(f"Failed to look up references to {len(keys)} keys: {e}")
+            return None
+
+    def existing_ids(self, image_ids: List[str]) -> Set[str]:
+        """The subset of record ids that exist"""
+        if self.collection is None or not image_ids:
+            return set()
+
+        try:
+            return set(self.collection.distinct("id", {"id": {"$in": image_ids}}))
+        except Exception as e:
+            logger.error(f"Failed to look up {len(image_ids)} record ids: {e}")
+            return set()
+
+    def iter_storage_records(self, batch_size: int = settings.RECONCILE_BATCH_SIZE):
+        """Iterate over the storage keys and file state of completed records"""
+        if self.collection is None:
+            return
+        yield from self.collection.find(
+            {"status": "completed"},
+            {"_id": 0, "id": 1, "filename": 1, "thumbnail_filename": 1, "file_state": 1},
+            batch_size=batch_size,
+        )
+
+    def iter_eviction_candidates(self, policy: str, before: datetime):
+        """Iterate over completed records with a stored image created before `before`, in eviction order"""
+        if self.collection is None:
+            return
+        yield from self.collection.find(
+            {"status": "completed", "file_state": None, "created_at": {"$lt": before}},
+            {"_id": 0, "id": 1, "filename": 1, "thumbnail_filename": 1},
+            sort=EVICTION_SORTS[policy],
+            allow_disk_use=True,
+        )
+
+    @invalidates_queries
+    def set_file_state(self, image_ids: List[str], file_state: Optional[str]) -> int:
+        """Set the file state of records; returns how many changed"""
+        if self.collection is None or not image_ids:
+            return 0
+
+        try:
+            modified = self.collection.update_many(
+                {"id": {"$in": image_ids}}, {"$set": {"file_state": file_state}}
+            ).modified_count
+            self._log_changes(image_ids)
+            return modified
+        except Exception as e:
+            logger.error(f"Failed to set file state of {len(image_ids)} records: {e}")
+            return 0
+
+    @invalidates_queries
+    def evict_file(self, key: str) -> Optional[List[str]]:
+        """Mark every record whose full-size image is stored under `key` as evicted; returns their ids"""
+        if self.collection is None:
+            return None
+
+        try:
+            image_ids = self.collection.distinct("id", {"filename": key, "status": "completed"})
+            self.collection.update_many({"id": {"$in": image_ids}}, {"$set": {"file_state": "evicted"}})
+            self._log_changes(image_ids)
+            return image_ids
+        except Exception as e:
+            logger.error(f"Failed to mark {key} evicted: {e}")
+            return None
+
+    def _log_changes(self, image_ids: List[str]):
+        """Note that records changed or were deleted, for incremental Gallery refreshes"""
+        if self.changes_collection is None or not image_ids:
+            return
+        try:
+            now = datetime.now()
+            self.changes_collection.insert_many([{"id": image_id, "at": now} for image_id in image_ids], ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to log changes to {len(image_ids)} records: {e}")
+
+    def get_gallery_delta(
+        self,
+        watermark: Optional[Tuple[datetime, str]],
+        since: datetime,
+        limit: int = 20,
+        lag: float = settings.GALLERY_REFRESH_LAG,
+    ) -> dict:
+        """What changed for the newest Gallery page since it was last loaded.
+
+        Returns records created after `watermark` (looking back `lag` seconds,
+        for records written late by the write-behind buffer), the current
+        state of records changed since `since`, and the ids of changed ones
+        the Gallery no longer shows (deleted, re-queued by a refine, or with
+        a missing file). When nothing has changed, this is one indexed query
+        per collection returning at most a few documents.
+        """
+        delta = {"new": [], "changed": [], "deleted": [], "synced_at": datetime.now()}
+        if self.collection is None:
+            return delta
+
+        try:
+            visible = {"status": "completed", "file_state": {"$ne": "missing"}}
+            query = dict(visible)
+            if watermark is not None:
+                query["created_at"] = {"$gte": watermark[0] - timedelta(seconds=lag)}
+            delta["new"] = list(
+                self.collection.find(query, GALLERY_PROJECTION).sort([("created_at", -1), ("id", -1)]).limit(limit)
+            )
+
+            changed_ids = self.changes_collection.distinct("id", {"at": {"$gt": since - timedelta(seconds=lag)}})
+            if changed_ids:
+                delta["changed"] = list(
+                    self.collection.find({**visible, "id": {"$in": changed_ids}}, GALLERY_PROJECTION)
+                )
+                found = {record["id"] for record in delta["changed"]}
+                delta["deleted"] = [image_id for image_id in changed_ids if image_id not in found]
+        except Exception as e:
+            logger.error(f"Failed to fetch gallery changes: {e}")
+        return delta
+
+    def touch_image(self, image_id: str) -> bool:
+        """Record that an image's full-size file was viewed (for least-recently-viewed eviction)"""
+        if self.collection is None:
+            return False
+
+        try:
+            # No cached read shows last_viewed_at, so this does not invalidate the query cache
+            result = self.collection.update_one({"id": image_id}, {"$set": {"last_viewed_at": datetime.now()}})
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"Failed to record view of {image_id}: {e}")
+            return False
+
+    def save_maintenance_report(self, name: str, report: dict) -> bool:
+        """Keep the latest report of a maintenance task in the stats collection"""
+        if self.stats_collection is None:
+            return False
+
+        try:
+            self.stats_collection.replace_one({"_id": f"report:{name}"}, report, upsert=True)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save {name} report: {e}")
+            return False
+
+    def get_maintenance_report(self, name: str) -> Optional[dict]:
+        """Latest report of a maintenance task, if it has run"""
+        if self.stats_collection is None:
+            return None
+
+        try:
+            return self.stats_collection.find_one({"_id": f"report:{name}"}, {"_id": 0})
+        except Exception as e:
+            logger.error(f"Failed to read {name} report: {e}")
+            return None
+
+    def enqueue_job(self, image_record: ImageRecord) -> bool:
+        """Persist a generation job in the queued state"""
+        image_record.status = "queued"
+        # complete_job sets tier_times.<tier>, which MongoDB cannot do inside a null field
+        image_record.tier_times = image_record.tier_times or {}
+        return self.save_image_record(image_record)
+
+    @staticmethod
+    def _claimable_query(now: datetime, max_attempts: int) -> dict:
+        """Queued jobs, and running jobs whose lease expired, with attempts left"""
+        return {
+            "$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_expires_at": {"$lt": now}},
+            ],
+            "attempts": {"$lt": max_attempts},
+        }
+
+    def _next_claim_user(self, now: datetime, max_attempts: int) -> Tuple[bool, Optional[str]]:
+        """(found, user id) of the user served next: fewest running jobs, then oldest waiting job.
+
+        Scans the queued and running jobs, which admission control keeps to
+        at most ADMISSION_MAX_QUEUE plus the workers' share.
+        """
+        claimable = {"$and": [
+            {"$lt": ["$attempts", max_attempts]},
+            {"$or": [
+                {"$eq": ["$status", "queued"]},
+                {"$and": [{"$gt": ["$lease_expires_at", None]}, {"$lt": ["$lease_expires_at", now]}]},
+            ]},
+        ]}
+        users = list(self.collection.aggregate([
+            {"$match": {"status": {"$in": ["queued", "running"]}}},
+            {"$group": {
+                "_id": "$user_id",
+                "running": {"$sum": {"$cond": [
+                    {"$and": [{"$eq": ["$status", "running"]}, {"$gte": ["$lease_expires_at", now]}]}, 1, 0
+                ]}},
+                "oldest": {"$min": {"$cond": [claimable, "$created_at", None]}},
+            }},
+            {"$match": {"oldest": {"$ne": None}}},
+            {"$sort": {"running": 1, "oldest": 1}},
+            {"$limit": 1},
+        ]))
+        return (True, users[0]["_id"]) if users else (False, None)
+
+    def claim_next_job(self, worker_id: str, lease_seconds: int, max_attempts: int) -> Optional[dict]:
+        """Atomically claim a queued job, or a running job whose lease expired.
+
+        Fair across users: the job is the oldest one of the user with the
+        fewest running jobs, so one user's large batch cannot hold every
+        worker while others wait.
+        """
+        if self.collection is None:
+            return None
+
+        now = datetime.now()
+        update = {
+            "$set": {
+                "status": "running",
+                "worker_id": worker_id,
+                "started_at": now,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+            },
+            "$inc": {"attempts": 1},
+        }
+        try:
+            found, user_id = self._next_claim_user(now, max_attempts)
+            if not found:
+                return None
+            job = self.collection.find_one_and_update(
+                {**self._claimable_query(now, max_attempts), "user_id": user_id},
+                update,
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if job is None:
+                # Another worker took that user's last job first; fall back to the oldest job
+                job = self.collection.find_one_and_update(
+                    self._claimable_query(now, max_attempts),
+                    update,
+                    sort=[("created_at", 1)],
+                    return_document=ReturnDocument.AFTER,
+                )
+            return job
+        except Exception as e:
+            logger.error(f"Failed to claim job: {e}")
+            return None
+
+    @invalidates_queries
+    def complete_job(
+        self,
+        image_id: str,
+        worker_id: str,
+        generation_time: float,
+        file_size: int,
+        thumbnail_filename: Optional[str] = None,
+        filename: Optional[str] = None,
+        timings: Optional[dict] = None,
+        quality_tier: Optional[str] = None,
+    ) -> bool:
+        """Mark a running job as completed by the worker that holds it"""
+        if self.collection is None:
+            return False
+
+        try:
+            update = {"filename": filename} if filename else {}
+            if quality_tier:
+                # Earlier tiers (e.g. the draft a refine replaced) keep their entries
+                update.update({"quality_tier": quality_tier, f"tier_times.{quality_tier}": generation_time})
+                # Jobs queued with tier_times: null (before enqueue_job defaulted it to {})
+                self.collection.update_one(
+                    {"id": image_id, "status": "running", "worker_id": worker_id, "tier_times": None},
+                    {"$set": {"tier_times": {}}},
+                )
+            record = self.collection.find_one_and_update(
+                {"id": image_id, "status": "running", "worker_id": worker_id},
+                {"$set": {
+                    **update,
+                    "status": "completed",
+                    "generation_time": generation_time,
+                    "file_size": file_size,
+                    "thumbnail_filename": thumbnail_filename,
+                    "timings": dict(timings) if timings else None,
+                    "error": None,
+                    "lease_expires_at": None,
+                }},
+                return_document=ReturnDocument.AFTER,
+            )
+            if record is None:
+                return False
+            self._update_stats(self._record_increments(record))
+            # Completed jobs were created before they appear, so the Gallery learns of them from the change log
+            self._log_changes([image_id])
+            return True
+        except Exception as e:
+            logger.error(f"Failed to complete job {image_id}: {e}")
+            return False
+
+    def fail_job(self, image_id: str, worker_id: str, error: str, max_attempts: int) -> bool:
+        """Record a job failure, re-queueing it while attempts remain"""
+        if self.collection is None:
+            return False
+
+        try:
+            result = self.collection.update_one(
+                {"id": image_id, "status": "running", "worker_id": worker_id},
+                [{"$set": {
+                    "status": {"$cond": [{"$lt": ["$attempts", max_attempts]}, "queued", "failed"]},
+                    "error": error,
+                    "lease_expires_at": None,
+                }}],
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error(f"Failed to record failure for job {image_id}: {e}")
+            return False
+
+    def fail_expired_jobs(self, max_attempts: int) -> int:
+        """Fail running jobs whose lease expired after their last allowed attempt"""
+        if self.collection is None:
+            return 0
+
+        try:
+            result = self.collection.update_many(
+                {
+                    "status": "running",
+                    "lease_expires_at": {"$lt": datetime.now()},
+                    "attempts": {"$gte": max_attempts},
+                },
+                {"$set": {"status": "failed", "error": "Worker lease expired", "lease_expires_at": None}},
+            )
+            return result.modified_count
+        except Exception as e:
+            logger.error(f"Failed to expire jobs: {e}")
+            return 0
+
+    def requeue_job(self, image_id: str) -> bool:
+        """Put a failed job back on the queue with a fresh attempt budget"""
+        if self.collection is None:
+            return False
+
+        try:
+            result = self.collection.update_one(
+                {"id": image_id, "status": "failed"},
+                {"$set": {"status": "queued", "attempts": 0, "error": None, "queued_at": datetime.now()}},
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error(f"Failed to requeue job {image_id}: {e}")
+            return False
+
+    @invalidates_queries
+    def refine_job(self, image_id: str, quality_tier: str) -> bool:
+        """Queue a completed image again at a higher quality tier; the new image replaces it when done"""
+        if self.collection is None:
+            return False
+
+        try:
+            record = self.collection.find_one_and_update(
+                {"id": image_id, "status": "completed", "quality_tier": {"$ne": quality_tier}},
+                {"$set": {
+                    "status": "queued",
+                    "quality_tier": quality_tier,
+                    "attempts": 0,
+                    "error": None,
+                    "queued_at": datetime.now(),
+                }},
+            )
+            if record is None:
+                return False
+            # Counted again when the refined job completes
+            self._update_stats(self._record_increments(record, sign=-1))
+            self._log_changes([image_id])
+            return True
+        except Exception as e:
+            logger.error(f"Failed to refine job {image_id}: {e}")
+            return False
+
+    def count_queued_jobs(self, user_id: Optional[str] = None) -> int:
+        """Number of queued jobs, optionally only one user's"""
+        if self.collection is None:
+            return 0
+
+        query = {"status": "queued"}
+        if user_id is not None:
+            query["user_id"] = user_id
+        try:
+            return self.collection.count_documents(query)
+        except Exception as e:
+            logger.error(f"Failed to count queued jobs: {e}")
+            return 0
+
+    def queue_position(self, user_id: Optional[str], created_at: datetime) -> int:
+        """Queued jobs served before a user's job under the workers' per-user rotation"""
+        if self.collection is None:
+            return 0
+
+        try:
+            counts = list(self.collection.aggregate([
+                {"$match": {"status": "queued"}},
+                {"$group": {
+                    "_id": "$user_id",
+                    "queued": {"$sum": 1},
+                    "before": {"$sum": {"$cond": [{"$lt": ["$created_at", created_at]}, 1, 0]}},
+                }},
+            ]))
+        except Exception as e:
+            logger.error(f"Failed to compute queue position: {e}")
+            return 0
+        own = next((count["before"] for count in counts if count["_id"] == user_id), 0)
+        # Every other user with more than `own` jobs waiting gets a turn first (as in AdmissionController.position)
+        return own + sum(min(count["queued"], own + 1) for count in counts if count["_id"] != user_id)
+
+    def get_jobs(self, image_ids: List[str]) -> List[dict]:
+        """Get the current state of the given jobs, in the order requested"""
+        if self.collection is None or not image_ids:
+            return []
+
+        try:
+            cursor = self.collection.find({"id": {"$in": image_ids}})
+            jobs = {job["id"]: job for job in cursor}
+            return [jobs[image_id] for image_id in image_ids if image_id in jobs]
+        except Exception as e:
+            logger.error(f"Failed to fetch jobs: {e}")
+            return []
+
+    @invalidates_queries
+    def save_feedback(self, image_id: str, feedback_data: FeedbackData) -> bool:
+        """Attach user feedback to an existing image record"""
+        if self.collection is None:
+            return False
+
+        try:
+            record = self.collection.find_one_and_update(
+                {"id": image_id},
+                {"$set": {"feedback_data": feedback_data.model_dump()}},
+                return_document=ReturnDocument.BEFORE,
+            )
+            if record is None:
+                return False
+            if record.get("status") == "completed":
+                inc = self._rating_increments(record["expected_style"], feedback_data.rating)
+                previous = (record.get("feedback_data") or {}).get("rating")
+                if previous is not None:
+                    for key, value in self._rating_increments(record["expected_style"], previous, sign=-1).items():
+                        inc[key] = inc.get(key, 0) + value
+                self._update_stats(inc)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save feedback for {image_id}: {e}")
+            return False
+
+    @invalidates_queries
+    def set_thumbnail(self, image_id: str, thumbnail_filename: str) -> bool:
+        """Record the thumbnail filename of an image"""
+        if self.collection is None:
+            return False
+
+        try:
+            result = self.collection.update_one({"id": image_id}, {"$set": {"thumbnail_filename": thumbnail_filename}})
+            self._log_changes([image_id])
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"Failed to set thumbnail for {image_id}: {e}")
+            return False
+
+    def iter_images_missing_thumbnails(self):
+        """Iterate over completed images that have no thumbnail yet"""
+        if self.collection is None:
+            return
+        yield from self.collection.find(
+            {"status": "completed", "thumbnail_filename": None},
+            {"id": 1, "filename": 1},
+        )
+
+    def iter_images(self, filters: Optional[dict] = None):
+        """Iterate over completed image records matching history filters, oldest first"""
+        if self.collection is None:
+            return
+        yield from self.collection.find(self._history_query(filters)).sort("created_at", 1)
+
+    def iter_prompts(self, since: Optional[datetime] = None):
+        """Iterate over (id, prompt, style, created_at) of completed records, optionally created after `since`"""
+        if self.collection is None:
+            return
+        query = {"status": "completed"}
+        if since is not None:
+            query["created_at"] = {"$gt": since}
+        yield from self.collection.find(
+            query,
+            {"_id": 0, "id": 1, "prompt": 1, "expected_style": 1, "created_at": 1},
+        ).sort("created_at", 1)
+
+    def iter_legacy_images(self):
+        """Iterate over records whose image is still stored as a flat, non content-addressed file"""
+        if self.collection is None:
+            return
+        yield from self.collection.find(
+            # Queued and running jobs hold placeholder filenames with no file behind them
+            {"status": "completed", "filename": {"$not": {"$regex": "/"}}},
+            {"id": 1, "filename": 1, "thumbnail_filename": 1},
+        )
+
+    @invalidates_queries
+    def update_storage_keys(self, image_id: str, keys: dict) -> bool:
+        """Point a record's filename/thumbnail_filename at new storage keys"""
+        if self.collection is None:
+            return False
+
+        try:
+            result = self.collection.update_one({"id": image_id}, {"$set": keys})
+            self._log_changes([image_id])
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"Failed to update storage keys for {image_id}: {e}")
+            return False
+
+    @cached_query
+    def get_statistics(self) -> dict:
+        """Get totals, averages and style distribution over all completed images"""
+        if self.collection is None:
+            return self._empty_statistics()
+
+        if settings.STATS_MATERIALIZED:
+            stats = self._get_materialized_stats()
+            if stats is not None:
+                return self._statistics_from_document(stats)
+
+        try:
+            result = next(self.collection.aggregate([
+                {"$match": {"status": "completed"}},
+                {"$facet": {
+                    "totals": [{"$group": {
+                        "_id": None,
+                        "total": {"$sum": 1},
+                        "avg_generation_time": {"$avg": "$generation_time"},
+                        "avg_file_size": {"$avg": "$file_size"},
+                    }}],
+                    "styles": [{"$group": {"_id": "$expected_style", "count": {"$sum": 1}}}],
+                }},
+            ]))
+        except Exception as e:
+            logger.error(f"Failed to aggregate statistics: {e}")
+            return _uncached(self._empty_statistics())
+
+        totals = result["totals"][0] if result["totals"] else {}
+        return {
+            "total": totals.get("total", 0),
+            "avg_generation_time": totals.get("avg_generation_time") or 0.0,
+            "avg_file_size": totals.get("avg_file_size") or 0.0,
+            "style_counts": {row["_id"]: row["count"] for row in result["styles"]},
+        }
+
+    @cached_query
+    def get_rating_report(self) -> dict:
+        """Get average rating, rating histogram and per-style averages over all rated images"""
+        if self.collection is None:
+            return self._empty_rating_report()
+
+        if settings.STATS_MATERIALIZED:
+            stats = self._get_materialized_stats()
+            if stats is not None:
+                return self._rating_report_from_document(stats)
+
+        try:
+            result = next(self.collection.aggregate([
+                {"$match": {"status": "completed", "feedback_data.rating": {"$type": "number"}}},
+                {"$facet": {
+                    "totals": [{"$group": {
+                        "_id": None,
+                        "count": {"$sum": 1},
+                        "avg_rating": {"$avg": "$feedback_data.rating"},
+                    }}],
+                    "histogram": [
+                        {"$group": {"_id": "$feedback_data.rating", "count": {"$sum": 1}}},
+                        {"$sort": {"_id": 1}},
+                    ],
+                    "by_style": [{"$group": {
+                        "_id": "$expected_style",
+                        "avg_rating": {"$avg": "$feedback_data.rating"},
+                    }}],
+                }},
+            ]))
+        except Exception as e:
+            logger.error(f"Failed to aggregate ratings: {e}")
+            return _uncached(self._empty_rating_report())
+
+        totals = result["totals"][0] if result["totals"] else {}
+        return {
+            "count": totals.get("count", 0),
+            "avg_rating": totals.get("avg_rating") or 0.0,
+            "histogram": {row["_id"]: row["count"] for row in result["histogram"]},
+            "style_avgs": {row["_id"]: row["avg_rating"] for row in result["by_style"]},
+        }
+
+    @invalidates_queries
+    def rebuild_stats(self) -> bool:
+        """Recompute the materialized stats document from the full collection.
+
+        Increments applied while the aggregation runs are overwritten by the
+        final replace, so run it when no images are being generated or rated.
+        """
+        if self.collection is None:
+            return False
+
+        try:
+            stats = {"_id": STATS_DOCUMENT_ID, "rebuilt_at": datetime.now()}
+            # One group per (style, rating) pair keeps the result small however many images are rated
+            for record in self.collection.aggregate([
+                {"$match": {"status": "completed"}},
+                {"$group": {
+                    "_id": {"style": "$expected_style", "rating": "$feedback_data.rating"},
+                    "total": {"$sum": 1},
+                    "generation_time_sum": {"$sum": {"$ifNull": ["$generation_time", 0]}},
+                    "generation_time_count": {"$sum": {"$cond": [{"$isNumber": "$generation_time"}, 1, 0]}},
+                    "file_size_sum": {"$sum": {"$ifNull": ["$file_size", 0]}},
+                    "file_size_count": {"$sum": {"$cond": [{"$isNumber": "$file_size"}, 1, 0]}},
+                }},
+            ]):
+                style = record["_id"]["style"]
+                rating = record["_id"].get("rating")
+                for key in ("total", "generation_time_sum", "generation_time_count", "file_size_sum", "file_size_count"):
+                    stats[key] = stats.get(key, 0) + record[key]
+                self._add_nested(stats, f"styles.{style}", record["total"])
+                if isinstance(rating, (int, float)):
+                    for key, value in self._rating_increments(style, rating, record["total"]).items():
+                        self._add_nested(stats, key, value)
+
+            self.stats_collection.replace_one({"_id": STATS_DOCUMENT_ID}, stats, upsert=True)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to rebuild stats: {e}")
+            return False
+
+    def _get_materialized_stats(self) -> Optional[dict]:
+        try:
+            stats = self.stats_collection.find_one({"_id": STATS_DOCUMENT_ID})
+            # A document without rebuilt_at was upserted by an increment alone and counts only that write
+            if (stats is None or "rebuilt_at" not in stats) and self.rebuild_stats():
+                stats = self.stats_collection.find_one({"_id": STATS_DOCUMENT_ID})
+            return stats
+        except Exception as e:
+            logger.error(f"Failed to read materialized stats: {e}")
+            return None
+
+    def _update_stats(self, increments: dict):
+        """Apply counter increments to the materialized stats document.
+
+        Never creates it: a missing document is built from the whole
+        collection by `rebuild_stats` on the next read.
+        """
+        if not settings.STATS_MATERIALIZED or self.stats_collection is None or not increments:
+            return
+        try:
+            self.stats_collection.update_one({"_id": STATS_DOCUMENT_ID}, {"$inc": increments})
+        except Exception as e:
+            logger.error(f"Failed to update materialized stats: {e}")
+
+    @staticmethod
+    def _rating_increments(style: str, rating: float, sign: int = 1) -> dict:
+        return {
+            "rating_count": sign,
+            "rating_sum": sign * rating,
+            f"rating_histogram.{int(rating)}": sign,
+            f"style_rating_count.{style}": sign,
+            f"style_rating_sum.{style}": sign * rating,
+        }
+
+    def _record_increments(self, record: dict, sign: int = 1) -> dict:
+        inc = {"total": sign, f"styles.{record['expected_style']}": sign}
+        if record.get("generation_time") is not None:
+            inc["generation_time_sum"] = sign * record["generation_time"]
+            inc["generation_time_count"] = sign
+        if record.get("file_size") is not None:
+            inc["file_size_sum"] = sign * record["file_size"]
+            inc["file_size_count"] = sign
+        rating = (record.get("feedback_data") or {}).get("rating")
+        if rating is not None:
+            inc.update(self._rating_increments(record["expected_style"], rating, sign))
+        return inc
+
+    @staticmethod
+    def _add_nested(document: dict, dotted_key: str, value: float):
+        *parents, leaf = dotted_key.split(".")
+        for parent in parents:
+            document = document.setdefault(parent, {})
+        document[leaf] = document.get(leaf, 0) + value
+
+    @staticmethod
+    def _statistics_from_document(stats: dict) -> dict:
+        generation_time_count = stats.get("generation_time_count", 0)
+        file_size_count = stats.get("file_size_count", 0)
+        return {
+            "total": stats.get("total", 0),
+            "avg_generation_time": stats.get("generation_time_sum", 0) / generation_time_count if generation_time_count else 0.0,
+            "avg_file_size": stats.get("file_size_sum", 0) / file_size_count if file_size_count else 0.0,
+            "style_counts": {style: count for style, count in stats.get("styles", {}).items() if count > 0},
+        }
+
+    @staticmethod
+    def _rating_report_from_document(stats: dict) -> dict:
+        count = stats.get("rating_count", 0)
+        style_counts = stats.get("style_rating_count", {})
+        return {
+            "count": count,
+            "avg_rating": stats.get("rating_sum", 0) / count if count else 0.0,
+            "histogram": {
+                int(rating): n for rating, n in sorted(stats.get("rating_histogram", {}).items(), key=lambda item: int(item[0])) if n > 0
+            },
+            "style_avgs": {
+                style: stats["style_rating_sum"][style] / n for style, n in style_counts.items() if n > 0
+            },
+        }
+
+    @staticmethod
+    def _empty_statistics() -> dict:
+        return {"total": 0, "avg_generation_time": 0.0, "avg_file_size": 0.0, "style_counts": {}}
+
+    @staticmethod
+    def _empty_rating_report() -> dict:
+        return {"count": 0, "avg_rating": 0.0, "histogram": {}, "style_avgs": {}}
+
+    def ensure_indexes(self) -> bool:
+        """Create the indexes declared in INDEXES (no-op for ones that already exist) and drop superseded ones"""
+        if self.collection is None:
+            return False
+
+        try:
+            for name, keys, options in INDEXES:
+                self.collection.create_index(keys, name=name, **options)
+            existing = set(self.collection.index_information())
+            for name in SUPERSEDED_INDEXES:
+                if name in existing:
+                    self.collection.drop_index(name)
+                    logger.info(f"Dropped superseded index {name}")
+            # Change log entries only need to outlive the longest gap between Gallery refreshes
+            self.changes_collection.create_index(
+                [("at", pymongo.ASCENDING)], name="at_ttl", expireAfterSeconds=int(settings.CHANGE_LOG_TTL)
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Failed to create indexes: {e}")
+            return False
+
+    def check_indexes(self) -> dict:
+        """Report missing and unused indexes and the query plan of each query method"""
+        if self.collection is None:
+            return {}
+
+        declared = {name for name, _, _ in INDEXES}
+        existing = set(self.collection.index_information()) - {"_id_"}
+
+        # $indexStats counters reset on server restart, so "unused" is since then
+        unused = []
+        try:
+            for index_stats in self.collection.aggregate([{"$indexStats": {}}]):
+                if index_stats["name"] != "_id_" and index_stats["accesses"]["ops"] == 0:
+                    unused.append(index_stats["name"])
+        except Exception as e:
+            logger.warning(f"$indexStats not available: {e}")
+
+        plans = {}
+        for method, cursor in self._query_shapes().items():
+            try:
+                plans[method] = self._summarize_plan(cursor.explain())
+            except Exception as e:
+                plans[method] = {"error": str(e)}
+
+        return {
+            "missing": sorted(declared - existing),
+            "undeclared": sorted(existing - declared),
+            "unused": sorted(unused),
+            "plans": plans,
+        }
+
+    def _query_shapes(self) -> dict:
+        """Representative cursors for each query method, used for explain()"""
+        return {
+            "get_images": self.collection.find({"status": "completed"}).sort("created_at", -1).limit(20),
+            "get_images(rated_only)": self.collection.find(
+                {"status": "completed", "feedback_data.rating": {"$type": "number"}}
+            ).sort("created_at", -1).limit(5),
+            "get_images_page": self.collection.find({
+                "status": "completed",
+                "file_state": {"$ne": "missing"},
+                "created_at": {"$lte": datetime.now()},
+                "$or": [{"created_at": {"$lt": datetime.now()}}, {"created_at": datetime.now(), "id": {"$lt": ""}}],
+            }).sort([("created_at", -1), ("id", -1)]).limit(21),
+            "get_gallery_delta": self.collection.find(
+                {"status": "completed", "file_state": {"$ne": "missing"}, "created_at": {"$gte": datetime.now()}},
+                GALLERY_PROJECTION,
+            ).sort([("created_at", -1), ("id", -1)]).limit(20),
+            "get_prompt_history": self.collection.find(
+                {"status": "completed"}, {"prompt": 1, "expected_style": 1, "created_at": 1}
+            ).sort("created_at", -1),
+            "get_prompt_history_page(style, rating)": self.collection.find(
+                self._history_query({"styles": ["realistic"], "min_rating": 7}), HISTORY_PROJECTION
+            ).sort([("created_at", -1), ("id", -1)]).limit(26),
+            "search_prompts": self.collection.find(
+                {"status": "completed", "$text": {"$search": "dragon"}},
+                {"score": {"$meta": "textScore"}},
+            ).sort([("score", {"$meta": "textScore"}), ("created_at", -1)]).limit(26),
+            "delete_image_record": self.collection.find({"id": ""}),
+            "iter_eviction_candidates": self.collection.find(
+                {"status": "completed", "file_state": None, "created_at": {"$lt": datetime.now()}}
+            ).sort(EVICTION_SORTS["least_recently_viewed"]).limit(100),
+            "claim_next_job": self.collection.find(
+                {**self._claimable_query(datetime.now(), settings.JOB_MAX_ATTEMPTS), "user_id": ""}
+            ).sort("created_at", 1).limit(1),
+            "claim_next_job(fallback)": self.collection.find(
+                self._claimable_query(datetime.now(), settings.JOB_MAX_ATTEMPTS)
+            ).sort("created_at", 1).limit(1),
+        }
+
+    @staticmethod
+    def _summarize_plan(explain: dict) -> dict:
+        """Extract the stages and index names of a winning plan"""
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        winning_plan = winning_plan.get("queryPlan", winning_plan)
+
+        stages, indexes = [], []
+        pending = [winning_plan]
+        while pending:
+            stage = pending.pop()
+            stages.append(stage.get("stage"))
+            if stage.get("indexName"):
+                indexes.append(stage["indexName"])
+            if "inputStage" in stage:
+                pending.append(stage["inputStage"])
+            pending.extend(stage.get("inputStages", []))
+
+        return {
+            "stages": stages,
+            "indexes": indexes,
+            "uses_index": bool(indexes) and "COLLSCAN" not in stages,
+            "in_memory_sort": "SORT" in stages,
+        }
+
+
+def get_database() -> Database:
+    """Return the process-wide Database instance"""
+    global _shared_database
+    with _shared_lock:
+        if _shared_database is None:
+            _shared_database = Database()
+        return _shared_database
+
+
+def set_database(db: Database):
+    """Make `db` and its client the process-wide instances (e.g. a benchmark's in-process stand-in)"""
+    global _shared_client, _shared_database
+    with _shared_lock:
+        _shared_client = db.client
+        _shared_database = db
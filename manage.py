@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from config import settings
+from database import EVICTION_SORTS, Database
+from services.admission import AdmissionController
+from services.bulk_generate import BulkGeneration, Checkpoint, read_items
+from services.export import stream_export
+from services.image_codec import detect_format
+from services.image_generator import get_image_generator
+from services.image_store import LocalImageStore, get_image_store
+from services.reconcile import StorageReconciler
+from services.thumbnails import save_thumbnail
+
+logger = logging.getLogger(__name__)
+
+
+def check_indexes(args) -> int:
+    """Create declared indexes and report index usage and query plans"""
+    db = Database()
+    if db.collection is None:
+        print("❌ MongoDB not available")
+        return 1
+
+    if args.create:
+        db.ensure_indexes()
+
+    report = db.check_indexes()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Missing indexes:    {', '.join(report['missing']) or '-'}")
+        print(f"Undeclared indexes: {', '.join(report['undeclared']) or '-'}")
+        print(f"Unused indexes:     {', '.join(report['unused']) or '-'}")
+        print("Query plans:")
+        for method, plan in report["plans"].items():
+            if "error" in plan:
+                print(f"  ❌ {method}: {plan['error']}")
+                continue
+            status = "✅" if plan["uses_index"] and not plan["in_memory_sort"] else "❌"
+            note = " (in-memory sort)" if plan["in_memory_sort"] else ""
+            print(f"  {status} {method}: {', '.join(plan['indexes']) or 'COLLSCAN'}{note}")
+
+    healthy = not report["missing"] and all(
+        plan.get("uses_index") and not plan.get("in_memory_sort") for plan in report["plans"].values()
+    )
+    return 0 if healthy else 1
+
+
+def rebuild_stats(args) -> int:
+    """Recompute the materialized statistics document.
+
+    Ratings and generations recorded while this runs are lost when the
+    rebuilt document replaces the live one, so run it with the app idle.
+    """
+    db = Database()
+    return 0 if db.rebuild_stats() else 1
+
+
+def backfill_thumbnails(args) -> int:
+    """Generate thumbnails for stored images that do not have one"""
+    db = Database()
+    if db.collection is None:
+        print("❌ MongoDB not available")
+        return 1
+
+    store = get_image_store()
+    created, skipped = 0, 0
+    for record in db.iter_images_missing_thumbnails():
+        if not store.exists(record["filename"]):
+            skipped += 1
+            continue
+        thumb_name = save_thumbnail(store.load(record["filename"]))
+        if thumb_name and db.set_thumbnail(record["id"], thumb_name):
+            created += 1
+        else:
+            skipped += 1
+
+    print(f"Created {created} thumbnails, skipped {skipped}")
+    return 0
+
+
+def migrate_store(args) -> int:
+    """Move images saved as flat IMAGES_DIR/<uuid>.png files into the content-addressed store"""
+    db = Database()
+    if db.collection is None:
+        print("❌ MongoDB not available")
+        return 1
+
+    legacy = LocalImageStore(settings.IMAGES_DIR)
+    store = get_image_store()
+    migrated, missing = 0, 0
+    for record in db.iter_legacy_images():
+        updates = {}
+        for field in ("filename", "thumbnail_filename"):
+            key = record.get(field)
+            if not key or "/" in key:
+                continue
+            if not legacy.exists(key):
+                missing += 1
+                continue
+            data = legacy.load(key)
+            updates[field] = store.save(data, detect_format(data)[1])
+
+        if updates and db.update_storage_keys(record["id"], updates):
+            migrated += 1
+            if not args.keep:
+                for field, new_key in updates.items():
+                    if legacy.local_path(record[field]) != store.local_path(new_key):
+                        legacy.delete(record[field])
+
+    print(f"Migrated {migrated} records, {missing} files missing")
+    return 0
+
+
+def export_images(args) -> int:
+    """Stream a ZIP of images and a JSONL manifest matching the filters to a file or stdout"""
+    db = Database()
+    if db.collection is None:
+        print("❌ MongoDB not available", file=sys.stderr)
+        return 1
+
+    filters = {
+        "styles": args.style,
+        "min_rating": args.min_rating,
+        "max_rating": args.max_rating,
+        "start": datetime.fromisoformat(args.since) if args.since else None,
+        # --until is inclusive of the whole day when only a date is given
+        "end": datetime.fromisoformat(args.until) + (timedelta(days=1) if len(args.until) == 10 else timedelta())
+        if args.until else None,
+    }
+    size = 0
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in stream_export(db, filters):
+            output.write(chunk)
+            size += len(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+    print(f"Exported {size/1024/1024:.1f} MB to {args.output}", file=sys.stderr)
+    return 0
+
+
+def reconcile_storage(args) -> int:
+    """Delete orphaned blobs, mark records with missing files and evict images above the disk quota"""
+    db = Database()
+    if db.collection is None:
+        print("❌ MongoDB not available")
+        return 1
+
+    reconciler = StorageReconciler(
+        db,
+        quota_bytes=settings.STORAGE_QUOTA_BYTES if args.quota_mb is None else args.quota_mb * 1024 * 1024,
+        policy=args.policy,
+    )
+    report = reconciler.run(dry_run=args.dry_run)
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        verb = "Would reclaim" if args.dry_run else "Reclaimed"
+        print(f"{verb} {report['reclaimed_bytes']/1024/1024:.1f} MB")
+        print(f"  Orphaned blobs:   {report['orphans_deleted']} ({report['orphan_bytes']/1024/1024:.1f} MB) of {report['blobs_scanned']} scanned")
+        print(f"  Evicted images:   {report['evicted']} ({report['evicted_bytes']/1024/1024:.1f} MB, {report['policy']})")
+        print(f"  Missing files:    {report['marked_missing']} marked, {report['restored']} restored of {report['records_scanned']} records")
+        print(f"  Stored:           {report['stored_bytes']/1024/1024:.1f} MB")
+    return 0
+
+
+def bulk_generate(args) -> int:
+    """Generate an image for every prompt in a JSONL file, resuming from its checkpoint"""
+    db = Database()
+    if db.collection is None:
+        print("❌ MongoDB not available", file=sys.stderr)
+        return 1
+
+    checkpoint_path = args.checkpoint or f"{args.input}.checkpoint.jsonl"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    try:
+        checkpoint = Checkpoint(checkpoint_path)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    if checkpoint.resumed:
+        print(f"Resuming run {checkpoint.run_id}: {len(checkpoint.completed)} items already done", file=sys.stderr)
+
+    generator = get_image_generator()
+    # This process has its own quota: hold up to `concurrency` calls at the provider's rate
+    rate = settings.PROVIDER_RATE_LIMIT if args.rate is None else args.rate
+    generator.admission = AdmissionController(
+        rate_per_minute=rate,
+        max_queue=args.concurrency,
+        max_per_user=args.concurrency,
+        timeout=args.timeout,
+    ) if rate > 0 else None
+
+    bulk = BulkGeneration(
+        db,
+        generator,
+        checkpoint,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        batch_size=args.batch_size,
+    )
+    resume_hint = f"run the same command again to resume from {checkpoint_path}"
+    try:
+        summary = bulk.run(read_items(args.input, args.style, args.tier))
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"❌ {e}; {resume_hint}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    if summary["error"]:
+        print(f"❌ {summary['error']}; {resume_hint}", file=sys.stderr)
+        return 1
+    if summary["interrupted"]:
+        print(f"Interrupted; {resume_hint}", file=sys.stderr)
+        return 130
+    return 1 if summary["failed"] else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Maintenance commands for the text-to-image app")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    indexes_parser = subparsers.add_parser("indexes", help="Check indexes and query plans")
+    indexes_parser.add_argument("--create", action="store_true", help="Create missing indexes first")
+    indexes_parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    indexes_parser.set_defaults(func=check_indexes)
+
+    stats_parser = subparsers.add_parser("rebuild-stats", help="Recompute the materialized stats document (run with the app idle)")
+    stats_parser.set_defaults(func=rebuild_stats)
+
+    thumbnails_parser = subparsers.add_parser("thumbnails", help="Backfill thumbnails for existing images")
+    thumbnails_parser.set_defaults(func=backfill_thumbnails)
+
+    migrate_parser = subparsers.add_parser("migrate-store", help="Move flat legacy image files into the content-addressed store")
+    migrate_parser.add_argument("--keep", action="store_true", help="Keep the legacy files after copying")
+    migrate_parser.set_defaults(func=migrate_store)
+
+    export_parser = subparsers.add_parser("export", help="Export images and a JSONL manifest as a ZIP archive")
+    export_parser.add_argument("--output", "-o", default="export.zip", help="Archive path, or - for stdout")
+    export_parser.add_argument("--style", action="append", choices=list(settings.STYLES), help="Style to include (repeatable)")
+    export_parser.add_argument("--min-rating", type=int, help="Minimum rating (excludes unrated images)")
+    export_parser.add_argument("--max-rating", type=int, help="Maximum rating (excludes unrated images)")
+    export_parser.add_argument("--since", help="Created on or after (ISO date or datetime)")
+    export_parser.add_argument("--until", help="Created before (ISO datetime) or on (ISO date)")
+    export_parser.set_defaults(func=export_images)
+
+    reconcile_parser = subparsers.add_parser("reconcile", help="Clean up orphaned files, mark missing ones and enforce the disk quota")
+    reconcile_parser.add_argument("--dry-run", action="store_true", help="Report what would change without changing it")
+    reconcile_parser.add_argument("--quota-mb", type=int, help="Disk quota in MB (default: STORAGE_QUOTA_MB)")
+    reconcile_parser.add_argument("--policy", default=settings.EVICTION_POLICY,
+                                  choices=list(EVICTION_SORTS), help="Eviction order")
+    reconcile_parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    reconcile_parser.set_defaults(func=reconcile_storage)
+
+    generate_parser = subparsers.add_parser("generate", help="Generate images for a JSONL file of prompts without the UI")
+    generate_parser.add_argument("input", help='JSONL file: one {"prompt", "style"?, "tier"?, "id"?} object or string per line')
+    generate_parser.add_argument("--style", default="realistic", choices=list(settings.STYLES), help="Default style")
+    generate_parser.add_argument("--tier", default=settings.DEFAULT_QUALITY_TIER,
+                                 choices=list(settings.QUALITY_TIERS), help="Default quality tier")
+    generate_parser.add_argument("--concurrency", type=int, default=settings.GENERATION_CONCURRENCY,
+                                 help="Provider calls in flight")
+    generate_parser.add_argument("--rate", type=float, help="Provider calls per minute (default: PROVIDER_RATE_LIMIT, 0 for none)")
+    generate_parser.add_argument("--timeout", type=float, default=settings.GENERATION_TIMEOUT, help="Seconds per image")
+    generate_parser.add_argument("--batch-size", type=int, default=settings.WRITE_BATCH_SIZE,
+                                 help="Records per bulk insert and checkpoint")
+    generate_parser.add_argument("--checkpoint", help="Checkpoint file (default: <input>.checkpoint.jsonl)")
+    generate_parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start a new run")
+    generate_parser.add_argument("--summary", help="Also write the run summary as JSON")
+    generate_parser.set_defaults(func=bulk_generate)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
 
 class FeedbackData(BaseModel):
     rating: int
@@ -15,4 +15,22 @@ class ImageRecord(BaseModel):
     generation_time: Optional[float] = None
     status: str = "completed"
     file_size: Optional[int] = None
-    feedback_data: FeedbackData
\ No newline at end of file
+    thumbnail_filename: Optional[str] = None
+    # None while the image file is stored; "evicted" (thumbnail kept) or "missing", set by storage reconciliation
+    file_state: Optional[str] = None
+    last_viewed_at: Optional[datetime] = None
+    # Seconds spent in each stage (prompt_enhance, provider_call, image_encode, file_write, db_insert, ...)
+    timings: Optional[Dict[str, float]] = None
+    # Quality tier of the stored image and generation seconds per tier tried (e.g. draft then final)
+    quality_tier: Optional[str] = None
+    tier_times: Optional[Dict[str, float]] = None
+    feedback_data: Optional[FeedbackData] = None
+    # Browser session that requested the image, for fair scheduling of provider calls
+    user_id: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    worker_id: Optional[str] = None
+    started_at: Optional[datetime] = None
+    # When a finished job was queued again (refine or retry); queue_wait is measured from here
+    queued_at: Optional[datetime] = None
+    lease_expires_at: Optional[datetime] = None
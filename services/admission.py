@@ -0,0 +1,194 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a provider call cannot be admitted (queue full or wait timed out)"""
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self) -> float:
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Waiter:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.admitted = threading.Event()
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """Admits provider calls at the provider's quota, fairly across users.
+
+    Callers wait in a per-user FIFO queue. A dispatcher thread hands out
+    tokens from a global token bucket to users in round-robin order, so
+    one user with many requests cannot starve the others. When the total
+    queue is full, or a user already has `max_per_user` requests waiting,
+    new requests are rejected immediately instead of piling up.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = settings.PROVIDER_RATE_LIMIT,
+        burst: float = settings.PROVIDER_BURST,
+        max_queue: int = settings.ADMISSION_MAX_QUEUE,
+        max_per_user: int = settings.ADMISSION_MAX_PER_USER,
+        timeout: float = settings.ADMISSION_TIMEOUT,
+    ):
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.timeout = timeout
+
+        # user id -> waiting requests; order of keys is the round-robin order
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._dispatch, name="admission", daemon=True)
+        self._thread.start()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._waiting:
+                    self._condition.wait()
+                while self._waiting and self.bucket.take():
+                    # Serve the user at the front of the rotation, then move them to the back
+                    user_id, queue = next(iter(self._queues.items()))
+                    waiter = queue.popleft()
+                    self._waiting -= 1
+                    if queue:
+                        self._queues.move_to_end(user_id)
+                    else:
+                        del self._queues[user_id]
+                    self.admitted += 1
+                    self.total_wait += time.monotonic() - waiter.enqueued_at
+                    waiter.admitted.set()
+                if self._waiting:
+                    self._condition.wait(self.bucket.time_until_token())
+
+    def acquire(
+        self,
+        user_id: Optional[str] = None,
+        on_wait: Optional[Callable[[int, float], None]] = None,
+        poll_interval: float = 1.0,
+    ):
+        """Block until a provider call is admitted for `user_id`.
+
+        `on_wait(position, eta_seconds)` is called while waiting so callers can
+        show progress. Raises AdmissionRejected when the queue is full or the
+        wait exceeds the timeout.
+        """
+        user_id = user_id or "anonymous"
+        waiter = _Waiter(user_id)
+        with self._condition:
+            queue = self._queues.get(user_id)
+            if self._waiting >= self.max_queue or (queue and len(queue) >= self.max_per_user):
+                self.rejected += 1
+                raise AdmissionRejected("Too many generation requests are waiting, please try again shortly")
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+            queue.append(waiter)
+            self._waiting += 1
+            self._condition.notify_all()
+
+        deadline = time.monotonic() + self.timeout
+        while not waiter.admitted.wait(poll_interval):
+            if time.monotonic() >= deadline:
+                with self._condition:
+                    if not waiter.admitted.is_set():
+                        self._queues[user_id].remove(waiter)
+                        if not self._queues[user_id]:
+                            del self._queues[user_id]
+                        self._waiting -= 1
+                        self.rejected += 1
+                        raise AdmissionRejected(f"Timed out after {self.timeout:.0f}s waiting for the provider")
+                break
+            if on_wait is not None:
+                position, eta = self.position(waiter)
+                on_wait(position, eta)
+
+    def try_acquire(self) -> bool:
+        """Admit a call only if a token is free now and no one is queued ahead of it"""
+        with self._condition:
+            if self._waiting or not self.bucket.take():
+                return False
+            self.admitted += 1
+            return True
+
+    def position(self, waiter: _Waiter):
+        """(requests admitted before this one, estimated seconds until it is admitted)"""
+        with self._condition:
+            queue = self._queues.get(waiter.user_id)
+            if not queue or waiter not in queue:
+                return 0, 0.0
+            index = queue.index(waiter)
+            # Round-robin: every other user with more than `index` requests gets a turn first
+            ahead = index + sum(min(len(q), index + 1) for user, q in self._queues.items() if user != waiter.user_id)
+            eta = self.bucket.time_until_token() + ahead / self.bucket.rate
+            return ahead + 1, eta
+
+    def estimate_wait(self) -> float:
+        """Seconds a request arriving now would wait if the queue is served at the quota"""
+        with self._condition:
+            return self.bucket.time_until_token() + self._waiting / self.bucket.rate
+
+    def stats(self) -> dict:
+        """Return admission counters"""
+        with self._condition:
+            return {
+                "waiting": self._waiting,
+                "users_waiting": len(self._queues),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+                "rate_per_minute": self.bucket.rate * 60,
+            }
+
+
+_shared_controller: Optional[AdmissionController] = None
+_shared_lock = threading.Lock()
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Return the process-wide admission controller, or None when admission control is disabled"""
+    global _shared_controller
+    if not settings.ADMISSION_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_controller is None:
+            _shared_controller = AdmissionController()
+        return _shared_controller
@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from itertools import groupby, islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config import settings
+from models import ImageRecord
+from services.image_codec import detect_format
+from services.image_store import get_image_store
+from services.metrics import percentiles
+from services.thumbnails import save_thumbnail
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class RecordWriteError(RuntimeError):
+    """Raised when a batch of records cannot be written after all retries"""
+
+
+def read_items(path: str, style: str, tier: str) -> Iterator[dict]:
+    """Parse a JSONL prompt file, one {"prompt", "style"?, "tier"?, "id"?} object (or plain string) per line.
+
+    Each item gets a stable key: its "id" if given, else a hash of its
+    prompt, style and tier plus how many identical lines came before it,
+    so the key survives lines being added elsewhere in the file.
+    """
+    seen: Dict[str, int] = {}
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_no}: invalid JSON: {e}")
+            if isinstance(entry, str):
+                entry = {"prompt": entry}
+
+            item = {
+                "prompt": str(entry.get("prompt") or "").strip(),
+                "style": entry.get("style") or style,
+                "tier": entry.get("tier") or tier,
+            }
+            if not item["prompt"]:
+                raise ValueError(f"{path}:{line_no}: missing prompt")
+            if item["style"] not in settings.STYLES:
+                raise ValueError(f"{path}:{line_no}: unknown style {item['style']!r}")
+            if item["tier"] not in settings.QUALITY_TIERS:
+                raise ValueError(f"{path}:{line_no}: unknown quality tier {item['tier']!r}")
+
+            identity = json.dumps([item["prompt"], item["style"], item["tier"]])
+            seen[identity] = seen.get(identity, 0) + 1
+            if entry.get("id") is not None:
+                item["key"] = str(entry["id"])
+            else:
+                item["key"] = hashlib.sha256(f"{identity}#{seen[identity]}".encode()).hexdigest()[:16]
+            yield item
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished items, so an interrupted run can resume.
+
+    The first line holds the run id, from which record ids are derived;
+    every later line is one item whose record is durably written (or which
+    failed). Completed items are skipped on resume, failed ones are retried.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = set()
+        self.failed = set()
+        header = self._read_header(path)
+        if header is not None:
+            self.run_id = uuid.UUID(header["run_id"])
+            with open(path) as f:
+                f.readline()
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line from a crash mid-write
+                        continue
+                    if entry["status"] == "completed":
+                        self.completed.add(entry["key"])
+                        self.failed.discard(entry["key"])
+                    else:
+                        self.failed.add(entry["key"])
+            self.resumed = True
+        else:
+            self.run_id = uuid.uuid4()
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps({"run_id": str(self.run_id), "started_at": datetime.now().isoformat()}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self.resumed = False
+        self._file = open(path, "a")
+
+    @staticmethod
+    def _read_header(path: str) -> Optional[dict]:
+        """The run header, or None to start a new run (no file, or an empty one left by a crash)"""
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            first = f.readline()
+            has_entries = bool(f.readline())
+        try:
+            header = json.loads(first)
+            uuid.UUID(header["run_id"])
+            return header
+        except (ValueError, KeyError, TypeError):
+            if first.strip() or has_entries:
+                # Without the run id, record ids cannot be derived again and a resume would duplicate images
+                raise ValueError(f"{path}: unreadable checkpoint header; use --restart to start a new run")
+            return None
+
+    def image_id(self, key: str) -> str:
+        """Deterministic record id of an item in this run (a retried write is a duplicate, not a second record)"""
+        return str(uuid.uuid5(self.run_id, key))
+
+    def record(self, entries: List[dict]):
+        for entry in entries:
+            self._file.write(json.dumps(entry) + "\n")
+            if entry["status"] == "completed":
+                self.completed.add(entry["key"])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class BulkGeneration:
+    """Generates images for a stream of prompt items without the UI.
+
+    Items are read `chunk_size` at a time and generated through
+    `ImageGenerator.generate_images` (its concurrency, timeout, result cache,
+    single-flight and admission rate limit all apply). Images are stored as
+    they finish; their records are inserted with `insert_many` every
+    `batch_size` results, and only then checkpointed, so a resumed run never
+    regenerates an item whose record was written.
+    """
+
+    def __init__(
+        self,
+        db,
+        generator,
+        checkpoint: Checkpoint,
+        concurrency: int = settings.GENERATION_CONCURRENCY,
+        timeout: float = settings.GENERATION_TIMEOUT,
+        batch_size: int = settings.WRITE_BATCH_SIZE,
+        chunk_size: int = 1000,
+        retry_attempts: int = settings.WRITE_RETRY_ATTEMPTS,
+        user_id: str = "bulk",
+    ):
+        self.db = db
+        self.generator = generator
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.retry_attempts = retry_attempts
+        self.user_id = user_id
+        self.store = get_image_store()
+
+        self._records: List[dict] = []
+        self._entries: List[dict] = []
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.latencies: List[float] = []
+        self.stages: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def run(self, items: Iterable[dict]) -> dict:
+        """Generate every item not already checkpointed; returns a summary"""
+        started = time.monotonic()
+        interrupted, error = False, None
+        try:
+            asyncio.run(self._run(items))
+        except KeyboardInterrupt:
+            interrupted = True
+        except RecordWriteError as e:
+            error = str(e)
+        finally:
+            try:
+                if error is None:
+                    # Images generated before an interruption are kept
+                    self._flush()
+            except RecordWriteError as e:
+                error = str(e)
+            finally:
+                self.checkpoint.close()
+        return self.summary(time.monotonic() - started, interrupted, error)
+
+    async def _run(self, items: Iterable[dict]):
+        loop = asyncio.get_running_loop()
+        for chunk in _batches(items, self.chunk_size):
+            todo = [item for item in chunk if item["key"] not in self.checkpoint.completed]
+            self.skipped += len(chunk) - len(todo)
+            # Records written just before an interruption, before their checkpoint entry
+            written = await loop.run_in_executor(
+                None, self.db.existing_ids, [self.checkpoint.image_id(item["key"]) for item in todo]
+            )
+            if written:
+                self.checkpoint.record([
+                    {"key": item["key"], "id": self.checkpoint.image_id(item["key"]), "status": "completed"}
+                    for item in todo if self.checkpoint.image_id(item["key"]) in written
+                ])
+                self.skipped += len(written)
+                todo = [item for item in todo if self.checkpoint.image_id(item["key"]) not in written]
+
+            for tier, group in groupby(sorted(todo, key=lambda item: item["tier"]), key=lambda item: item["tier"]):
+                group = list(group)
+                async for result in self.generator.generate_images(
+                    [(item["prompt"], item["style"]) for item in group],
+                    concurrency=self.concurrency,
+                    timeout=self.timeout,
+                    tier=tier,
+                    user_id=self.user_id,
+                ):
+                    item = group[result["index"]]
+                    if result["image"]:
+                        # Encoding thumbnails and writing files stays off the event loop
+                        record = await loop.run_in_executor(None, self._store, item, result)
+                        self._completed(item, result, record)
+                    else:
+                        self._failed(item, result["error"])
+                    if len(self._records) >= self.batch_size:
+                        # Inserts, retry backoff and the checkpoint fsync must not stall finished generations
+                        await loop.run_in_executor(None, self._flush)
+
+    def _store(self, item: dict, result: dict) -> dict:
+        image_data = result["image"]
+        timer_stages = dict(result["timings"])
+        started = time.perf_counter()
+        filename = self.store.save(image_data, detect_format(image_data)[1])
+        timer_stages["file_write"] = time.perf_counter() - started
+        started = time.perf_counter()
+        thumbnail = save_thumbnail(image_data)
+        timer_stages["thumbnail"] = time.perf_counter() - started
+
+        return ImageRecord(
+            id=self.checkpoint.image_id(item["key"]),
+            prompt=item["prompt"],
+            expected_style=item["style"],
+            filename=filename,
+            created_at=datetime.now(),
+            generation_time=result["generation_time"],
+            status="completed",
+            file_size=len(image_data),
+            thumbnail_filename=thumbnail,
+            timings=timer_stages,
+            quality_tier=item["tier"],
+            tier_times={item["tier"]: result["generation_time"]},
+            user_id=self.user_id,
+        ).model_dump()
+
+    def _completed(self, item: dict, result: dict, record: dict):
+        self._records.append(record)
+        self._entries.append({"key": item["key"], "id": record["id"], "status": "completed"})
+        self.latencies.append(result["generation_time"])
+        for stage, seconds in record["timings"].items():
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def _failed(self, item: dict, error: Optional[str]):
+        self.failed += 1
+        error = error or "unknown error"
+        self.errors[error] = self.errors.get(error, 0) + 1
+        self._entries.append({"key": item["key"], "status": "failed", "error": error})
+
+    def _flush(self):
+        """Insert buffered records, then checkpoint them (and any failures)"""
+        if self._records:
+            records = self._records
+            delay = 0.1
+            for attempt in range(self.retry_attempts):
+                if attempt:
+                    time.sleep(delay)
+                    delay = min(delay * 2, settings.WRITE_RETRY_MAX_DELAY)
+                    self.db.check_health()
+                    # Without a unique id index, a retry must not insert what an earlier attempt wrote
+                    written = self.db.existing_ids([record["id"] for record in records])
+                    records = [record for record in records if record["id"] not in written]
+                if self.db.save_image_records(records):
+                    break
+            else:
+                raise RecordWriteError(f"Could not write {len(self._records)} image records")
+            self.completed += len(self._records)
+            print(f"  {self.completed} generated, {self.failed} failed, {self.skipped} skipped", file=sys.stderr)
+        self.checkpoint.record(self._entries)
+        self._records, self._entries = [], []
+
+    def summary(self, elapsed: float, interrupted: bool = False, error: Optional[str] = None) -> dict:
+        """Machine-readable throughput and latency of this run"""
+        latency = percentiles(self.latencies, QUANTILES)
+        if self.latencies:
+            latency.update(mean=sum(self.latencies) / len(self.latencies), max=max(self.latencies))
+        return {
+            "run_id": str(self.checkpoint.run_id),
+            "resumed": self.checkpoint.resumed,
+            "interrupted": interrupted,
+            "error": error,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed": elapsed,
+            "throughput_per_minute": self.completed / elapsed * 60 if elapsed else 0.0,
+            "concurrency": self.concurrency,
+            "latency": latency,
+            "stages": {stage: percentiles(values, QUANTILES) for stage, values in sorted(self.stages.items())},
+            "errors": dict(sorted(self.errors.items(), key=lambda error: -error[1])[:10]),
+        }
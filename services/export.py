@@ -0,0 +1,118 @@
+import io
+import os
+import json
+import zipfile
+import tempfile
+import posixpath
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from config import settings
+from services.image_store import get_image_store
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only, non-seekable file that hands written bytes to a generator.
+
+    zipfile falls back to data descriptors on unseekable files, so entries
+    can be written front to back and drained after every chunk.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def archive_path(record: dict) -> str:
+    """Path of a record's image inside the archive"""
+    return posixpath.join("images", f"{record['id']}{posixpath.splitext(record['filename'])[1]}")
+
+
+def manifest_line(record: dict, path: Optional[str]) -> str:
+    """One JSONL manifest entry: the ImageRecord fields plus where the image is in the archive"""
+    entry = {key: value for key, value in record.items() if key != "_id"}
+    entry["archive_path"] = path
+    return json.dumps(entry, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+
+def stream_export(db, filters: Optional[dict] = None, chunk_size: int = settings.EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a ZIP archive of the images matching `filters` and a JSONL manifest, chunk by chunk.
+
+    Records are read in one cursor pass. Images are copied from the store
+    `chunk_size` bytes at a time, and each record's manifest line is
+    spooled to a temporary file and written as the last entry, so the
+    manifest lists exactly what was archived and memory use does not depend
+    on the number or size of exported images.
+    """
+    store = get_image_store()
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as archive, \
+            tempfile.SpooledTemporaryFile(max_size=chunk_size) as manifest_lines:
+        for record in db.iter_images(filters):
+            path = None
+            try:
+                source = store.open(record["filename"])
+            except Exception:
+                # Missing or evicted file: listed in the manifest without an image
+                source = None
+            if source is not None:
+                path = archive_path(record)
+                # Images are already compressed formats; store them as-is
+                info = zipfile.ZipInfo(path, date_time=record["created_at"].timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with source, archive.open(info, "w", force_zip64=True) as entry:
+                    while True:
+                        chunk = source.read(chunk_size)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        yield sink.drain()
+            manifest_lines.write((manifest_line(record, path) + "\n").encode("utf-8"))
+
+        manifest_lines.seek(0)
+        manifest = zipfile.ZipInfo(MANIFEST_NAME, date_time=datetime.now().timetuple()[:6])
+        manifest.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(manifest, "w", force_zip64=True) as entry:
+            while True:
+                chunk = manifest_lines.read(chunk_size)
+                if not chunk:
+                    break
+                entry.write(chunk)
+                data = sink.drain()
+                if data:
+                    yield data
+    # Remaining entry headers and the central directory, written when the archive is closed
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def write_export(db, path: str, filters: Optional[dict] = None) -> int:
+    """Stream an export archive to a file; returns its size in bytes"""
+    size = 0
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for chunk in stream_export(db, filters):
+            f.write(chunk)
+            size += len(chunk)
+    os.replace(tmp_path, path)
+    return size
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from config import settings
+
+
+def _sort_key(record: dict) -> Tuple[datetime, str]:
+    return record["created_at"], record["id"]
+
+
+class GalleryView:
+    """Session-local model of the newest Gallery page, kept current from deltas.
+
+    Holds at most `limit` records, reduced to the fields the Gallery renders.
+    `apply` merges a `Database.get_gallery_delta` result: new and changed
+    records are inserted in (created_at, id) order, deleted ones (including
+    records no longer shown) are dropped, and the page is trimmed back to
+    `limit`. When removals leave fewer than `limit` records although older
+    ones exist, the view marks itself stale and the caller reloads the page.
+    """
+
+    def __init__(self, page: dict, limit: int, fields: dict):
+        self.limit = limit
+        self.fields = [field for field, include in fields.items() if include]
+        self.items: List[dict] = [self._slim(record) for record in page["items"]][:limit]
+        self.has_next = page["has_next"]
+        self.watermark: Optional[Tuple[datetime, str]] = _sort_key(self.items[0]) if self.items else None
+        self.loaded_at = self.synced_at = datetime.now()
+        self.stale = False
+
+    def _slim(self, record: dict) -> dict:
+        return {field: record.get(field) for field in self.fields}
+
+    def needs_reload(self, limit: int) -> bool:
+        """Whether the page must be loaded again instead of refreshed from a delta"""
+        # Past the change log TTL, deletions since the last sync may already be forgotten
+        expired = datetime.now() - self.synced_at > timedelta(seconds=settings.CHANGE_LOG_TTL)
+        return self.stale or expired or limit != self.limit
+
+    def apply(self, delta: dict) -> bool:
+        """Merge a delta into the page; returns whether anything visible changed"""
+        items = {record["id"]: record for record in self.items}
+        before = [(record["id"], record) for record in self.items]
+        # Records older than the page's oldest one belong to later pages
+        oldest = _sort_key(self.items[-1]) if self.items and self.has_next else None
+
+        for image_id in delta["deleted"]:
+            items.pop(image_id, None)
+        for record in delta["changed"] + delta["new"]:
+            if oldest is None or _sort_key(record) >= oldest:
+                items[record["id"]] = self._slim(record)
+            if self.watermark is None or _sort_key(record) > self.watermark:
+                self.watermark = _sort_key(record)
+
+        ordered = sorted(items.values(), key=_sort_key, reverse=True)
+        if len(ordered) > self.limit:
+            self.has_next = True
+        elif len(ordered) < self.limit and self.has_next:
+            # A gap opened at the end of the page that only a reload can fill
+            self.stale = True
+        self.items = ordered[:self.limit]
+        self.synced_at = delta["synced_at"]
+        return [(record["id"], record) for record in self.items] != before
+
+    def page(self) -> dict:
+        """The page in the shape returned by `Database.get_images_page`"""
+        return {
+            "items": self.items,
+            "has_prev": False,
+            "has_next": self.has_next,
+            "first": _sort_key(self.items[0]) if self.items else None,
+            "last": _sort_key(self.items[-1]) if self.items else None,
+        }
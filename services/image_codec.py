@@ -0,0 +1,56 @@
+from io import BytesIO
+from typing import Tuple
+
+from PIL import Image
+
+from config import settings
+
+# Magic-number prefixes of the formats we store: (format, extension, mime type)
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", ("PNG", "png", "image/png")),
+    (b"\xff\xd8\xff", ("JPEG", "jpg", "image/jpeg")),
+    (b"GIF8", ("GIF", "gif", "image/gif")),
+]
+
+
+def detect_format(image_data: bytes) -> Tuple[str, str, str]:
+    """Return (format, extension, mime type) of encoded image bytes"""
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "WEBP", "webp", "image/webp"
+    for signature, info in _SIGNATURES:
+        if image_data.startswith(signature):
+            return info
+    return "PNG", "png", "image/png"
+
+
+def extension_mime(filename: str) -> str:
+    """Mime type of a stored image file, based on its extension"""
+    extension = filename.rsplit(".", 1)[-1].lower()
+    return {"jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp", "gif": "image/gif"}.get(extension, "image/png")
+
+
+def encode_image(image: Image.Image) -> bytes:
+    """Encode a PIL image in the configured output format.
+
+    Images returned by the provider are opened lazily from the response
+    bytes; when those are already in the requested format they are returned
+    as-is instead of being decoded and re-encoded.
+    """
+    output_format = settings.OUTPUT_FORMAT
+    source = getattr(image, "fp", None)
+    if isinstance(source, BytesIO) and image.format and output_format in ("AUTO", image.format):
+        return source.getvalue()
+
+    if output_format == "AUTO":
+        output_format = "PNG"
+
+    buffer = BytesIO()
+    if output_format == "JPEG":
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=settings.OUTPUT_QUALITY, optimize=True)
+    elif output_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=settings.OUTPUT_QUALITY, lossless=settings.OUTPUT_LOSSLESS)
+    else:
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
@@ -1,49 +1,249 @@
 import os
+import time
+import asyncio
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from huggingface_hub import InferenceClient
-from io import BytesIO
+import threading
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 
 from config import settings
+from services.admission import AdmissionController, AdmissionRejected, get_admission_controller
+from services.image_codec import encode_image
+from services.metrics import StageTimer
+from services.provider_router import Endpoint, ProviderRouter, parse_endpoints
+from services.result_cache import ResultCache, get_result_cache
+from services.single_flight import get_single_flight
 
 logger = logging.getLogger(__name__)
 
+
 class ImageGenerator:
-    def __init__(self):
+    def __init__(self, client=None):
         self.api_url = settings.HF_API_URL
         self.model = os.getenv("MODEL", "stabilityai/stable-diffusion-xl-base-1.0")
+        self.provider = os.getenv("PROVIDER", "nebius")
 
-        self.client = InferenceClient(
-            provider=os.getenv("PROVIDER", "nebius"),
+        # Any object with InferenceClient's text_to_image() can be injected (e.g. a fake for benchmarks)
+        self.requires_token = client is None
+        if client is None and settings.PROVIDER_ENDPOINTS:
+            client = self.build_router(parse_endpoints(settings.PROVIDER_ENDPOINTS))
+        self.client = client or InferenceClient(
+            provider=self.provider,
             api_key=os.environ["HF_TOKEN"],
+            timeout=settings.HF_TIMEOUT,
         )
+        if isinstance(self.client, ProviderRouter):
+            # Routed results may come from any endpoint, so they share one cache namespace
+            self.provider = "router"
+            self.model = ",".join(endpoint.name for endpoint in self.client.endpoints)
+        self.cache = get_result_cache()
+        self.single_flight = get_single_flight()
+        self.admission = get_admission_controller()
+
+    @property
+    def admission(self) -> Optional[AdmissionController]:
+        return self._admission
+
+    @admission.setter
+    def admission(self, admission: Optional[AdmissionController]):
+        self._admission = admission
+        # Hedged requests draw on the same quota as the calls admitted here
+        if isinstance(self.client, ProviderRouter):
+            self.client.admission = admission
+
+    @staticmethod
+    def build_router(pairs: List[Tuple[str, str]]) -> ProviderRouter:
+        """Router over one InferenceClient per (provider, model) endpoint"""
+        endpoints = [
+            Endpoint(
+                provider,
+                model,
+                InferenceClient(provider=provider, api_key=os.environ["HF_TOKEN"], timeout=settings.HF_TIMEOUT),
+            )
+            for provider, model in pairs
+        ]
+        return ProviderRouter(endpoints)
+
+    def router_stats(self) -> Optional[List[dict]]:
+        """Per-endpoint routing statistics, when requests are routed"""
+        if isinstance(self.client, ProviderRouter):
+            return self.client.stats()
+        return None
 
-    
     def enhance_prompt(self, prompt: str, style: str) -> str:
         """Enhance prompt based on selected style"""
         enhancement = settings.STYLES.get(style, "")
         return f"{prompt}, {enhancement}" if enhancement else prompt
-    
-    def generate_image(self, prompt: str, style: str = "realistic") -> bytes:
-        """Generate image using Hugging Face API"""
-        if not settings.HF_API_TOKEN:
+
+    def cache_key(self, enhanced_prompt: str, params: dict = None) -> str:
+        """Cache key for an enhanced prompt and its generation parameters"""
+        return ResultCache.make_key(self.model, self.provider, enhanced_prompt, params)
+
+    def generate_image(
+        self,
+        prompt: str,
+        style: str = "realistic",
+        timer: Optional[StageTimer] = None,
+        tier: Optional[str] = None,
+        user_id: Optional[str] = None,
+        on_wait: Optional[Callable[[int, float], None]] = None,
+    ) -> Optional[bytes]:
+        """Generate image using Hugging Face API at a quality tier, recording stage timings on `timer`.
+
+        Provider calls wait for admission in `user_id`'s fair queue; `on_wait`
+        receives (queue position, estimated wait) meanwhile. Returns None when
+        the provider fails and raises AdmissionRejected when the call is not
+        admitted.
+        """
+        if self.requires_token and not settings.HF_API_TOKEN:
             raise ValueError("❌ Hugging Face API token not configured")
-        
-        enhanced_prompt = self.enhance_prompt(prompt, style)
-        
-        try:
+
+        timer = timer or StageTimer(style=style)
+        with timer.span("prompt_enhance"):
+            enhanced_prompt = self.enhance_prompt(prompt, style)
+        tier_params = settings.QUALITY_TIERS[tier or settings.DEFAULT_QUALITY_TIER]
+        params = {
+            "format": settings.OUTPUT_FORMAT,
+            "quality": settings.OUTPUT_QUALITY,
+            "lossless": settings.OUTPUT_LOSSLESS,
+            **tier_params,
+        }
+
+        key = self.cache_key(enhanced_prompt, params)
+        if self.cache is not None:
+            with timer.span("cache_lookup"):
+                cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"Result cache hit for {key[:12]}")
+                return cached
+
+        def call_provider() -> bytes:
+            if self.admission is not None:
+                with timer.span("admission_wait"):
+                    self.admission.acquire(user_id, on_wait)
+
             # output is a PIL.Image object
-            image = self.client.text_to_image(
-                enhanced_prompt,
-                model=self.model,
-            )
+            with timer.span("provider_call"):
+                image = self.client.text_to_image(
+                    enhanced_prompt,
+                    model=self.model,
+                    **tier_params,
+                )
 
-            buffer = BytesIO()
-            image.save(buffer, format="PNG")  # Or JPEG, WEBP etc.
-            image_bytes = buffer.getvalue()   # byte-like data 
+            # Reuses the provider's bytes when they are already in the output format
+            with timer.span("image_encode"):
+                image_bytes = encode_image(image)
 
+            if self.cache is not None:
+                self.cache.put(key, image_bytes)
             return image_bytes
-    
+
+        try:
+            if self.single_flight is None:
+                return call_provider()
+
+            # Identical requests already in flight (other sessions, double clicks) share one provider call
+            start = time.perf_counter()
+            image_bytes, shared = self.single_flight.do(key, call_provider)
+            if shared:
+                logger.info(f"Coalesced with in-flight request {key[:12]}")
+                timer.record("coalesced_wait", time.perf_counter() - start)
+            return image_bytes
+
+        except AdmissionRejected:
+            raise
         except Exception as e:
-            print(f"Failed to Generate the image: {e}")
-            return None
\ No newline at end of file
+            logger.error(f"Failed to Generate the image: {e}")
+            return None
+
+    async def generate_images(
+        self,
+        requests: List[Tuple[str, str]],
+        concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        tier: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> AsyncIterator[dict]:
+        """Generate many (prompt, style) pairs concurrently, yielding results as they finish.
+
+        At most `concurrency` provider calls are in flight at once and each one
+        is given `timeout` seconds. A timed-out call keeps its slot until its
+        worker thread returns. Closing the iterator early cancels every
+        request that has not started yet.
+        """
+        concurrency = concurrency or settings.GENERATION_CONCURRENCY
+        timeout = timeout if timeout is not None else settings.GENERATION_TIMEOUT
+
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="generate")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index: int, prompt: str, style: str) -> dict:
+            await semaphore.acquire()
+            start_time = time.time()
+            timer = StageTimer(style=style)
+            image_data, error = None, None
+            call = loop.run_in_executor(executor, self.generate_image, prompt, style, timer, tier, user_id)
+            try:
+                # Shielded: a timeout abandons the call, but its worker thread keeps running
+                image_data = await asyncio.wait_for(asyncio.shield(call), timeout)
+                if image_data is None:
+                    error = "Provider returned no image"
+            except asyncio.TimeoutError:
+                error = f"Timed out after {timeout:.0f}s"
+            except Exception as e:
+                error = str(e)
+            finally:
+                # Hold the slot until the worker thread is free again, so later requests
+                # never queue behind a timed-out call and their timeout only covers their own call
+                if call.done():
+                    semaphore.release()
+                else:
+                    call.add_done_callback(lambda _: semaphore.release())
+
+            return {
+                "index": index,
+                "prompt": prompt,
+                "style": style,
+                "image": image_data,
+                "generation_time": time.time() - start_time,
+                "timings": dict(timer.stages),
+                "error": error,
+            }
+
+        tasks = [
+            asyncio.create_task(run(index, prompt, style))
+            for index, (prompt, style) in enumerate(requests)
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Provider calls already running in a worker thread cannot be interrupted;
+            # they finish in the background and only populate the result cache.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_shared_generator: Optional[ImageGenerator] = None
+_shared_lock = threading.Lock()
+
+
+def get_image_generator() -> ImageGenerator:
+    """Return the process-wide ImageGenerator (one InferenceClient shared by all sessions)"""
+    global _shared_generator
+    with _shared_lock:
+        if _shared_generator is None:
+            _shared_generator = ImageGenerator()
+        return _shared_generator
+
+
+def set_image_generator(generator: ImageGenerator):
+    """Make `generator` the process-wide ImageGenerator (e.g. one wrapping a fake provider client)"""
+    global _shared_generator
+    with _shared_lock:
+        _shared_generator = generator
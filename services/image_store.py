@@ -0,0 +1,257 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import BinaryIO, Iterable, Iterator, Optional, Set, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(image_data: bytes, extension: str) -> str:
+    """Content-addressed storage key, sharded by hash prefix (e.g. "ab/cd/abcd....png")"""
+    digest = hashlib.sha256(image_data).hexdigest()
+    shards = [digest[i * 2:i * 2 + 2] for i in range(settings.IMAGE_STORE_SHARD_DEPTH)]
+    return "/".join(shards + [f"{digest}.{extension}"])
+
+
+class ImageStore(ABC):
+    """Interface of an image storage backend.
+
+    Images are addressed by the key returned from `save`, which is what
+    `ImageRecord.filename` holds. Identical bytes map to the same key, so a
+    blob is only written once however many records point at it.
+
+    There is no refcount field on ImageRecord: references to a key are
+    counted with a query (`Database.count_references`) when a record is
+    deleted, so a stored counter can never drift from the records.
+    """
+
+    @abstractmethod
+    def save(self, image_data: bytes, extension: str) -> str:
+        """Store bytes (if not already present) and return their key"""
+
+    def load(self, key: str) -> bytes:
+        """Read the whole blob for a key"""
+        with self.open(key) as f:
+            return f.read()
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Open a blob for streaming reads"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether a blob is stored under a key"""
+
+    def existing_keys(self, keys: Iterable[str]) -> Set[str]:
+        """The subset of `keys` that are stored"""
+        return {key for key in keys if self.exists(key)}
+
+    @abstractmethod
+    def size(self, key: str) -> Optional[int]:
+        """Size of a blob in bytes, or None if it is not stored"""
+
+    @abstractmethod
+    def saved_at(self, key: str) -> Optional[float]:
+        """Timestamp a blob was last written or re-saved, or None if it is not stored"""
+
+    @abstractmethod
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        """(key, size, last written or re-saved timestamp) of every stored blob, streamed"""
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Remove a blob; returns whether it existed"""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of a blob, when the backend has one"""
+        return None
+
+
+class LocalImageStore(ImageStore):
+    """Stores blobs in a sharded directory tree under IMAGES_DIR"""
+
+    def __init__(self, root: str = settings.IMAGES_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def save(self, image_data: bytes, extension: str) -> str:
+        key = content_key(image_data, extension)
+        path = self.local_path(key)
+        try:
+            # Already stored: refresh its mtime so orphan cleanup's grace period covers the new reference
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(image_data)
+            os.replace(tmp_path, path)
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.local_path(key), "rb")
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.local_path(key))
+        except FileNotFoundError:
+            return None
+
+    def saved_at(self, key: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.local_path(key))
+        except FileNotFoundError:
+            return None
+
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        yield from self._walk(self.root, "")
+
+    def _walk(self, path: str, prefix: str) -> Iterator[Tuple[str, int, float]]:
+        # One open directory per shard level; entries are never collected into a list
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._walk(entry.path, f"{prefix}{entry.name}/")
+                elif entry.is_file(follow_symlinks=False):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield f"{prefix}{entry.name}", stat.st_size, stat.st_mtime
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self.local_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class GridFSImageStore(ImageStore):
+    """Stores blobs in a MongoDB GridFS bucket, keyed by filename"""
+
+    def __init__(self, db, bucket_name: str = settings.GRIDFS_BUCKET):
+        import gridfs
+
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=bucket_name)
+        self.files = db[f"{bucket_name}.files"]
+
+    def save(self, image_data: bytes, extension: str) -> str:
+        key = content_key(image_data, extension)
+        # Already stored: refresh its timestamp so orphan cleanup's grace period covers the new reference
+        touched = self.files.update_many({"filename": key}, {"$set": {"metadata.saved_at": datetime.now(timezone.utc)}})
+        if touched.matched_count == 0:
+            self.bucket.upload_from_stream(key, image_data)
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        return self.bucket.open_download_stream_by_name(key)
+
+    def exists(self, key: str) -> bool:
+        return self.files.count_documents({"filename": key}, limit=1) > 0
+
+    def existing_keys(self, keys: Iterable[str]) -> Set[str]:
+        return set(self.files.distinct("filename", {"filename": {"$in": list(keys)}}))
+
+    def size(self, key: str) -> Optional[int]:
+        grid_file = self.files.find_one({"filename": key}, {"length": 1})
+        return grid_file["length"] if grid_file else None
+
+    @staticmethod
+    def _written(grid_file: dict) -> float:
+        written = (grid_file.get("metadata") or {}).get("saved_at") or grid_file["uploadDate"]
+        # GridFS dates come back as naive UTC
+        return written.replace(tzinfo=timezone.utc).timestamp()
+
+    def saved_at(self, key: str) -> Optional[float]:
+        grid_files = self.files.find({"filename": key}, {"uploadDate": 1, "metadata.saved_at": 1})
+        return max((self._written(grid_file) for grid_file in grid_files), default=None)
+
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        for grid_file in self.files.find({}, {"filename": 1, "length": 1, "uploadDate": 1, "metadata.saved_at": 1}):
+            yield grid_file["filename"], grid_file["length"], self._written(grid_file)
+
+    def delete(self, key: str) -> bool:
+        deleted = False
+        for grid_file in self.files.find({"filename": key}, {"_id": 1}):
+            self.bucket.delete(grid_file["_id"])
+            deleted = True
+        return deleted
+
+
+_shared_store: Optional[ImageStore] = None
+_shared_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    """Return the process-wide image store for the configured backend"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            if settings.IMAGE_STORE_BACKEND == "gridfs":
+                from database import get_database
+
+                db = get_database().db
+                if db is None:
+                    raise RuntimeError("GridFS image store requires a MongoDB connection")
+                _shared_store = GridFSImageStore(db)
+            else:
+                _shared_store = LocalImageStore()
+        return _shared_store
+
+
+def set_image_store(store: ImageStore):
+    """Make `store` the process-wide image store"""
+    global _shared_store
+    with _shared_lock:
+        _shared_store = store
+
+
+def delete_image(db, image_id: str) -> bool:
+    """Delete an image record and any blobs only it referenced"""
+    record = db.get_image(image_id)
+    if record is None or not db.delete_image_record(image_id):
+        return False
+    release_image(db, record)
+    return True
+
+
+def release_image(db, record: dict, grace_period: float = settings.RECONCILE_GRACE_PERIOD) -> int:
+    """Delete the blobs of a removed record that no other record references.
+
+    Blobs saved or re-saved within `grace_period` are left to the
+    reconciler's orphan pass: a concurrent save of the same bytes (say a
+    result cache hit whose record is still in the write-behind buffer)
+    finds the blob, skips the write and is about to reference it.
+    """
+    store = get_image_store()
+    cutoff = time.time() - grace_period
+    released = 0
+    for key in (record.get("filename"), record.get("thumbnail_filename")):
+        if not key:
+            continue
+        try:
+            saved_at = store.saved_at(key)
+            if saved_at is None or saved_at > cutoff or db.count_references(key) != 0:
+                continue
+            # Re-saved while references were counted
+            if (store.saved_at(key) or 0) > cutoff:
+                continue
+            if store.delete(key):
+                released += 1
+        except Exception as e:
+            logger.error(f"Failed to delete blob {key}: {e}")
+    return released
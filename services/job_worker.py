@@ -0,0 +1,123 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from typing import List, Optional
+
+from config import settings
+from database import Database, get_database
+from services.image_codec import detect_format
+from services.image_generator import ImageGenerator, get_image_generator
+from services.image_store import get_image_store, release_image
+from services.metrics import StageTimer
+from services.thumbnails import save_thumbnail
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorkerPool:
+    """Pool of worker threads that process generation jobs from the MongoDB queue.
+
+    Jobs are `ImageRecord` documents in the `queued` state. Each worker claims
+    one at a time with a lease, generates the image, writes it to
+    the image store and marks the record `completed` or `failed`. Jobs
+    held by a worker that dies are picked up again once the lease expires.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = settings.JOB_WORKERS,
+        db: Optional[Database] = None,
+        image_generator: Optional[ImageGenerator] = None,
+    ):
+        self.num_workers = num_workers
+        self.db = db or get_database()
+        self.image_generator = image_generator or get_image_generator()
+        self.pool_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """Start the worker threads"""
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._run,
+                args=(f"{self.pool_id}-{i}",),
+                name=f"job-worker-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.num_workers} job workers ({self.pool_id})")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Signal workers to stop after their current job and wait for them"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, worker_id: str):
+        while not self._stop.is_set():
+            job = self.db.claim_next_job(worker_id, settings.JOB_LEASE_SECONDS, settings.JOB_MAX_ATTEMPTS)
+            if job is None:
+                self.db.fail_expired_jobs(settings.JOB_MAX_ATTEMPTS)
+                self._stop.wait(settings.JOB_POLL_INTERVAL)
+                continue
+            self.process(job, worker_id)
+
+    def process(self, job: dict, worker_id: str):
+        """Generate and store the image for a claimed job"""
+        start_time = time.time()
+        timer = StageTimer(style=job["expected_style"])
+        queued_at = job.get("queued_at") or job.get("created_at")
+        if job.get("started_at") and queued_at:
+            timer.record("queue_wait", (job["started_at"] - queued_at).total_seconds())
+        tier = job.get("quality_tier") or settings.DEFAULT_QUALITY_TIER
+        try:
+            image_data = self.image_generator.generate_image(
+                job["prompt"], job["expected_style"], timer, tier, user_id=job.get("user_id")
+            )
+            if image_data is None:
+                raise RuntimeError("Provider returned no image")
+            generation_time = time.time() - start_time
+
+            # Content-addressed: identical outputs share one stored blob
+            with timer.span("file_write"):
+                filename = get_image_store().save(image_data, detect_format(image_data)[1])
+            with timer.span("thumbnail"):
+                thumb_name = save_thumbnail(image_data)
+
+            with timer.span("db_insert"):
+                completed = self.db.complete_job(
+                    job["id"], worker_id, generation_time, len(image_data), thumb_name, filename, timer.stages, tier
+                )
+            if completed:
+                self.db.record_timing(job["id"], "db_insert", timer.stages["db_insert"])
+                if job.get("tier_times") and job.get("filename") != filename:
+                    # A refine replaced an earlier image; drop its blobs unless shared
+                    release_image(self.db, job)
+            else:
+                logger.warning(f"Job {job['id']} lease was lost before completion")
+
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {e}")
+            self.db.fail_job(job["id"], worker_id, str(e), settings.JOB_MAX_ATTEMPTS)
+
+
+if __name__ == "__main__":
+    # Standalone worker process: python -m services.job_worker
+    logging.basicConfig(level=logging.INFO)
+    pool = JobWorkerPool()
+    pool.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,150 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds, from disk writes up to slow provider calls
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+
+
+class MetricsExporter:
+    """Receives stage durations; subclasses forward them to a metrics backend"""
+
+    def observe(self, stage: str, seconds: float, labels: Dict[str, str]):
+        pass
+
+    def render(self) -> str:
+        """Text exposition of the collected metrics, if the backend has one"""
+        return ""
+
+
+class PrometheusExporter(MetricsExporter):
+    """Keeps per-stage histograms in memory and renders Prometheus text format"""
+
+    name = "image_generation_stage_seconds"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (stage, style) -> [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, str], list] = {}
+
+    def observe(self, stage: str, seconds: float, labels: Dict[str, str]):
+        key = (stage, labels.get("style", ""))
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(BUCKETS) + [0.0, 0])
+            index = bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} Duration of each image generation stage",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for (stage, style), series in sorted(self._series.items()):
+                labels = f'stage="{stage}",style="{style}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryExporter(MetricsExporter):
+    """Records stage durations on an OpenTelemetry histogram (SDK configured by the deployment)"""
+
+    def __init__(self):
+        from opentelemetry import metrics
+
+        meter = metrics.get_meter("text-to-image-mini-app")
+        self.histogram = meter.create_histogram(
+            "image_generation.stage.duration", unit="s", description="Duration of each image generation stage"
+        )
+
+    def observe(self, stage: str, seconds: float, labels: Dict[str, str]):
+        self.histogram.record(seconds, {"stage": stage, **labels})
+
+
+class StageTimer:
+    """Collects named timing spans for one generation and reports them to the exporter"""
+
+    def __init__(self, **labels: str):
+        self.labels = labels
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        get_metrics().observe(stage, seconds, self.labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = get_metrics().render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporter: Optional[MetricsExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsExporter:
+    """Return the process-wide metrics exporter selected by METRICS_EXPORTER"""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            if settings.METRICS_EXPORTER == "otel":
+                try:
+                    _exporter = OpenTelemetryExporter()
+                except ImportError:
+                    logger.warning("opentelemetry is not installed, metrics are disabled")
+                    _exporter = MetricsExporter()
+            elif settings.METRICS_EXPORTER == "prometheus":
+                _exporter = PrometheusExporter()
+                if settings.METRICS_PORT:
+                    try:
+                        server = ThreadingHTTPServer(("0.0.0.0", settings.METRICS_PORT), _MetricsHandler)
+                        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+                    except OSError as e:
+                        logger.warning(f"Metrics endpoint not started on port {settings.METRICS_PORT}: {e}")
+            else:
+                _exporter = MetricsExporter()
+        return _exporter
+
+
+def percentiles(values, quantiles=(0.5, 0.95, 0.99)) -> Dict[str, float]:
+    """Nearest-rank percentiles of a list of numbers"""
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        f"p{int(q * 100)}": values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+        for q in quantiles
+    }
@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PendingImageStore:
+    """Holds generated images that are waiting for feedback outside session state.
+
+    Sessions keep only the short reference returned by `put`. Images live
+    in `directory` (a local disk or a cache directory shared by the server
+    processes) until feedback is submitted and `discard` is called, or,
+    for abandoned tabs, until they have not been read for `ttl` seconds.
+    Expired images are swept at most every `sweep_interval` seconds, from
+    whichever session writes next.
+    """
+
+    def __init__(
+        self,
+        directory: str = settings.PENDING_IMAGE_DIR,
+        ttl: float = settings.PENDING_IMAGE_TTL,
+        sweep_interval: float = settings.PENDING_SWEEP_INTERVAL,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        self.stored = 0
+        self.discarded = 0
+        self.expired = 0
+
+    def path(self, ref: str) -> str:
+        """Filesystem path of a pending image (st.image can serve it without loading it into the session)"""
+        # References come from session state; never let one escape the directory
+        return os.path.join(self.directory, os.path.basename(ref))
+
+    def put(self, image_data: bytes) -> str:
+        """Store an image and return its reference"""
+        ref = uuid.uuid4().hex
+        path = self.path(ref)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.stored += 1
+        self.sweep()
+        return ref
+
+    def exists(self, ref: Optional[str]) -> bool:
+        return bool(ref) and os.path.exists(self.path(ref))
+
+    def get(self, ref: Optional[str]) -> Optional[bytes]:
+        """Read a pending image, or None if it was discarded or has expired"""
+        if not ref:
+            return None
+        try:
+            with open(self.path(ref), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(ref)
+        return data
+
+    def touch(self, ref: str):
+        """Restart the TTL of an image that is still being looked at"""
+        try:
+            os.utime(self.path(ref))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, ref: Optional[str]):
+        """Remove an image once its feedback flow is finished"""
+        if not ref:
+            return
+        try:
+            os.remove(self.path(ref))
+            with self._lock:
+                self.discarded += 1
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, force: bool = False) -> int:
+        """Delete images not read for `ttl` seconds; returns how many were removed"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_sweep < self.sweep_interval:
+                return 0
+            self._last_sweep = now
+
+        cutoff = time.time() - self.ttl
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        if removed:
+            logger.info(f"Removed {removed} abandoned pending images")
+            with self._lock:
+                self.expired += removed
+        return removed
+
+    def stats(self) -> dict:
+        """Return pending image counters and current disk use"""
+        count, size = 0, 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    count += 1
+                    size += entry.stat().st_size
+        with self._lock:
+            return {
+                "pending": count,
+                "bytes": size,
+                "stored": self.stored,
+                "discarded": self.discarded,
+                "expired": self.expired,
+            }
+
+
+_shared_store: Optional[PendingImageStore] = None
+_shared_lock = threading.Lock()
+
+
+def get_pending_store() -> PendingImageStore:
+    """Return the process-wide pending image store"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = PendingImageStore()
+        return _shared_store
+
+
+def set_pending_store(store: PendingImageStore):
+    """Make `store` the process-wide pending image store"""
+    global _shared_store
+    with _shared_lock:
+        _shared_store = store
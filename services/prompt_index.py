@@ -0,0 +1,202 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+")
+
+
+def normalize_prompt(prompt: str) -> FrozenSet[str]:
+    """Reduce a prompt to its set of words: case, accents, punctuation, spacing and word order are ignored"""
+    text = unicodedata.normalize("NFKD", prompt).encode("ascii", "ignore").decode("ascii").lower()
+    return frozenset(_TOKEN.findall(text))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class PromptIndex:
+    """MinHash/LSH index of stored prompts, partitioned by style.
+
+    Prompts are normalized to word sets; each distinct word set is indexed
+    once, with the ids of the newest few records that used it. A query
+    hashes its word set into `bands` LSH buckets, then checks the exact
+    Jaccard similarity of the candidates it collides with, so lookups cost
+    a handful of dict reads regardless of collection size.
+
+    The index is built from MongoDB on first use and then refreshed
+    incrementally from records created since the last refresh (looking back
+    `lag` seconds so jobs that complete late are still picked up).
+    """
+
+    def __init__(
+        self,
+        db=None,
+        num_perm: int = settings.PROMPT_INDEX_PERMUTATIONS,
+        bands: int = settings.PROMPT_INDEX_BANDS,
+        ids_per_prompt: int = 4,
+        lag: float = settings.PROMPT_INDEX_LAG,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.db = db
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ids_per_prompt = ids_per_prompt
+        self.lag = lag
+
+        # One random 64-bit mask per permutation: h_i(word) = hash(word) XOR mask_i
+        self._masks = [
+            int.from_bytes(hashlib.sha256(b"prompt-index-%d" % i).digest()[:8], "big")
+            for i in range(num_perm)
+        ]
+
+        # (style, word set) -> newest record ids; (style, band, band signature) -> word sets
+        self._entries: Dict[Tuple[str, FrozenSet[str]], deque] = {}
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[FrozenSet[str]]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._built = False
+        self._watermark: Optional[datetime] = None
+        self._last_refresh = 0.0
+
+        self.queries = 0
+        self.offered = 0
+        self.reused = 0
+        self.generated = 0
+
+    def _signature(self, words: FrozenSet[str]) -> List[int]:
+        hashes = [int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "big") for w in words]
+        return [min(h ^ mask for h in hashes) for mask in self._masks]
+
+    def _band_keys(self, style: str, words: FrozenSet[str]):
+        signature = self._signature(words)
+        for band in range(self.bands):
+            yield style, band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, image_id: str, prompt: str, style: str):
+        """Index one record (idempotent)"""
+        words = normalize_prompt(prompt)
+        if not words:
+            return
+        with self._lock:
+            ids = self._entries.get((style, words))
+            if ids is None:
+                ids = self._entries[(style, words)] = deque(maxlen=self.ids_per_prompt)
+                for key in self._band_keys(style, words):
+                    self._buckets.setdefault(key, set()).add(words)
+            if image_id not in ids:
+                ids.appendleft(image_id)
+
+    def refresh(self, force: bool = False):
+        """Load records created since the last refresh (everything on first use).
+
+        Only one refresh runs at a time; concurrent callers return immediately
+        and query what is already indexed.
+        """
+        if self.db is None or self.db.collection is None:
+            return
+        if not force and self._built and time.monotonic() - self._last_refresh < settings.PROMPT_INDEX_REFRESH:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            since = self._watermark - timedelta(seconds=self.lag) if self._watermark else None
+            count = 0
+            for record in self.db.iter_prompts(since):
+                self.add(record["id"], record["prompt"], record["expected_style"])
+                if self._watermark is None or record["created_at"] > self._watermark:
+                    self._watermark = record["created_at"]
+                count += 1
+            if not self._built:
+                logger.info(f"Built prompt index from {count} records")
+            self._built = True
+            self._last_refresh = time.monotonic()
+        except Exception as e:
+            logger.error(f"Failed to refresh prompt index: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def start(self):
+        """Build the index in the background so the first query does not wait for a full scan"""
+        threading.Thread(target=self.refresh, name="prompt-index", daemon=True).start()
+
+    def find(
+        self,
+        prompt: str,
+        style: str,
+        threshold: float = settings.PROMPT_REUSE_THRESHOLD,
+        limit: int = 4,
+    ) -> List[Tuple[float, str]]:
+        """(similarity, record id) of stored prompts in the same style, most similar first"""
+        if self._built:
+            self.refresh()
+        elif not self._refresh_lock.locked():
+            # The initial build failed (e.g. MongoDB was down); retry it without blocking
+            self.start()
+        words = normalize_prompt(prompt)
+        if not words:
+            return []
+        with self._lock:
+            self.queries += 1
+            candidates = set()
+            for key in self._band_keys(style, words):
+                candidates.update(self._buckets.get(key, ()))
+
+            matches = []
+            for candidate in candidates:
+                similarity = jaccard(words, candidate)
+                if similarity >= threshold:
+                    matches.extend((similarity, image_id) for image_id in self._entries[(style, candidate)])
+        matches.sort(key=lambda match: -match[0])
+        return matches[:limit]
+
+    def record_offer(self, reused: bool):
+        """Count the outcome of offering existing images for a prompt"""
+        with self._lock:
+            self.offered += 1
+            if reused:
+                self.reused += 1
+            else:
+                self.generated += 1
+
+    def stats(self) -> dict:
+        """Return index size and reuse counters"""
+        with self._lock:
+            return {
+                "prompts": len(self._entries),
+                "queries": self.queries,
+                "offered": self.offered,
+                "reused": self.reused,
+                "generated": self.generated,
+                "reuse_rate": self.reused / self.offered if self.offered else 0.0,
+            }
+
+
+_shared_index: Optional[PromptIndex] = None
+_shared_lock = threading.Lock()
+
+
+def get_prompt_index() -> Optional[PromptIndex]:
+    """Return the process-wide prompt index, or None when reuse suggestions are disabled"""
+    global _shared_index
+    if not settings.PROMPT_REUSE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_index is None:
+            from database import get_database
+
+            _shared_index = PromptIndex(get_database())
+            _shared_index.start()
+        return _shared_index
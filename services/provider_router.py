@@ -0,0 +1,225 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Stops traffic to an endpoint after repeated failures, then probes it again after a cooldown"""
+
+    def __init__(
+        self,
+        failure_threshold: int = settings.ROUTER_FAILURE_THRESHOLD,
+        error_rate: float = settings.ROUTER_ERROR_RATE,
+        cooldown: float = settings.ROUTER_COOLDOWN,
+        window: int = settings.ROUTER_WINDOW,
+    ):
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent now; in half-open state only one trial request is allowed"""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release(self):
+        """Give back a half-open trial that was granted but never used"""
+        self._trial_in_flight = False
+
+    def record(self, success: bool):
+        self.outcomes.append(success)
+        if success:
+            self.consecutive_failures = 0
+            if self.state == "half_open":
+                logger.info("Circuit closed after successful trial request")
+            self.state = "closed"
+            return
+
+        self.consecutive_failures += 1
+        failures = self.outcomes.count(False)
+        rate_tripped = len(self.outcomes) >= self.outcomes.maxlen // 2 and failures / len(self.outcomes) > self.error_rate
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold or rate_tripped:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class Endpoint:
+    """One provider/model pair with rolling latency and error statistics"""
+
+    def __init__(self, provider: str, model: str, client, window: int = settings.ROUTER_WINDOW):
+        self.provider = provider
+        self.model = model
+        self.client = client
+        self.name = f"{provider}:{model}"
+        self.breaker = CircuitBreaker(window=window)
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0
+
+    def latency_estimate(self) -> float:
+        """Median of recent successful latencies; untried endpoints rank first so they get measured"""
+        if not self.latencies:
+            return 0.0
+        return sorted(self.latencies)[len(self.latencies) // 2]
+
+    def error_rate(self) -> float:
+        outcomes = self.breaker.outcomes
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+
+class ProviderRouter:
+    """Routes text_to_image calls across several endpoints.
+
+    Implements the subset of InferenceClient used by ImageGenerator, so it can
+    be passed as its client. Each request goes to the healthy endpoint with
+    the lowest rolling median latency; if it has not answered after
+    `hedge_delay` seconds a second request is sent to the next endpoint and
+    the first successful response wins. Failures fail over immediately.
+
+    The caller's admission covers the first request only; each hedge needs a
+    free token from `admission` and is skipped while none is available.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        hedge_delay: float = settings.ROUTER_HEDGE_DELAY,
+        max_hedges: int = settings.ROUTER_MAX_HEDGES,
+        admission=None,
+    ):
+        self.endpoints = endpoints
+        self.admission = admission
+        self.hedge_delay = hedge_delay
+        self.max_hedges = max_hedges
+        self.hedged_requests = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(4, settings.GENERATION_CONCURRENCY * (1 + max_hedges) * 2),
+            thread_name_prefix="provider",
+        )
+
+    def _ranked(self) -> List[Endpoint]:
+        """Healthy endpoints, fastest first"""
+        with self._lock:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.breaker.allow_request()]
+        return sorted(healthy, key=lambda endpoint: (endpoint.latency_estimate(), endpoint.error_rate()))
+
+    def _call(self, endpoint: Endpoint, prompt: str, kwargs: dict):
+        start = time.monotonic()
+        try:
+            image = endpoint.client.text_to_image(prompt, model=endpoint.model, **kwargs)
+        except Exception:
+            with self._lock:
+                endpoint.requests += 1
+                endpoint.failures += 1
+                endpoint.breaker.record(False)
+            raise
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.latencies.append(time.monotonic() - start)
+            endpoint.breaker.record(True)
+        return image
+
+    def text_to_image(self, prompt: str, model: Optional[str] = None, **kwargs):
+        """Generate an image on the best endpoint, hedging and failing over as needed"""
+        candidates = self._ranked()
+        if not candidates:
+            raise RuntimeError("No healthy provider endpoints (all circuits open)")
+
+        pending = {}
+        launched = 0
+        hedges = 0
+        last_error: Optional[Exception] = None
+
+        def launch():
+            nonlocal launched
+            endpoint = candidates[launched]
+            launched += 1
+            pending[self._executor.submit(self._call, endpoint, prompt, kwargs)] = endpoint
+
+        try:
+            launch()
+            while pending:
+                can_hedge = self.hedge_delay > 0 and hedges < self.max_hedges and launched < len(candidates)
+                done, _ = wait(pending, timeout=self.hedge_delay if can_hedge else None, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    if self.admission is not None and not self.admission.try_acquire():
+                        # Hedging would exceed the provider quota; keep waiting and retry after another delay
+                        continue
+                    # Primary is slow: hedge on the next fastest endpoint
+                    hedges += 1
+                    with self._lock:
+                        self.hedged_requests += 1
+                    launch()
+                    continue
+
+                for future in done:
+                    endpoint = pending.pop(future)
+                    try:
+                        image = future.result()
+                    except Exception as e:
+                        logger.warning(f"Provider {endpoint.name} failed: {e}")
+                        last_error = e
+                        continue
+                    with self._lock:
+                        endpoint.wins += 1
+                    # Slower in-flight requests finish in the background and only update statistics
+                    return image
+
+                if launched < len(candidates):
+                    launch()
+
+            raise last_error or RuntimeError("All provider endpoints failed")
+        finally:
+            with self._lock:
+                for endpoint in candidates[launched:]:
+                    endpoint.breaker.release()
+
+    def stats(self) -> List[dict]:
+        """Per-endpoint routing statistics"""
+        with self._lock:
+            return [
+                {
+                    "endpoint": endpoint.name,
+                    "state": endpoint.breaker.state,
+                    "p50_latency": endpoint.latency_estimate(),
+                    "error_rate": endpoint.error_rate(),
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                    "wins": endpoint.wins,
+                }
+                for endpoint in self.endpoints
+            ]
+
+
+def parse_endpoints(spec: str) -> List[tuple]:
+    """Parse "provider:model,provider:model" into (provider, model) pairs"""
+    pairs = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        provider, _, model = item.partition(":")
+        pairs.append((provider.strip(), model.strip()))
+    return pairs
@@ -0,0 +1,85 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+from config import settings
+
+
+class QueryCache:
+    """TTL cache for Database read results, shared by every session in the process.
+
+    Entries expire after `ttl` seconds and the whole cache is dropped on every
+    write through `Database`. Each invalidation bumps a generation number, so
+    a read that started before a write cannot store its (possibly stale)
+    result afterwards. Writes made by other processes are only picked up
+    when entries expire. Cached values are shared and must not be mutated.
+    """
+
+    def __init__(self, ttl: float = settings.QUERY_CACHE_TTL, max_entries: int = settings.QUERY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (found, value) for a key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any, generation: int):
+        """Store a value read during `generation`, unless a write has happened since"""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drop every entry after a write"""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Return hit/miss/invalidation counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+_shared_cache: Optional[QueryCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    """Return the process-wide query cache, or None when it is disabled"""
+    global _shared_cache
+    if not settings.QUERY_CACHE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = QueryCache()
+        return _shared_cache
@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from config import settings
+from database import EVICTION_SORTS, get_database
+from services.image_store import ImageStore, get_image_store
+from services.thumbnails import save_thumbnail
+
+logger = logging.getLogger(__name__)
+
+REPORT_NAME = "reconcile"
+
+
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class StorageReconciler:
+    """Keeps the image store and the image collection consistent, within a disk quota.
+
+    A run makes three streaming passes, each in batches of `batch_size`, so
+    memory does not grow with the number of files or records:
+
+    1. Orphans: blobs no record points at are deleted once they are older
+       than `grace_period` (files are written before their records, and the
+       write-behind buffer may still hold the record).
+    2. Missing files: records whose image file is gone are marked
+       `file_state="missing"` so the Gallery skips them without checking the
+       store; dangling thumbnail keys are cleared.
+    3. Quota: while the store is over `quota_bytes`, full-size images are
+       evicted in `policy` order. Records are marked `file_state="evicted"`
+       and keep their thumbnail (created first if missing) and metadata.
+
+    Every step is idempotent, so overlapping runs from several processes are
+    harmless.
+    """
+
+    def __init__(
+        self,
+        db=None,
+        store: Optional[ImageStore] = None,
+        batch_size: int = settings.RECONCILE_BATCH_SIZE,
+        grace_period: float = settings.RECONCILE_GRACE_PERIOD,
+        quota_bytes: int = settings.STORAGE_QUOTA_BYTES,
+        policy: str = settings.EVICTION_POLICY,
+    ):
+        if policy not in EVICTION_SORTS:
+            raise ValueError(f"Unknown eviction policy {policy!r}, expected one of {', '.join(EVICTION_SORTS)}")
+        self.db = db or get_database()
+        self.store = store or get_image_store()
+        self.batch_size = batch_size
+        self.grace_period = grace_period
+        self.quota_bytes = quota_bytes
+        self.policy = policy
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._run_lock = threading.Lock()
+
+    def run(self, dry_run: bool = False) -> dict:
+        """Reconcile once and return (and store) a report of what was, or would be, changed"""
+        with self._run_lock:
+            started = time.monotonic()
+            report = {
+                "started_at": datetime.now(),
+                "dry_run": dry_run,
+                "blobs_scanned": 0,
+                "stored_bytes": 0,
+                "orphans_deleted": 0,
+                "orphan_bytes": 0,
+                "records_scanned": 0,
+                "marked_missing": 0,
+                "restored": 0,
+                "thumbnails_cleared": 0,
+                "evicted": 0,
+                "evicted_bytes": 0,
+                "quota_bytes": self.quota_bytes,
+                "policy": self.policy,
+            }
+            self._collect_orphans(report, dry_run)
+            self._mark_missing(report, dry_run)
+            self._enforce_quota(report, dry_run)
+            report["reclaimed_bytes"] = report["orphan_bytes"] + report["evicted_bytes"]
+            report["duration"] = time.monotonic() - started
+
+            logger.info(
+                f"Storage reconciliation{' (dry run)' if dry_run else ''}: "
+                f"reclaimed {report['reclaimed_bytes']/1024/1024:.1f} MB "
+                f"({report['orphans_deleted']} orphans, {report['evicted']} evicted), "
+                f"{report['marked_missing']} records marked missing"
+            )
+            if not dry_run:
+                self.db.save_maintenance_report(REPORT_NAME, report)
+            return report
+
+    def _collect_orphans(self, report: dict, dry_run: bool):
+        # Spilled write-behind batches hold records whose blobs are not referenced in MongoDB yet
+        spill_dir = settings.WRITE_SPILL_DIR
+        pending_spill = os.path.isdir(spill_dir) and any(name.endswith(".jsonl") for name in os.listdir(spill_dir))
+        if pending_spill:
+            logger.warning("Skipping orphan cleanup while spilled image records await replay")
+        cutoff = time.time() - self.grace_period
+
+        for batch in _batches(self.store.iter_blobs(), self.batch_size):
+            report["blobs_scanned"] += len(batch)
+            referenced = None if pending_spill else self.db.referenced_keys(key for key, _, _ in batch)
+            for key, size, written_at in batch:
+                if referenced is None or key in referenced or written_at > cutoff:
+                    report["stored_bytes"] += size
+                    continue
+                if not dry_run:
+                    try:
+                        self.store.delete(key)
+                    except Exception as e:
+                        logger.error(f"Failed to delete orphaned blob {key}: {e}")
+                        report["stored_bytes"] += size
+                        continue
+                report["orphans_deleted"] += 1
+                report["orphan_bytes"] += size
+
+    def _mark_missing(self, report: dict, dry_run: bool):
+        for batch in _batches(self.db.iter_storage_records(self.batch_size), self.batch_size):
+            report["records_scanned"] += len(batch)
+            existing = self.store.existing_keys(
+                {record["filename"] for record in batch}
+                | {record["thumbnail_filename"] for record in batch if record.get("thumbnail_filename")}
+            )
+
+            changes = {None: [], "missing": [], "evicted": []}
+            for record in batch:
+                thumb_key = record.get("thumbnail_filename")
+                if thumb_key and thumb_key not in existing:
+                    report["thumbnails_cleared"] += 1
+                    thumb_key = None
+                    if not dry_run:
+                        self.db.update_storage_keys(record["id"], {"thumbnail_filename": None})
+
+                state = record.get("file_state")
+                if record["filename"] in existing:
+                    # Also restores evicted records whose identical image has been generated again
+                    new_state = None
+                elif state == "evicted" and thumb_key:
+                    new_state = "evicted"
+                else:
+                    new_state = "missing"
+                if new_state != state:
+                    changes[new_state].append(record["id"])
+
+            report["marked_missing"] += len(changes["missing"])
+            report["restored"] += len(changes[None])
+            if not dry_run:
+                for state, image_ids in changes.items():
+                    self.db.set_file_state(image_ids, state)
+
+    def _enforce_quota(self, report: dict, dry_run: bool):
+        excess = report["stored_bytes"] - self.quota_bytes
+        if not self.quota_bytes or excess <= 0:
+            return
+
+        cutoff = datetime.now() - timedelta(seconds=self.grace_period)
+        saved_cutoff = time.time() - self.grace_period
+        evicted_keys = set()
+        for record in self.db.iter_eviction_candidates(self.policy, cutoff):
+            if excess <= 0:
+                break
+            key = record["filename"]
+            if key in evicted_keys:
+                continue
+            size = self.store.size(key)
+            if size is None:
+                continue
+            if self._saved_since(key, saved_cutoff):
+                # Re-saved by a newer record (content dedup) that is about to be viewed
+                continue
+
+            if not dry_run:
+                if not record.get("thumbnail_filename"):
+                    # Evicted records are shown by their thumbnail, so make sure they have one
+                    thumb_key = save_thumbnail(self.store.load(key))
+                    if not thumb_key or not self.db.set_thumbnail(record["id"], thumb_key):
+                        continue
+                    excess += self.store.size(thumb_key) or 0
+                # Mark first so no record ever points at a deleted file as if it were stored
+                image_ids = self.db.evict_file(key)
+                if not image_ids:
+                    continue
+                if self._saved_since(key, saved_cutoff):
+                    # A save reused the blob while it was being marked: keep it and undo the marking
+                    self.db.set_file_state(image_ids, None)
+                    continue
+                self.store.delete(key)
+
+            evicted_keys.add(key)
+            excess -= size
+            report["evicted"] += 1
+            report["evicted_bytes"] += size
+        report["stored_bytes"] -= report["evicted_bytes"]
+
+    def _saved_since(self, key: str, cutoff: float) -> bool:
+        saved_at = self.store.saved_at(key)
+        return saved_at is not None and saved_at > cutoff
+
+    def start(self, interval: float = settings.RECONCILE_INTERVAL):
+        """Run every `interval` seconds in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="storage-reconcile", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"Storage reconciliation failed: {e}")
@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Content-addressed cache for generated images.
+
+    Results are kept in a small in-memory LRU tier backed by a size-bounded
+    on-disk tier. Keys are derived from everything that determines the
+    provider output, so a hit can be returned without calling the provider.
+    """
+
+    def __init__(
+        self,
+        memory_items: int = settings.RESULT_CACHE_MEMORY_ITEMS,
+        disk_dir: str = settings.RESULT_CACHE_DIR,
+        disk_max_bytes: int = settings.RESULT_CACHE_DISK_MAX_BYTES,
+    ):
+        self.memory_items = memory_items
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if self.disk_dir and self.disk_max_bytes > 0:
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(model: str, provider: str, enhanced_prompt: str, params: Optional[dict] = None) -> str:
+        """Build a stable cache key for a generation request"""
+        payload = json.dumps(
+            {
+                "model": model,
+                "provider": provider,
+                "prompt": enhanced_prompt,
+                "params": params or {},
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.bin")
+
+    def _load_disk_index(self):
+        """Rebuild the disk index from files left by previous runs, oldest first"""
+        entries = []
+        if os.path.isdir(self.disk_dir):
+            for shard in os.scandir(self.disk_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and entry.name.endswith(".bin"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached bytes for a key, or None on a miss"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+
+            if key in self._disk:
+                try:
+                    path = self._disk_path(key)
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    os.utime(path)
+                except OSError as e:
+                    logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+                    self._disk_bytes -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    self._put_memory(key, data)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return data
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        """Store bytes in both tiers"""
+        if not data:
+            return
+        with self._lock:
+            self._put_memory(key, data)
+            self._put_disk(key, data)
+
+    def _put_memory(self, key: str, data: bytes):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _put_disk(self, key: str, data: bytes):
+        if not self.disk_dir or self.disk_max_bytes <= 0 or len(data) > self.disk_max_bytes:
+            return
+        if key in self._disk:
+            self._disk.move_to_end(key)
+            return
+
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+            return
+
+        self._disk[key] = len(data)
+        self._disk_bytes += len(data)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._disk):
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+            self._disk.clear()
+            self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss/eviction counters and tier sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "memory_items": len(self._memory),
+                "disk_items": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+_shared_cache: Optional[ResultCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Return the process-wide result cache, or None when caching is disabled"""
+    global _shared_cache
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ResultCache()
+        return _shared_cache
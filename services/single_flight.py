@@ -0,0 +1,84 @@
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import settings
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for it and receive the same result (or exception).
+    Nothing is remembered once the call finishes, that is the result
+    cache's job.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn once per in-flight key; returns (result, shared) where shared means another caller ran it"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        """Return execution/coalescing counters"""
+        with self._lock:
+            requests = self.executions + self.coalesced
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+                "coalesced_rate": self.coalesced / requests if requests else 0.0,
+            }
+
+
+_shared_flight: Optional[SingleFlight] = None
+_shared_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """Return the process-wide single-flight group, or None when coalescing is disabled"""
+    global _shared_flight
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_flight is None:
+            _shared_flight = SingleFlight()
+        return _shared_flight
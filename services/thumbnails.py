@@ -0,0 +1,31 @@
+import logging
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+from config import settings
+from services.image_store import get_image_store
+
+logger = logging.getLogger(__name__)
+
+
+def make_thumbnail(image_data: bytes) -> bytes:
+    """Downscale encoded image bytes to a small WebP thumbnail"""
+    with Image.open(BytesIO(image_data)) as image:
+        image.draft("RGB", (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+        image.thumbnail((settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        buffer = BytesIO()
+        image.save(buffer, format="WEBP", quality=settings.THUMBNAIL_QUALITY, method=4)
+        return buffer.getvalue()
+
+
+def save_thumbnail(image_data: bytes) -> Optional[str]:
+    """Store the thumbnail for an image and return its storage key"""
+    try:
+        return get_image_store().save(make_thumbnail(image_data), "webp")
+    except Exception as e:
+        logger.error(f"Failed to create thumbnail: {e}")
+        return None
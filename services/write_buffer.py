@@ -0,0 +1,251 @@
+import os
+import time
+import uuid
+import atexit
+import logging
+import threading
+from typing import List, Optional
+
+from bson import json_util
+
+from config import settings
+from database import Database, get_database
+from models import ImageRecord
+from services.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Collects image records and writes them to MongoDB in batches.
+
+    `submit` only appends to an in-memory buffer, so callers do not wait on
+    MongoDB. A background thread flushes with `insert_many` once
+    `batch_size` records are waiting or every `flush_interval` seconds,
+    retrying with exponential backoff. Batches that still fail are spilled
+    to `spill_dir` as JSON lines and replayed once writes succeed again, so
+    a short outage delays records instead of dropping them. Spill files
+    that cannot be read are renamed to `.bad` and left for inspection.
+    """
+
+    def __init__(
+        self,
+        db: Optional[Database] = None,
+        batch_size: int = settings.WRITE_BATCH_SIZE,
+        flush_interval: float = settings.WRITE_FLUSH_INTERVAL,
+        max_pending: int = settings.WRITE_BUFFER_MAX,
+        retry_attempts: int = settings.WRITE_RETRY_ATTEMPTS,
+        retry_max_delay: float = settings.WRITE_RETRY_MAX_DELAY,
+        spill_dir: str = settings.WRITE_SPILL_DIR,
+    ):
+        self.db = db or get_database()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_attempts = retry_attempts
+        self.retry_max_delay = retry_max_delay
+        self.spill_dir = spill_dir
+
+        self._pending: List[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.spilled = 0
+        self.replayed = 0
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, image_record: ImageRecord) -> bool:
+        """Queue a record for writing; returns immediately"""
+        record = image_record.model_dump()
+        record["_submitted_at"] = time.monotonic()
+        with self._lock:
+            self.submitted += 1
+            if len(self._pending) >= self.max_pending:
+                overflow = True
+            else:
+                self._pending.append(record)
+                overflow = False
+                if len(self._pending) >= self.batch_size:
+                    self._wakeup.set()
+        if overflow:
+            # Bounded memory: a full buffer means MongoDB is not keeping up, go straight to disk
+            try:
+                self._spill([self._strip(record)])
+            except OSError as e:
+                logger.error(f"Dropped image record {record['id']}: buffer full and spilling failed: {e}")
+                return False
+        return True
+
+    def flush(self) -> bool:
+        """Write everything buffered now; returns False if some records were spilled instead"""
+        ok = True
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:self.batch_size]
+                    del self._pending[:self.batch_size]
+                if not batch:
+                    break
+                if not self._write(batch):
+                    ok = False
+        return ok
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop the flush thread and write (or spill) whatever is still buffered"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                if self.flush():
+                    self._replay_spilled()
+            except Exception as e:
+                # Keep the thread alive; the next cycle retries
+                logger.exception(f"Write-behind flush failed: {e}")
+
+    @staticmethod
+    def _strip(record: dict) -> dict:
+        record.pop("_submitted_at", None)
+        return record
+
+    def _write(self, batch: List[dict]) -> bool:
+        """Insert one batch, retrying with bounded exponential backoff, spilling it on failure"""
+        flush_started = time.monotonic()
+        for record in batch:
+            # Time the record spent buffered before its write started
+            submitted_at = record.pop("_submitted_at", None)
+            if submitted_at is not None:
+                record["timings"] = {**(record["timings"] or {}), "db_write_queue": flush_started - submitted_at}
+
+        if self._insert_with_retry(batch):
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+            get_metrics().observe("db_insert_batch", time.monotonic() - flush_started, {})
+            return True
+
+        try:
+            self._spill(batch)
+        except OSError as e:
+            # Nowhere to put them (e.g. the disk is full): keep them buffered for the next cycle
+            logger.error(f"Could not spill {len(batch)} image records, keeping them in memory: {e}")
+            with self._lock:
+                self._pending[:0] = batch
+        return False
+
+    def _unwritten(self, batch: List[dict]) -> List[dict]:
+        """Drop records an earlier attempt already wrote.
+
+        save_image_records skips duplicates through the unique id index, which
+        does not exist when ENSURE_INDEXES is off.
+        """
+        written = self.db.existing_ids([record["id"] for record in batch])
+        return [record for record in batch if record["id"] not in written]
+
+    def _insert_with_retry(self, batch: List[dict]) -> bool:
+        delay = 0.1
+        for attempt in range(self.retry_attempts):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+                # Reconnect if the outage took the connection down
+                self.db.check_health()
+                batch = self._unwritten(batch)
+            if self.db.save_image_records(batch):
+                return True
+        return False
+
+    def _spill(self, batch: List[dict]):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{time.time():.6f}-{uuid.uuid4().hex[:8]}.jsonl")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            for record in batch:
+                f.write(json_util.dumps(record) + "\n")
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.spilled += len(batch)
+        logger.warning(f"Spilled {len(batch)} image records to {path}")
+
+    def spill_files(self) -> List[str]:
+        """Spilled batches waiting to be replayed, oldest first"""
+        if not os.path.isdir(self.spill_dir):
+            return []
+        return sorted(
+            os.path.join(self.spill_dir, name)
+            for name in os.listdir(self.spill_dir)
+            if name.endswith(".jsonl")
+        )
+
+    def _replay_spilled(self):
+        """Write spilled batches back to MongoDB, one file per flush cycle"""
+        for path in self.spill_files()[:1]:
+            try:
+                with open(path) as f:
+                    batch = [json_util.loads(line) for line in f if line.strip()]
+            except (OSError, ValueError) as e:
+                # Retrying would fail the same way on every cycle and every restart
+                logger.error(f"Moving unreadable spill file {path} aside: {e}")
+                os.replace(path, f"{path}.bad")
+                return
+            if not self.db.save_image_records(self._unwritten(batch)):
+                return
+            os.remove(path)
+            with self._lock:
+                self.replayed += len(batch)
+                self.written += len(batch)
+            logger.info(f"Replayed {len(batch)} spilled image records from {path}")
+
+    def stats(self) -> dict:
+        """Return buffer counters"""
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "submitted": self.submitted,
+                "written": self.written,
+                "batches": self.batches,
+                "retries": self.retries,
+                "spilled": self.spilled,
+                "replayed": self.replayed,
+                "spill_files": len(self.spill_files()),
+            }
+
+
+_shared_buffer: Optional[WriteBehindBuffer] = None
+_shared_lock = threading.Lock()
+
+
+def get_write_buffer() -> Optional[WriteBehindBuffer]:
+    """Return the process-wide, started write-behind buffer, or None when it is disabled"""
+    global _shared_buffer
+    if not settings.WRITE_BEHIND_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_buffer is None:
+            _shared_buffer = WriteBehindBuffer()
+            _shared_buffer.start()
+        return _shared_buffer